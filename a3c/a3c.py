@@ -9,11 +9,23 @@ import tensorflow as tf
 import numpy as np
 from time import time, sleep, gmtime, strftime
 import gym
-import queue
-from custom_gym import CustomGym
+from custom_gym import CustomGym, VecCustomGym
 from custom_gym_classic_control import CustomGymClassicControl
 import random
+from step_counter import StepCounter
+from env_pool import EnvPool
+from phase_timer import PhaseTimers
 from agent import Agent
+from shared_params import store_from_agent
+from inference_server import InferenceServer
+from optimizers import make_optimizer, make_update_lock, OPTIMIZERS, \
+UPDATE_MODES
+from snapshot import snapshot_path, publish_snapshot, snapshot_sequence, \
+load_snapshot
+from checkpoint import CheckpointWriter, checkpoint_path, load_checkpoint, \
+restore_session
+from metrics import SummaryWriter
+from returns import discounted_returns
 
 random.seed(100)
 
@@ -27,50 +39,69 @@ TESTING = False
 
 I_ASYNC_UPDATE = 5
 
+# If INFERENCE_BATCH_SIZE > 0, the workers get their policies from a central
+# inference server, which batches up to INFERENCE_BATCH_SIZE states, waiting at
+# most INFERENCE_TIMEOUT seconds for them to arrive.
+INFERENCE_BATCH_SIZE = 0
+INFERENCE_TIMEOUT = 0.005
+
+# The number of threads the evaluation process may use for tensorflow, and how
+# many seconds to wait for it to evaluate the final weights.
+EVALUATION_THREADS = 1
+EVALUATION_TIMEOUT = 600
+
+# Keep the CHECKPOINTS_TO_KEEP most recent checkpoints, plus one for good every
+# KEEP_CHECKPOINT_EVERY_SECONDS seconds (or never, if None).
+CHECKPOINTS_TO_KEEP = 2
+KEEP_CHECKPOINT_EVERY_SECONDS = None
+
+# The optimizer the workers share ('adam' or 'rmsprop'), and how their updates
+# are serialised ('locked', 'striped' or 'hogwild'). See optimizers.py.
+OPTIMIZER = 'adam'
+UPDATE_MODE = 'hogwild'
+
 FLAGS = {'T_MAX': T_MAX, 'NUM_THREADS': NUM_THREADS, 'INITIAL_LEARNING_RATE':
 INITIAL_LEARNING_RATE, 'DISCOUNT_FACTOR': DISCOUNT_FACTOR, 'VERBOSE_EVERY':
-VERBOSE_EVERY, 'TESTING': TESTING, 'I_ASYNC_UPDATE': I_ASYNC_UPDATE}
+VERBOSE_EVERY, 'TESTING': TESTING, 'I_ASYNC_UPDATE': I_ASYNC_UPDATE,
+'INFERENCE_BATCH_SIZE': INFERENCE_BATCH_SIZE, 'INFERENCE_TIMEOUT':
+INFERENCE_TIMEOUT, 'EVALUATION_THREADS': EVALUATION_THREADS,
+'EVALUATION_TIMEOUT': EVALUATION_TIMEOUT, 'CHECKPOINTS_TO_KEEP':
+CHECKPOINTS_TO_KEEP, 'KEEP_CHECKPOINT_EVERY_SECONDS':
+KEEP_CHECKPOINT_EVERY_SECONDS, 'OPTIMIZER': OPTIMIZER, 'UPDATE_MODE':
+UPDATE_MODE}
 
 training_finished = False
 
-class Summary:
-    def __init__(self, logdir, agent):
-        with tf.variable_scope('summary'):
-            summarising = ['episode_avg_reward', 'avg_value']
-            self.agent = agent
-            self.writer = tf.summary.FileWriter(logdir, self.agent.sess.graph)
-            self.summary_ops = {}
-            self.summary_vars = {}
-            self.summary_ph = {}
-            for s in summarising:
-                self.summary_vars[s] = tf.Variable(0.0)
-                self.summary_ph[s] = tf.placeholder('float32', name=s)
-                self.summary_ops[s] = tf.summary.scalar(s, self.summary_vars[s])
-            self.update_ops = []
-            for k in self.summary_vars:
-                self.update_ops.append(self.summary_vars[k].assign(self.summary_ph[k]))
-            self.summary_op = tf.summary.merge(list(self.summary_ops.values()))
-
-    def write_summary(self, summary, t):
-        self.agent.sess.run(self.update_ops, {self.summary_ph[k]: v for k, v in summary.items()})
-        summary_to_add = self.agent.sess.run(self.summary_op, {self.summary_vars[k]: v for k, v in summary.items()})
-        self.writer.add_summary(summary_to_add, global_step=t)
-
-def async_trainer(agent, env, sess, thread_idx, T_queue, summary, saver,
-    save_path):
+# If store is given, the worker copies the shared weights from the store at the
+# start of each rollout and applies its gradients to the store, rather than
+# training the agent's own weights.
+# If server is given, the worker gets its policies and values from the
+# inference server rather than running the agent itself.
+# The time spent in each phase of the step is recorded in timers, which are
+# PhaseTimers.
+def async_trainer(agent, env, sess, thread_idx, step_counter, timers,
+    summary, checkpointer, save_path, store=None, server=None):
     print('Training thread', thread_idx)
-    T = T_queue.get()
-    T_queue.put(T+1)
+    predictor = agent if server is None else server.client()
+    worker_counter = step_counter.worker(thread_idx)
+    timer = timers.worker(thread_idx)
+    # The env's total time spent preprocessing, if it keeps one.
+    preprocess_seconds = getattr(env, 'preprocess_seconds', 0.0)
+    T = worker_counter.T
     t = 0
 
     last_verbose = T
     last_time = time()
     last_target_update = T
 
+    # The env returns a view of its frame stack that changes every step, so we
+    # copy each state into a preallocated batch as we go.
+    batch_states = None
+
     terminal = True
+    timer.start()
     while T < T_MAX:
         t_start = t
-        batch_states = []
         batch_rewards = []
         batch_actions = []
         baseline_values = []
@@ -78,24 +109,40 @@ def async_trainer(agent, env, sess, thread_idx, T_queue, summary, saver,
         if terminal:
             terminal = False
             state = env.reset()
+            last_preprocess_seconds = preprocess_seconds
+            preprocess_seconds = getattr(env, 'preprocess_seconds', 0.0)
+            timer.lap('env', 'preprocess',
+            preprocess_seconds - last_preprocess_seconds)
+
+        if store is not None:
+            agent.set_weights(store.get_weights())
+            timer.lap('gradients')
 
-        while not terminal and len(batch_states) < I_ASYNC_UPDATE:
+        while not terminal and len(batch_rewards) < I_ASYNC_UPDATE:
             # Save the current state
-            batch_states.append(state)
+            if batch_states is None:
+                batch_states = np.empty((I_ASYNC_UPDATE,) + state.shape[1:],
+                dtype=state.dtype)
+            batch_states[len(batch_rewards)] = state[0]
 
             # Choose an action randomly according to the policy
             # probabilities. We do this anyway to prevent us having to compute
-            # the baseline value separately.
-            policy, value = agent.get_policy_and_value(state)
-            action_idx = np.random.choice(agent.action_size, p=policy)
+            # the baseline value separately. The action is sampled in the graph.
+            actions, values = predictor.act(state)
+            action_idx = actions[0]
+            timer.lap('inference')
 
             # Take the action and get the next state, reward and terminal.
             state, reward, terminal, _ = env.step(action_idx)
+            last_preprocess_seconds = preprocess_seconds
+            preprocess_seconds = getattr(env, 'preprocess_seconds', 0.0)
+            timer.lap('env', 'preprocess',
+            preprocess_seconds - last_preprocess_seconds)
 
             # Update counters
             t += 1
-            T = T_queue.get()
-            T_queue.put(T+1)
+            T = worker_counter.increment()
+            timer.lap('counter')
 
             # Clip the reward to be between -1 and 1
             reward = np.clip(reward, -1, 1)
@@ -103,23 +150,20 @@ def async_trainer(agent, env, sess, thread_idx, T_queue, summary, saver,
             # Save the rewards and actions
             batch_rewards.append(reward)
             batch_actions.append(action_idx)
-            baseline_values.append(value[0])
+            baseline_values.append(values[0])
 
         target_value = 0
         # If the last state was terminal, just put R = 0. Else we want the
         # estimated value of the last state.
         if not terminal:
-            target_value = agent.get_value(state)[0]
+            target_value = predictor.get_value(state)[0]
+            timer.lap('inference')
         last_R = target_value
 
-        # Compute the sampled n-step discounted reward
-        batch_target_values = []
-        for reward in reversed(batch_rewards):
-            target_value = reward + DISCOUNT_FACTOR * target_value
-            batch_target_values.append(target_value)
-        # Reverse the batch target values, so they are in the correct order
-        # again.
-        batch_target_values.reverse()
+        # Compute the sampled n-step discounted reward. A rollout this short
+        # takes the python loop rather than the scan.
+        batch_target_values = discounted_returns(batch_rewards, DISCOUNT_FACTOR,
+        bootstrap=target_value)
 
         # Test batch targets
         if TESTING:
@@ -137,10 +181,20 @@ def async_trainer(agent, env, sess, thread_idx, T_queue, summary, saver,
 
         # Compute the estimated value of each state
         batch_advantages = np.array(batch_target_values) - np.array(baseline_values)
+        timer.lap('returns')
 
         # Apply asynchronous gradient update
-        agent.train(np.vstack(batch_states), batch_actions, batch_target_values,
-        batch_advantages)
+        if store is not None:
+            grads = agent.compute_gradients(batch_states[:len(batch_rewards)],
+            batch_actions, batch_target_values, batch_advantages)
+            store.apply_gradients(grads)
+        else:
+            agent.train(batch_states[:len(batch_rewards)], batch_actions,
+            batch_target_values, batch_advantages)
+        timer.lap('gradients')
+
+    # Make sure the evaluator sees all of our steps.
+    worker_counter.publish()
 
     global training_finished
     training_finished = True
@@ -154,11 +208,10 @@ def estimate_reward(agent, env, episodes=10, max_steps=10000):
         state = env.reset()
         terminal = False
         while not terminal:
-            policy, value = agent.get_policy_and_value(state)
-            action_idx = np.random.choice(agent.action_size, p=policy)
-            state, reward, terminal, _ = env.step(action_idx)
+            actions, values = agent.act(state)
+            state, reward, terminal, _ = env.step(actions[0])
             t += 1
-            episode_vals.append(value)
+            episode_vals.append(values[0])
             episode_reward += reward
             if t > max_steps:
                 episode_rewards.append(episode_reward)
@@ -166,86 +219,314 @@ def estimate_reward(agent, env, episodes=10, max_steps=10000):
         episode_rewards.append(episode_reward)
     return episode_rewards, episode_vals
 
-def evaluator(agent, env, sess, T_queue, summary, saver, save_path):
-    # Read T and put the same T back on.
-    T = T_queue.get()
-    T_queue.put(T)
+# Steps all the environments in lockstep for I_ASYNC_UPDATE steps, and then
+# trains on the whole batch of num_envs * I_ASYNC_UPDATE states with one
+# Agent.train call, as in A2C. One large batch keeps the BLAS threads busier
+# than many workers contending with batches of I_ASYNC_UPDATE states.
+def sync_trainer(agent, envs, step_counter, timers):
+    print('Synchronous trainer with', envs.num_envs, 'environments')
+    worker_counter = step_counter.worker(0)
+    timer = timers.worker(0)
+    T = worker_counter.T
+    num_envs = envs.num_envs
+
+    # The rollout is kept time-major in preallocated arrays.
+    states = envs.reset()
+    batch_states = np.empty((I_ASYNC_UPDATE,) + states.shape,
+    dtype=states.dtype)
+    batch_actions = np.empty((I_ASYNC_UPDATE, num_envs), dtype=np.int32)
+    batch_rewards = np.empty((I_ASYNC_UPDATE, num_envs), dtype=np.float32)
+    batch_terminals = np.empty((I_ASYNC_UPDATE, num_envs), dtype=bool)
+    baseline_values = np.empty((I_ASYNC_UPDATE, num_envs), dtype=np.float32)
+
+    timer.start()
+    while T < T_MAX:
+        for i in range(I_ASYNC_UPDATE):
+            batch_states[i] = states
+            actions, values = agent.act(states)
+            batch_actions[i] = actions
+            baseline_values[i] = values
+            timer.lap('inference')
+
+            # The environments reset themselves at the end of an episode, so
+            # states is then the first state of the next episode. They are
+            # preprocessed in the subprocesses, so that counts as env time.
+            states, rewards, terminals, _ = envs.step(actions)
+            timer.lap('env')
+
+            # Clip the rewards to be between -1 and 1
+            batch_rewards[i] = np.clip(rewards, -1, 1)
+            batch_terminals[i] = terminals
+        T = worker_counter.increment(num_envs * I_ASYNC_UPDATE)
+        timer.lap('counter')
+
+        # Bootstrap from the value of the last states. The discounted rewards
+        # start again from zero after each terminal step, so the bootstrap
+        # value is only used by environments that haven't just reset.
+        bootstrap_values = agent.get_value(states)
+        timer.lap('inference')
+        target_values = discounted_returns(batch_rewards.T, DISCOUNT_FACTOR,
+        batch_terminals.T, bootstrap_values).T
+        advantages = target_values - baseline_values
+        timer.lap('returns')
+
+        agent.train(batch_states.reshape((-1,) + states.shape[1:]),
+        batch_actions.reshape(-1), target_values.reshape(-1),
+        advantages.reshape(-1))
+        timer.lap('gradients')
+
+    # Make sure the evaluator sees all of our steps.
+    worker_counter.publish()
+
+    global training_finished
+    training_finished = True
+
+# Runs a worker in its own process, with its own environment, session and copy
+# of the agent. The weights are shared through the store.
+def process_trainer(game_name, worker_idx, step_counter, timers, store):
+    env = make_env(game_name)
+    # Each process only needs one thread: we get parallelism from the number
+    # of processes.
+    config = tf.ConfigProto(intra_op_parallelism_threads=1,
+    inter_op_parallelism_threads=1)
+    with tf.Session(config=config) as sess:
+        # The gradients are applied by the store, so the agent doesn't need an
+        # optimizer of its own.
+        agent = Agent(session=sess, action_size=env.action_size, model='mnih',
+        optimizer=None)
+        sess.run(tf.global_variables_initializer())
+        async_trainer(agent, env, sess, worker_idx, step_counter, timers, None,
+        None, None, store=store)
+
+# Every VERBOSE_EVERY steps, saves a checkpoint and publishes a snapshot of the
+# weights for the evaluation process. If store is given, copy the shared weights
+# into the agent first, and checkpoint them with the shared optimizer
+# statistics rather than the session's unused optimizer slots. If server is
+# given, report its batch sizes.
+# It also reports where the workers spent their time since the last report, and
+# writes the phase timings to tensorboard under save_path/timing.
+def publisher(agent, sess, step_counter, timers, checkpointer, save_path,
+    store=None, server=None):
+    timing_summary = SummaryWriter(os.path.join(save_path, 'timing'))
+    # Read a snapshot of T. This can be slightly stale, but we only need it to
+    # decide when to publish.
+    T = step_counter.value()
     last_time = time()
     last_verbose = T
     while T < T_MAX:
-        T = T_queue.get()
-        T_queue.put(T)
+        T = step_counter.value()
         if T - last_verbose >= VERBOSE_EVERY:
             print('T', T)
             current_time = time()
             print('Train steps per second', float(T - last_verbose) / (current_time - last_time))
             last_time = current_time
             last_verbose = T
-
-            print('Evaluating agent')
+            timing = timers.stats(interval=True)
+            timers.print_stats(timing)
+            timers.write_summary(timing_summary, timing, T)
+            if server is not None:
+                server.print_histogram()
+
+            if store is not None:
+                weights = store.get_weights()
+                agent.set_weights(weights)
+                values = {w.name: value for w, value in zip(agent.weights,
+                weights)}
+                values.update(store.get_statistics())
+
+            publish_snapshot(snapshot_path(save_path), agent.get_weights(), T)
+            # This only blocks while the variables are copied to host memory.
+            # The file is written in the background.
+            if store is not None:
+                checkpoint_file = checkpointer.save(T, values, copy=False)
+            else:
+                checkpoint_file = checkpointer.save_session(sess,
+                tf.global_variables(), T)
+            print('Saving in', checkpoint_file)
+            checkpointer.print_latency()
+        sleep(1.0)
+    timing_summary.close()
+
+# Evaluates each snapshot the publisher writes, in a separate process with its
+# own environment, session and copy of the agent. Playing the evaluation
+# episodes then doesn't take time away from the trainers. Stops after
+# evaluating the final snapshot.
+def evaluation_process(game_name, save_path):
+    env = make_env(game_name)
+    config = tf.ConfigProto(intra_op_parallelism_threads=EVALUATION_THREADS,
+    inter_op_parallelism_threads=1)
+    path = snapshot_path(save_path)
+    with tf.Session(config=config) as sess:
+        agent = Agent(session=sess, action_size=env.action_size, model='mnih',
+        optimizer=None)
+        sess.run(tf.global_variables_initializer())
+        summary = SummaryWriter(save_path, sess.graph)
+
+        last_sequence = None
+        final = False
+        while not final:
+            sequence = snapshot_sequence(path)
+            if sequence is None or sequence == last_sequence:
+                sleep(1.0)
+                continue
+            last_sequence = sequence
+            T, weights, final = load_snapshot(path)
+            agent.set_weights(weights)
+
+            print('Evaluating agent at T', T)
             episode_rewards, episode_vals = estimate_reward(agent, env, episodes=5)
             avg_ep_r = np.mean(episode_rewards)
             avg_val = np.mean(episode_vals)
             print('Avg ep reward', avg_ep_r, 'Average value', avg_val)
 
             summary.write_summary({'episode_avg_reward': avg_ep_r, 'avg_value': avg_val}, T)
-            checkpoint_file = saver.save(sess, save_path, global_step=T)
-            print('Saved in', checkpoint_file)
-        sleep(1.0)
+
+        summary.close()
+
+def make_env(game_name):
+    if game_name == 'CartPole-v0':
+        env = CustomGymClassicControl(game_name)
+    else:
+        print('Assuming ATARI game and playing with pixels')
+        env = CustomGym(game_name)
+    return env
+
+# The environments the training threads use. a3c gives them back at the end, so
+# later runs in the same process reuse them.
+ENV_POOL = EnvPool(make_env)
 
 # If restore is True, then start the model from the most recent checkpoint.
 # Else initialise as usual.
-def a3c(game_name, num_threads=8, restore=None, save_path='model'):
+# The mode is either 'threads', where the workers are threads sharing one
+# session, 'processes', where each worker is a separate process and the
+# weights are kept in shared memory, or 'sync', where one trainer steps
+# num_threads environments in lockstep (A2C).
+# The optimizer and update_mode are as in optimizers.py.
+# The environments are taken from env_pool, ENV_POOL by default, and given back
+# to it at the end.
+def a3c(game_name, num_threads=8, restore=None, save_path='model',
+    mode='threads', inference_batch_size=INFERENCE_BATCH_SIZE,
+    inference_timeout=INFERENCE_TIMEOUT, optimizer=OPTIMIZER,
+    update_mode=UPDATE_MODE, env_pool=None):
+    # Later runs in the same process, e.g. in a sweep, start afresh.
+    global training_finished
+    training_finished = False
+    start_time = time()
     processes = []
     envs = []
-    for _ in range(num_threads+1):
-        gym_env = gym.make(game_name)
-        if game_name == 'CartPole-v0':
-            env = CustomGymClassicControl(game_name)
-        else:
-            print('Assuming ATARI game and playing with pixels')
-            env = CustomGym(game_name)
-        envs.append(env)
-
-    # Separate out the evaluation environment
-    evaluation_env = envs[0]
-    envs = envs[1:]
+    if env_pool is None:
+        env_pool = ENV_POOL
+    if mode == 'sync':
+        # Step the environments in subprocesses. We fork them before starting
+        # the session, so they don't inherit it. Each subprocess makes its own
+        # environment, so they start up in parallel.
+        vec_env = VecCustomGym([lambda: make_env(game_name)] * num_threads,
+        use_subprocesses=True)
+        action_size = vec_env.action_size
+        print('Started', num_threads, 'environment processes in',
+        '{:.2f}'.format(time() - start_time), 'seconds')
+    else:
+        # In process mode, the workers build their own environments, and we
+        # only need one here to find the action size.
+        num_envs = num_threads if mode == 'threads' else 1
+        envs = env_pool.take(game_name, num_envs)
+        action_size = envs[0].action_size
 
     with tf.Session() as sess:
         agent = Agent(session=sess,
-        action_size=envs[0].action_size, model='mnih',
-        optimizer=tf.train.AdamOptimizer(INITIAL_LEARNING_RATE))
+        action_size=action_size, model='mnih',
+        optimizer=make_optimizer(optimizer, INITIAL_LEARNING_RATE, update_mode),
+        update_lock=make_update_lock(update_mode))
 
-        # Create a saver, and only keep 2 checkpoints.
-        saver = tf.train.Saver(max_to_keep=2)
-
-        T_queue = queue.Queue()
+        # Create a checkpoint writer, which writes in the background.
+        checkpointer = CheckpointWriter(save_path,
+        max_to_keep=CHECKPOINTS_TO_KEEP,
+        keep_every_seconds=KEEP_CHECKPOINT_EVERY_SECONDS)
 
         # Either restore the parameters or don't.
         if restore is not None:
-            saver.restore(sess, save_path + '-' + str(restore))
+            sess.run(tf.global_variables_initializer())
+            restore_path = checkpoint_path(save_path, restore)
+            if os.path.exists(restore_path):
+                # In process mode the optimizer statistics are restored into
+                # the shared store below, not the session.
+                restore_session(sess, agent.weights if mode == 'processes' else
+                tf.global_variables(), restore_path)
+            else:
+                # Fall back to checkpoints written by tf.train.Saver.
+                tf.train.Saver().restore(sess, save_path + '-' + str(restore))
             last_T = restore
             print('T was:', last_T)
-            T_queue.put(last_T)
         else:
             sess.run(tf.global_variables_initializer())
-            T_queue.put(0)
-
-        summary = Summary(save_path, agent)
-
-        # Create a process for each worker
-        for i in range(num_threads):
-            processes.append(threading.Thread(target=async_trainer, args=(agent,
-            envs[i], sess, i, T_queue, summary, saver, save_path,)))
-
-        # Create a process to evaluate the agent
-        processes.append(threading.Thread(target=evaluator, args=(agent,
-        evaluation_env, sess, T_queue, summary, saver, save_path,)))
+            last_T = 0
+
+        step_counter = StepCounter(num_threads, initial_T=last_T,
+        shared=(mode == 'processes'))
+        timers = PhaseTimers(num_threads, shared=(mode == 'processes'))
+
+        # The summaries are written by the evaluation process.
+        summary = None
+
+        server = None
+        if mode == 'processes':
+            # Put the (possibly restored) weights in shared memory and start
+            # the worker processes. We spawn rather than fork, so the workers
+            # don't inherit this process's session.
+            context = multiprocessing.get_context('spawn')
+            store = store_from_agent(agent, INITIAL_LEARNING_RATE,
+            optimizer=optimizer, update_mode=update_mode, context=context)
+            if restore is not None:
+                if os.path.exists(restore_path) and \
+                    store.set_statistics(load_checkpoint(restore_path)):
+                    print('Restored the shared', optimizer, 'statistics')
+                else:
+                    print('The checkpoint has no shared', optimizer,
+                    'statistics, so the optimizer starts afresh')
+            for i in range(num_threads):
+                processes.append(context.Process(target=process_trainer,
+                args=(game_name, i, step_counter, timers, store,)))
+        elif mode == 'sync':
+            store = None
+            processes.append(threading.Thread(target=sync_trainer, args=(agent,
+            vec_env, step_counter, timers,)))
+        else:
+            store = None
+            # Batch the workers' forward passes if asked to.
+            if inference_batch_size > 0:
+                server = InferenceServer(agent,
+                max_batch_size=inference_batch_size, timeout=inference_timeout)
+                server.start()
+            # Create a process for each worker
+            for i in range(num_threads):
+                processes.append(threading.Thread(target=async_trainer,
+                args=(agent, envs[i], sess, i, step_counter, timers, summary,
+                checkpointer, save_path, None, server,)))
+
+        # Create a thread to save checkpoints and publish snapshots of the
+        # weights
+        processes.append(threading.Thread(target=publisher, args=(agent, sess,
+        step_counter, timers, checkpointer, save_path, store, server,)))
 
         # Start all the processes
         for p in processes:
             p.daemon = True
             p.start()
+        print('Started training in', '{:.2f}'.format(time() - start_time),
+        'seconds')
+
+        # Evaluate the agent in a separate process
+        evaluator = multiprocessing.get_context('spawn').Process(
+        target=evaluation_process, args=(game_name, save_path,))
+        evaluator.daemon = True
+        evaluator.start()
+
+        if mode == 'processes':
+            # The workers can't set training_finished in this process, so wait
+            # for them to exit instead.
+            for p in processes[:-1]:
+                p.join()
+            training_finished = True
 
         # Until training is finished
         while not training_finished:
@@ -254,10 +535,29 @@ def a3c(game_name, num_threads=8, restore=None, save_path='model'):
         # Join the processes, so we get this thread back.
         for p in processes:
             p.join()
+        if server is not None:
+            server.stop()
+
+        # Publish the final weights, and wait for them to be evaluated.
+        if store is not None:
+            agent.set_weights(store.get_weights())
+        publish_snapshot(snapshot_path(save_path), agent.get_weights(),
+        step_counter.value(), final=True)
+        checkpointer.wait()
+        evaluator.join(EVALUATION_TIMEOUT)
+        if evaluator.is_alive():
+            print('The evaluator didn\'t finish within', EVALUATION_TIMEOUT,
+            'seconds, so stopping it')
+            evaluator.terminate()
+            evaluator.join()
+        if mode == 'sync':
+            vec_env.close()
+        else:
+            env_pool.put(game_name, envs)
 
 # Returns sum(rewards[i] * gamma**i)
 def discount(rewards, gamma):
-    return np.sum([rewards[i] * gamma**i for i in range(len(rewards))])
+    return np.dot(rewards, gamma ** np.arange(len(rewards)))
 
 def test_equals(arr1, arr2, eps):
     return np.sum(np.abs(np.array(arr1)-np.array(arr2))) < eps
@@ -267,8 +567,13 @@ def main(argv):
     game_name = 'SpaceInvaders-v0'
     save_path = None
     restore = None
+    mode = 'threads'
+    inference_batch_size = INFERENCE_BATCH_SIZE
+    inference_timeout = INFERENCE_TIMEOUT
+    optimizer = OPTIMIZER
+    update_mode = UPDATE_MODE
     try:
-        opts, args = getopt.getopt(argv, 'hg:s:r:t:')
+        opts, args = getopt.getopt(argv, 'hg:s:r:t:m:b:w:o:u:')
     except getopt.GetoptError:
         print('To run the OpenAI Gym game and save to the given save path: \
         a3c.py -g <game name> -s <save path> -t <num threads>')
@@ -278,7 +583,10 @@ def main(argv):
     for opt, arg in opts:
         if opt == '-h':
             print('Options: -g <game name>, -s <save path>, -r (restore from \
-            the save path given), -t <num threads>.')
+            the save path given), -t <num threads>, -m <threads, processes \
+            or sync>, -b <inference batch size>, -w <inference timeout in \
+            seconds>, -o <adam or rmsprop>, -u <locked, striped or hogwild \
+            updates>.')
             sys.exit()
         elif opt == '-g':
             game_name = arg
@@ -289,6 +597,26 @@ def main(argv):
         elif opt == '-t':
             num_threads = int(arg)
             print('Using', num_threads, 'threads.')
+        elif opt == '-m':
+            mode = arg
+            print('Running the workers as', mode)
+        elif opt == '-b':
+            inference_batch_size = int(arg)
+            print('Using an inference server with batch size',
+            inference_batch_size)
+        elif opt == '-w':
+            inference_timeout = float(arg)
+        elif opt == '-o':
+            optimizer = arg
+        elif opt == '-u':
+            update_mode = arg
+    if optimizer not in OPTIMIZERS:
+        print('Unknown optimizer', optimizer, '- choose from', OPTIMIZERS)
+        sys.exit(2)
+    if update_mode not in UPDATE_MODES:
+        print('Unknown update mode', update_mode, '- choose from', UPDATE_MODES)
+        sys.exit(2)
+    print('Using', optimizer, 'with', update_mode, 'updates')
     if game_name is None:
         print('No game name specified, so playing', game_name)
     if save_path is None:
@@ -300,8 +628,10 @@ def main(argv):
         os.makedirs(save_path)
     print('Using save path', save_path)
     print('Using flags', FLAGS)
-    a3c(game_name, num_threads=NUM_THREADS, restore=restore,
-    save_path=save_path)
+    a3c(game_name, num_threads=num_threads, restore=restore,
+    save_path=save_path, mode=mode, inference_batch_size=inference_batch_size,
+    inference_timeout=inference_timeout, optimizer=optimizer,
+    update_mode=update_mode)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
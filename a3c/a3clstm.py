@@ -9,11 +9,13 @@ import tensorflow as tf
 import numpy as np
 from time import time, sleep, gmtime, strftime
 import gym
-import queue
 from custom_gym import CustomGym
 from custom_gym_classic_control import CustomGymClassicControl
 import random
+from step_counter import StepCounter
 from agentlstm import Agent
+from metrics import SummaryWriter
+from returns import discounted_returns
 
 random.seed(100)
 
@@ -33,34 +35,11 @@ VERBOSE_EVERY, 'TESTING': TESTING, 'I_ASYNC_UPDATE': I_ASYNC_UPDATE}
 
 training_finished = False
 
-class Summary:
-    def __init__(self, logdir, agent):
-        with tf.variable_scope('summary'):
-            summarising = ['episode_avg_reward', 'avg_value']
-            self.agent = agent
-            self.writer = tf.summary.FileWriter(logdir, self.agent.sess.graph)
-            self.summary_ops = {}
-            self.summary_vars = {}
-            self.summary_ph = {}
-            for s in summarising:
-                self.summary_vars[s] = tf.Variable(0.0)
-                self.summary_ph[s] = tf.placeholder('float32', name=s)
-                self.summary_ops[s] = tf.summary.scalar(s, self.summary_vars[s])
-            self.update_ops = []
-            for k in self.summary_vars:
-                self.update_ops.append(self.summary_vars[k].assign(self.summary_ph[k]))
-            self.summary_op = tf.summary.merge(list(self.summary_ops.values()))
-            
-    def write_summary(self, summary, t):
-        self.agent.sess.run(self.update_ops, {self.summary_ph[k]: v for k, v in summary.items()})
-        summary_to_add = self.agent.sess.run(self.summary_op, {self.summary_vars[k]: v for k, v in summary.items()})
-        self.writer.add_summary(summary_to_add, global_step=t)
-
-def async_trainer(agent, env, sess, thread_idx, T_queue, summary, saver,
+def async_trainer(agent, env, sess, thread_idx, step_counter, summary, saver,
     save_path):
     print('Training thread', thread_idx)
-    T = T_queue.get()
-    T_queue.put(T+1)
+    worker_counter = step_counter.worker(thread_idx)
+    T = worker_counter.T
     t = 0
 
     last_verbose = T
@@ -70,46 +49,30 @@ def async_trainer(agent, env, sess, thread_idx, T_queue, summary, saver,
     terminal = True
     while T < T_MAX:
         t_start = t
-        batch_states = []
         batch_rewards = []
         batch_actions = []
-        baseline_values = []
 
+        new_episode = terminal
         if terminal:
             terminal = False
             state = env.reset()
-            # Get the initial state of the RNN (which is just zeros for both c
-            # and h)
-            rnn_state = agent.rnn_state_init
 
-        while not terminal and len(batch_states) < I_ASYNC_UPDATE:
-            # Save the current state
-            batch_states.append(state)
-            
+        while not terminal and len(batch_rewards) < I_ASYNC_UPDATE:
             # Choose an action randomly according to the policy
-            # probabilities. We do this anyway to prevent us having to compute
-            # the baseline value separately.
-            policy, value, rnn_state = sess.run([agent.policy, agent.value,
-            agent.rnn_state_out], feed_dict={ \
-                agent.state: state,
-                agent.rnn_state_in[0]: rnn_state[0],
-                agent.rnn_state_in[1]: rnn_state[1]})
-
-            # policy and value are currently arrays but we want scalars.
-            policy = policy.flatten()
-            value = value.flatten()
-            value = value[0]
-
-            # Choose the action according to the policy.
-            action_idx = np.random.choice(agent.action_size, p=policy)
+            # probabilities. The agent samples it in the graph, and keeps our
+            # recurrent state, and the states of this segment for training, in
+            # the session, so we only feed the state.
+            actions, _ = agent.act(state, thread_idx, new_episode=new_episode,
+            segment_start=len(batch_rewards) == 0)
+            action_idx = actions[0]
+            new_episode = False
 
             # Take the action and get the next state, reward and terminal.
             state, reward, terminal, _ = env.step(action_idx)
 
             # Update counters
             t += 1
-            T = T_queue.get()
-            T_queue.put(T+1)
+            T = worker_counter.increment()
 
             # Clip the reward to be between -1 and 1
             reward = np.clip(reward, -1, 1)
@@ -117,63 +80,35 @@ def async_trainer(agent, env, sess, thread_idx, T_queue, summary, saver,
             # Save the rewards and actions
             batch_rewards.append(reward)
             batch_actions.append(action_idx)
-            baseline_values.append(value)
-
-        target_value = 0
-        # If the last state was terminal, just put R = 0. Else we want the
-        # estimated value of the last state.
-        if not terminal:
-            target_value, rnn_state = sess.run([agent.value, agent.rnn_state_out],
-            feed_dict={
-                agent.state: state,
-                agent.rnn_state_in[0]: rnn_state[0],
-                agent.rnn_state_in[1]: rnn_state[1]})
-            target_value = target_value.flatten()
-            target_value = target_value[0]
-        last_R = target_value
-
-        # Compute the sampled n-step discounted reward
-        batch_target_values = []
-        for reward in reversed(batch_rewards):
-            target_value = reward + DISCOUNT_FACTOR * target_value
-            batch_target_values.append(target_value)
-        # Reverse the batch target values, so they are in the correct order
-        # again.
-        batch_target_values.reverse()
-
-        # Test batch targets
+
+        # Train on the segment. The agent gets the value of the last state to
+        # bootstrap from (or uses R = 0 if it was terminal), and computes the
+        # sampled n-step discounted rewards, in the same call.
         if TESTING:
-            temp_rewards = batch_rewards + [last_R]
-            test_batch_target_values = []
-            for j in range(len(batch_rewards)):
-                test_batch_target_values.append(discount(temp_rewards[j:], DISCOUNT_FACTOR))
-            if not test_equals(batch_target_values, test_batch_target_values,
-                1e-5):
+            target_values, last_R = agent.train(state, batch_actions,
+            batch_rewards, terminal, thread_idx, fetches=[agent.target_value,
+            agent.bootstrap_value])
+            test_target_values = discounted_returns(batch_rewards,
+            DISCOUNT_FACTOR, bootstrap=last_R)
+            if not test_equals(target_values, test_target_values, 1e-5):
                 print('Assertion failed')
                 print(last_R)
                 print(batch_rewards)
-                print(batch_target_values)
-                print(test_batch_target_values)
-
-        # Compute the estimated value of each state
-        batch_advantages = np.array(batch_target_values) - np.array(baseline_values)
-        
-        # Apply asynchronous gradient update
-        initial_rnn_state = agent.rnn_state_init
-
-        # Training
-        sess.run(agent.train_op, feed_dict={
-            agent.state: np.vstack(batch_states),
-            agent.action: batch_actions,
-            agent.target_value: batch_target_values,
-            agent.advantages: batch_advantages,
-            agent.rnn_state_in[0]: initial_rnn_state[0],
-            agent.rnn_state_in[1]: initial_rnn_state[1]})
+                print(target_values)
+                print(test_target_values)
+        else:
+            agent.train(state, batch_actions, batch_rewards, terminal,
+            thread_idx)
+
+    # Make sure the evaluator sees all of our steps.
+    worker_counter.publish()
 
     global training_finished
     training_finished = True
 
-def estimate_reward(agent, env, episodes=10, max_steps=10000):
+# The evaluator uses its own worker slot in the agent for its recurrent state.
+# It doesn't train, so it doesn't record its states in the slot's segment.
+def estimate_reward(agent, env, worker, episodes=10, max_steps=10000):
     episode_rewards = []
     episode_vals = []
     t = 0
@@ -181,26 +116,16 @@ def estimate_reward(agent, env, episodes=10, max_steps=10000):
         episode_reward = 0
         state = env.reset()
         terminal = False
-
-        # Initialise the rnn state
-        rnn_state = agent.rnn_state_init
+        new_episode = True
         while not terminal:
-            # Get the policy, value and next rnn state
-            policy, value, rnn_state = agent.sess.run([agent.policy, agent.value,
-            agent.rnn_state_out], feed_dict={
-                agent.state: state,
-                agent.rnn_state_in[0]: rnn_state[0],
-                agent.rnn_state_in[1]: rnn_state[1]})
-
-            # policy and value are currently arrays but we want scalars.
-            policy = policy.flatten()
-            value = value.flatten()
-            value = value[0]
-
-            action_idx = np.random.choice(agent.action_size, p=policy)
-            state, reward, terminal, _ = env.step(action_idx)
+            # Sample the action and advance the rnn state in one call. The rnn
+            # state starts from zero at the start of the episode.
+            actions, values = agent.act(state, worker, new_episode=new_episode,
+            record=False)
+            new_episode = False
+            state, reward, terminal, _ = env.step(actions[0])
             t += 1
-            episode_vals.append(value)
+            episode_vals.append(values[0])
             episode_reward += reward
             if t > max_steps:
                 episode_rewards.append(episode_reward)
@@ -208,15 +133,14 @@ def estimate_reward(agent, env, episodes=10, max_steps=10000):
         episode_rewards.append(episode_reward)
     return episode_rewards, episode_vals
 
-def evaluator(agent, env, sess, T_queue, summary, saver, save_path):
-    # Read T and put the same T back on.
-    T = T_queue.get()
-    T_queue.put(T)
+def evaluator(agent, env, sess, step_counter, summary, saver, save_path):
+    # Read a snapshot of T. This can be slightly stale, but we only need it to
+    # decide when to evaluate.
+    T = step_counter.value()
     last_time = time()
     last_verbose = T
     while T < T_MAX:
-        T = T_queue.get()
-        T_queue.put(T)
+        T = step_counter.value()
         if T - last_verbose >= VERBOSE_EVERY:
             print('T', T)
             current_time = time()
@@ -225,7 +149,9 @@ def evaluator(agent, env, sess, T_queue, summary, saver, save_path):
             last_verbose = T
             
             print('Evaluating agent')
-            episode_rewards, episode_vals = estimate_reward(agent, env, episodes=5)
+            # The last worker slot is the evaluator's.
+            episode_rewards, episode_vals = estimate_reward(agent, env,
+            agent.num_workers - 1, episodes=5)
             avg_ep_r = np.mean(episode_rewards)
             avg_val = np.mean(episode_vals)
             print('Avg ep reward', avg_ep_r, 'Average value', avg_val)
@@ -241,12 +167,11 @@ def a3c(game_name, num_threads=8, restore=None, save_path='model'):
     processes = []
     envs = []
     for _ in range(num_threads+1):
-        gym_env = gym.make(game_name)
         if game_name == 'CartPole-v0':
-            env = CustomGymClassicControl(gym_env)
+            env = CustomGymClassicControl(game_name)
         else:
             print('Assuming ATARI game and playing with pixels')
-            env = CustomGym(gym_env, game_name, nb_frames=1)
+            env = CustomGym(game_name, num_frames=1)
         envs.append(env)
 
     # Separate out the evaluation environment
@@ -257,33 +182,36 @@ def a3c(game_name, num_threads=8, restore=None, save_path='model'):
         agent = Agent(session=sess,
         action_size=envs[0].action_size,
         model='mnih-lstm',
-        optimizer=tf.train.AdamOptimizer(INITIAL_LEARNING_RATE))
+        optimizer=tf.train.AdamOptimizer(INITIAL_LEARNING_RATE),
+        num_workers=num_threads+1, segment_length=I_ASYNC_UPDATE,
+        discount_factor=DISCOUNT_FACTOR)
 
         # Create a saver, and only keep 2 checkpoints.
         saver = tf.train.Saver(max_to_keep=2)
 
-        T_queue = queue.Queue()
-
         # Either restore the parameters or don't.
         if restore is not None:
             saver.restore(sess, save_path + '-' + str(restore))
             last_T = restore
             print('T was:', last_T)
-            T_queue.put(last_T)
         else:
             sess.run(tf.global_variables_initializer())
-            T_queue.put(0)
+            last_T = 0
+        # The workers' recurrent and segment states.
+        sess.run(tf.local_variables_initializer())
+
+        step_counter = StepCounter(num_threads, initial_T=last_T)
 
-        summary = Summary(save_path, agent)
+        summary = SummaryWriter(save_path, sess.graph)
 
         # Create a process for each worker
         for i in range(num_threads):
             processes.append(threading.Thread(target=async_trainer, args=(agent,
-            envs[i], sess, i, T_queue, summary, saver, save_path,)))
+            envs[i], sess, i, step_counter, summary, saver, save_path,)))
 
         # Create a process to evaluate the agent
         processes.append(threading.Thread(target=evaluator, args=(agent,
-        evaluation_env, sess, T_queue, summary, saver, save_path,)))
+        evaluation_env, sess, step_counter, summary, saver, save_path,)))
 
         # Start all the processes
         for p in processes:
@@ -298,9 +226,7 @@ def a3c(game_name, num_threads=8, restore=None, save_path='model'):
         for p in processes:
             p.join()
 
-# Returns sum(rewards[i] * gamma**i)
-def discount(rewards, gamma):
-    return np.sum([rewards[i] * gamma**i for i in range(len(rewards))])
+        summary.close()
 
 def test_equals(arr1, arr2, eps):
     return np.sum(np.abs(np.array(arr1)-np.array(arr2))) < eps
@@ -343,7 +269,7 @@ def main(argv):
         os.makedirs(save_path)
     print('Using save path', save_path)
     print('Using flags', FLAGS)
-    a3c(game_name, num_threads=NUM_THREADS, restore=restore,
+    a3c(game_name, num_threads=num_threads, restore=restore,
     save_path=save_path)
 
 if __name__ == '__main__':
@@ -2,12 +2,17 @@ import tensorflow as tf
 import numpy as np
 
 class Agent():
+    # If update_lock is given, it is held around each training step, so that
+    # the threads sharing the agent never update the weights at the same time.
+    # If optimizer is None, no training op is built, and the agent can only
+    # compute gradients, e.g. for a shared parameter store.
     def __init__(self, session, action_size, model='mnih',
-        optimizer=tf.train.AdamOptimizer(1e-4)):
+        optimizer=tf.train.AdamOptimizer(1e-4), update_lock=None):
 
         self.action_size = action_size
         self.optimizer = optimizer
         self.sess = session
+        self.update_lock = update_lock
 
         with tf.variable_scope('network'):
             self.action = tf.placeholder('int32', [None], name='action')
@@ -21,6 +26,29 @@ class Agent():
             scope='network')
             self.advantages = tf.placeholder('float32', [None], name='advantages')
 
+        # Sample actions in the graph, so a worker gets its actions and values
+        # in one call without fetching the policy. The policy is sharpened
+        # (temperature < 1) or flattened (temperature > 1) before sampling, and
+        # greedy takes the most likely action instead.
+        with tf.variable_scope('act'):
+            self.temperature = tf.placeholder_with_default(1.0, [],
+            name='temperature')
+            self.greedy = tf.placeholder_with_default(False, [], name='greedy')
+            log_policy = tf.log(tf.clip_by_value(self.policy, 0.000001,
+            1.0))
+            sampled_actions = tf.squeeze(tf.multinomial(log_policy /
+            self.temperature, 1), [1])
+            greedy_actions = tf.argmax(log_policy, 1)
+            self.sampled_action = tf.cast(tf.where(tf.fill(
+            tf.shape(sampled_actions), self.greedy), greedy_actions,
+            sampled_actions), tf.int32, name='sampled_action')
+            # The log-probability of each action under the untempered policy.
+            self.sampled_log_prob = tf.reduce_sum(log_policy *
+            tf.one_hot(self.sampled_action, self.action_size), axis=1,
+            name='sampled_log_prob')
+            self.sampled_value = tf.reshape(self.value, [-1],
+            name='sampled_value')
+
         with tf.variable_scope('optimizer'):
             # Compute the one hot vectors for each action given.
             action_one_hot = tf.one_hot(self.action, self.action_size, 1.0, 0.0)
@@ -83,10 +111,24 @@ class Agent():
             grads, _ = tf.clip_by_global_norm(grads, 40.0)
             grads_vars = list(zip(grads, self.weights))
 
+            # Keep the clipped gradients so they can also be applied outside
+            # this graph, e.g. to a shared parameter store.
+            self.grads = grads
+
             # Create an operator to apply the gradients using the optimizer.
             # Note that apply_gradients is the second part of minimize() for the
             # optimizer, so will minimize the loss.
-            self.train_op = optimizer.apply_gradients(grads_vars)
+            if optimizer is not None:
+                self.train_op = optimizer.apply_gradients(grads_vars)
+
+        # Placeholders and assign ops to overwrite the weights with given
+        # values. We build these once here, so setting the weights doesn't grow
+        # the graph.
+        with tf.variable_scope('set_weights'):
+            self.weights_ph = [tf.placeholder(w.dtype.base_dtype,
+            w.get_shape()) for w in self.weights]
+            self.set_weights_op = [w.assign(ph) for w, ph in zip(self.weights,
+            self.weights_ph)]
 
     def get_policy(self, state):
         return self.sess.run(self.policy, {self.state: state}).flatten()
@@ -99,16 +141,47 @@ class Agent():
         state})
         return policy.flatten(), value.flatten()
 
+    # Returns the sampled actions and the values for a batch of states, and the
+    # log-probabilities of the actions if log_probs is True.
+    def act(self, states, temperature=1.0, greedy=False, log_probs=False):
+        fetches = [self.sampled_action, self.sampled_value]
+        if log_probs:
+            fetches.append(self.sampled_log_prob)
+        return tuple(self.sess.run(fetches, {self.state: states,
+        self.temperature: temperature, self.greedy: greedy}))
+
     # Train the network on the given states and rewards
     def train(self, states, actions, target_values, advantages):
+        feed_dict = {
+            self.state: states,
+            self.action: actions,
+            self.target_value: target_values,
+            self.advantages: advantages
+        }
         # Training
-        self.sess.run(self.train_op, feed_dict={
+        if self.update_lock is None:
+            self.sess.run(self.train_op, feed_dict=feed_dict)
+        else:
+            with self.update_lock:
+                self.sess.run(self.train_op, feed_dict=feed_dict)
+
+    # Compute the clipped gradients for the given states and rewards, without
+    # applying them.
+    def compute_gradients(self, states, actions, target_values, advantages):
+        return self.sess.run(self.grads, feed_dict={
             self.state: states,
             self.action: actions,
             self.target_value: target_values,
             self.advantages: advantages
         })
 
+    def get_weights(self):
+        return self.sess.run(self.weights)
+
+    def set_weights(self, values):
+        self.sess.run(self.set_weights_op, {ph: value for ph, value in
+        zip(self.weights_ph, values)})
+
     # Builds the DQN model as in Mnih, but we get a softmax output for the
     # policy from fc1 and a linear output for the value from fc1.
     def build_model(self, h, w, channels):
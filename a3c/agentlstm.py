@@ -3,35 +3,94 @@ import tensorflow as tf
 import numpy as np
 
 class Agent():
+    # Each of the num_workers workers keeps its recurrent state, and the states
+    # of its current segment of at most segment_length steps, in variables in
+    # the session. See get_policy_and_value and train.
+    # Acting and training both depend on that state, so the only model is
+    # 'mnih-lstm'. The feedforward models are in agent.py.
     def __init__(self, session, action_size, model='mnih-lstm',
-        optimizer=tf.train.AdamOptimizer(1e-4)):
+        optimizer=tf.train.AdamOptimizer(1e-4), num_workers=1,
+        segment_length=5, discount_factor=0.99):
+        if model != 'mnih-lstm':
+            raise ValueError('The LSTM agent only builds the mnih-lstm model, '
+            'not ' + str(model) + '. Use agent.Agent for the others.')
 
         self.action_size = action_size
         self.optimizer = optimizer
         self.sess = session
+        self.num_workers = num_workers
+        self.segment_length = segment_length
 
         with tf.variable_scope('network'):
             self.action = tf.placeholder('int32', [None], name='action')
-            self.target_value = tf.placeholder('float32', [None], name='target_value')
-
-            if model == 'mnih':
-                self.state, self.policy, self.value = self.build_model(84, 84, 1)
-            elif model == 'mnih-lstm':
-                self.state, self.policy, self.value = self.build_model_lstm(84, 84)
-            else:
-                # Assume we wanted a feedforward neural network
-                self.state, self.policy, self.value = self.build_model_feedforward(4)
+            self.reward = tf.placeholder('float32', [None], name='reward')
+            self.terminal = tf.placeholder('bool', [], name='terminal')
+
+            self.state, self.policy, self.value = self.build_model_lstm(84, 84)
             self.weights = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES,
             scope='network')
-            self.advantages = tf.placeholder('float32', [None], name='advantages')
+
+            # Running the policy or value this way also advances the worker's
+            # recurrent state and records the state in its segment.
+            with tf.control_dependencies(self.rnn_state_update +
+                self.segment_update):
+                self.step_policy = tf.identity(self.policy)
+                self.step_value = tf.identity(self.value)
+
+            # This way only advances the recurrent state, for evaluation, which
+            # never trains, so has no segments and may run for any number of
+            # steps.
+            with tf.control_dependencies(self.rnn_state_update):
+                self.evaluate_policy = tf.identity(self.policy)
+                self.evaluate_value = tf.identity(self.value)
+
+        # Sample actions in the graph, so a worker gets its actions and values
+        # in one call without fetching the policy. The policy is sharpened
+        # (temperature < 1) or flattened (temperature > 1) before sampling, and
+        # greedy takes the most likely action instead.
+        with tf.variable_scope('act'):
+            self.temperature = tf.placeholder_with_default(1.0, [],
+            name='temperature')
+            self.greedy = tf.placeholder_with_default(False, [], name='greedy')
+            self.sampled_action, self.sampled_log_prob, self.sampled_value = \
+            self.sample_actions(self.step_policy, self.step_value)
+        with tf.variable_scope('evaluate'):
+            self.evaluate_action, self.evaluate_log_prob, \
+            self.evaluate_sampled_value = self.sample_actions(
+            self.evaluate_policy, self.evaluate_value)
+
+        with tf.variable_scope('targets'):
+            # When training, the network runs over the segment's states and
+            # then the state after the segment, so the last value is the value
+            # to bootstrap from, unless the segment ended the episode.
+            num_steps = tf.shape(self.reward)[0]
+            values = tf.reshape(self.value, [-1])
+            self.bootstrap_value = tf.stop_gradient(values[num_steps]) * \
+            (1.0 - tf.cast(self.terminal, tf.float32))
+
+            # The sampled n-step discounted reward:
+            # R_t = sum_{k>=t} gamma^(k-t) r_k + gamma^(T-t) V(s_T).
+            steps = tf.range(num_steps)
+            distance = tf.cast(steps[None,:] - steps[:,None], tf.float32)
+            discount = tf.where(distance >= 0, discount_factor ** distance,
+            tf.zeros_like(distance))
+            self.target_value = tf.reduce_sum(discount * self.reward[None,:],
+            axis=1) + discount_factor ** tf.cast(num_steps - steps, tf.float32) \
+            * self.bootstrap_value
+            self.advantages = tf.stop_gradient(self.target_value -
+            values[:num_steps])
 
         with tf.variable_scope('optimizer'):
             # Compute the one hot vectors for each action given.
             action_one_hot = tf.one_hot(self.action, self.action_size, 1.0, 0.0)
 
+            # Only the segment's steps are trained on.
+            policy = self.policy[:num_steps]
+            value = values[:num_steps]
+
             min_policy = 1e-8
             max_policy = 1.0 - 1e-8
-            self.log_policy = tf.log(tf.clip_by_value(self.policy, 0.000001, 0.999999))
+            self.log_policy = tf.log(tf.clip_by_value(policy, 0.000001, 0.999999))
 
             # For a given state and action, compute the log of the policy at
             # that action for that state. This also works on batches.
@@ -58,7 +117,7 @@ class Agent():
             # so we just impose a square error loss.
             # Note that the target value should be the discounted reward for the
             # state as just sampled.
-            self.value_loss = tf.reduce_mean(tf.square(self.target_value - self.value))
+            self.value_loss = tf.reduce_mean(tf.square(self.target_value - value))
             
             # We follow Mnih's paper and introduce the entropy as another loss
             # to the policy. The entropy of a probability distribution is just
@@ -70,7 +129,7 @@ class Agent():
             # distribution is more concentrated on one action, so a larger
             # entropy implies more exploration. Thus we penalise small entropy,
             # or equivalently, add -entropy to our loss.
-            self.entropy = tf.reduce_sum(tf.multiply(self.policy, -self.log_policy))
+            self.entropy = tf.reduce_sum(tf.multiply(policy, -self.log_policy))
 
             # Try to minimise the loss. There is some rationale for choosing the
             # weighted linear combination here that I found somewhere else that
@@ -92,17 +151,73 @@ class Agent():
             # optimizer, so will minimize the loss.
             self.train_op = optimizer.apply_gradients(grads_vars)
 
-    # Train the network on the given states and rewards
-    def train(self, states, actions, target_values, advantages,
-        initial_rnn_state):
-        # Training
-        self.sess.run(self.train_op, feed_dict={
-            self.state: states,
+    # Returns the policy and value for the given state, and advances the
+    # worker's recurrent state in the session, so that only the state has to be
+    # fed. Set new_episode at the first step of an episode to start from the
+    # zero state, and segment_start at the first step of each segment.
+    def get_policy_and_value(self, state, worker=0, new_episode=False,
+        segment_start=False):
+        policy, value = self.sess.run([self.step_policy, self.step_value],
+        feed_dict={
+            self.state: state,
+            self.worker: worker,
+            self.reset_rnn_state: new_episode,
+            self.segment_start: segment_start})
+        return policy.flatten(), value[0,0]
+
+    # Returns the sampled actions, their log-probabilities under the untempered
+    # policy, and the values.
+    def sample_actions(self, policy, value):
+        log_policy = tf.log(tf.clip_by_value(policy, 0.000001, 1.0))
+        sampled_actions = tf.squeeze(tf.multinomial(log_policy /
+        self.temperature, 1), [1])
+        greedy_actions = tf.argmax(log_policy, 1)
+        actions = tf.cast(tf.where(tf.fill(tf.shape(sampled_actions),
+        self.greedy), greedy_actions, sampled_actions), tf.int32,
+        name='sampled_action')
+        log_probs = tf.reduce_sum(log_policy * tf.one_hot(actions,
+        self.action_size), axis=1, name='sampled_log_prob')
+        values = tf.reshape(value, [-1], name='sampled_value')
+        return actions, log_probs, values
+
+    # Like get_policy_and_value, but samples the action in the graph. The LSTM
+    # treats a batch of states as a sequence, so state is a batch of one.
+    # Returns the actions and values, and the log-probabilities of the actions
+    # if log_probs is True.
+    # If record is False, as when evaluating, the state isn't recorded in the
+    # worker's segment, and segment_start is ignored.
+    def act(self, state, worker=0, new_episode=False, segment_start=False,
+        temperature=1.0, greedy=False, log_probs=False, record=True):
+        if record:
+            fetches = [self.sampled_action, self.sampled_value]
+            if log_probs:
+                fetches.append(self.sampled_log_prob)
+        else:
+            fetches = [self.evaluate_action, self.evaluate_sampled_value]
+            if log_probs:
+                fetches.append(self.evaluate_log_prob)
+        return tuple(self.sess.run(fetches, feed_dict={
+            self.state: state,
+            self.worker: worker,
+            self.reset_rnn_state: new_episode,
+            self.segment_start: segment_start,
+            self.temperature: temperature,
+            self.greedy: greedy}))
+
+    # Trains on the worker's current segment. The segment's states are already
+    # in the session, so we only feed the state after the segment (to
+    # bootstrap from), and the actions and rewards. The network runs again from
+    # the recurrent state at the start of the segment, and the n-step targets
+    # and bootstrap value are computed in the same call.
+    def train(self, next_state, actions, rewards, terminal, worker=0,
+        fetches=[]):
+        return self.sess.run([self.train_op] + fetches, feed_dict={
+            self.state: next_state,
             self.action: actions,
-            self.target_value: target_values,
-            self.advantages: advantages,
-            self.rnn_state_in[0]: initial_rnn_state[0],
-            self.rnn_state_in[1]: initial_rnn_state[1]})
+            self.reward: rewards,
+            self.terminal: terminal,
+            self.worker: worker,
+            self.stored_steps: len(rewards)})[1:]
 
     # Builds the DQN model as in Mnih, but we get a softmax output for the
     # policy from fc1 and a linear output for the value from fc1.
@@ -112,9 +227,45 @@ class Agent():
         # order to do convolutions.
         state = tf.placeholder('float32', shape=(None, h, w, 1), name='state')
         self.layers['state'] = state
+
+        # Which worker is running, whether it starts a new episode or segment,
+        # and, when training, how many of its stored segment states to run
+        # over before the fed state.
+        self.worker = tf.placeholder_with_default(0, [], name='worker')
+        self.reset_rnn_state = tf.placeholder_with_default(False, [],
+        name='reset_rnn_state')
+        self.segment_start = tf.placeholder_with_default(False, [],
+        name='segment_start')
+        self.stored_steps = tf.placeholder_with_default(0, [],
+        name='stored_steps')
+        worker_row = tf.expand_dims(self.worker, 0)
+        from_segment_start = tf.cast(self.stored_steps > 0, tf.float32)
+
+        # The states of each worker's current segment, and the number of them
+        # stored so far. These are local variables, so they are not part of
+        # self.weights and are not saved in checkpoints.
+        with tf.variable_scope('segment'):
+            self.segment_states = tf.Variable(tf.zeros([self.num_workers,
+            self.segment_length, h, w, 1]), trainable=False,
+            collections=[tf.GraphKeys.LOCAL_VARIABLES], name='states')
+            self.segment_step = tf.Variable(tf.zeros([self.num_workers],
+            tf.int32), trainable=False,
+            collections=[tf.GraphKeys.LOCAL_VARIABLES], name='step')
+            segment_step = tf.gather(self.segment_step, self.worker) * \
+            (1 - tf.cast(self.segment_start, tf.int32))
+            stored_states = tf.gather(self.segment_states,
+            self.worker)[:self.stored_steps]
+            model_input = tf.concat([stored_states, state], 0)
+            self.segment_update = [
+                tf.scatter_nd_update(self.segment_states,
+                tf.expand_dims(tf.stack([self.worker, segment_step]), 0),
+                state),
+                tf.scatter_update(self.segment_step, worker_row,
+                tf.expand_dims(segment_step + 1, 0))]
+
         # First convolutional layer
         with tf.variable_scope('conv1'):
-            conv1 = tf.contrib.layers.convolution2d(inputs=state,
+            conv1 = tf.contrib.layers.convolution2d(inputs=model_input,
             num_outputs=16, kernel_size=[8,8], stride=[4,4], padding="VALID",
             activation_fn=tf.nn.relu,
             weights_initializer=tf.contrib.layers.xavier_initializer_conv2d(),
@@ -149,14 +300,37 @@ class Agent():
             c_init = np.zeros((1, lstm_cell.state_size.c), np.float32)
             h_init = np.zeros((1, lstm_cell.state_size.h), np.float32)
             self.rnn_state_init = [c_init, h_init]
-            c_in = tf.placeholder(tf.float32, [1, lstm_cell.state_size.c],
-            "c_in")
-            h_in = tf.placeholder(tf.float32, [1, lstm_cell.state_size.h],
-            "h_in")
+
+            # Each worker's recurrent state, and its state at the start of the
+            # current segment.
+            def worker_variables(name, size):
+                variable = tf.Variable(tf.zeros([self.num_workers, size]),
+                trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                name=name)
+                return variable, tf.gather(variable, worker_row)
+            self.rnn_c, rnn_c = worker_variables('c', lstm_cell.state_size.c)
+            self.rnn_h, rnn_h = worker_variables('h', lstm_cell.state_size.h)
+            self.segment_c, segment_c = worker_variables('segment_c',
+            lstm_cell.state_size.c)
+            self.segment_h, segment_h = worker_variables('segment_h',
+            lstm_cell.state_size.h)
+
+            # Training starts from the state at the start of the segment, and
+            # acting from the worker's current state, or zero at the start of
+            # an episode. Feeding c_in and h_in overrides both.
+            keep = 1.0 - tf.cast(self.reset_rnn_state, tf.float32)
+            c_default = from_segment_start * segment_c + \
+            (1.0 - from_segment_start) * keep * rnn_c
+            h_default = from_segment_start * segment_h + \
+            (1.0 - from_segment_start) * keep * rnn_h
+            c_in = tf.placeholder_with_default(c_default,
+            [1, lstm_cell.state_size.c], "c_in")
+            h_in = tf.placeholder_with_default(h_default,
+            [1, lstm_cell.state_size.h], "h_in")
             self.rnn_state_in = (c_in, h_in)
             rnn_in = tf.expand_dims(fc1, [0])
             # The sequence length is the size of the batch
-            sequence_length = tf.shape(state)[:1]
+            sequence_length = tf.shape(model_input)[:1]
             rnn_state_in = tf.contrib.rnn.LSTMStateTuple(c_in, h_in)
             lstm_outputs, lstm_state = tf.nn.dynamic_rnn(lstm_cell,
                 rnn_in,
@@ -165,6 +339,19 @@ class Agent():
                 time_major=False)
             lstm_c, lstm_h = lstm_state
             self.rnn_state_out = (lstm_c[:1,:], lstm_h[:1,:])
+
+            # After acting, store the worker's new recurrent state, and, when
+            # recording the segment, its state at the start of the segment if
+            # this step starts one.
+            self.rnn_state_update = [
+                tf.scatter_update(self.rnn_c, worker_row, lstm_c[:1,:]),
+                tf.scatter_update(self.rnn_h, worker_row, lstm_h[:1,:])]
+            starts = tf.cast(self.segment_start, tf.float32)
+            self.segment_update += [
+                tf.scatter_update(self.segment_c, worker_row,
+                starts * c_in + (1.0 - starts) * segment_c),
+                tf.scatter_update(self.segment_h, worker_row,
+                starts * h_in + (1.0 - starts) * segment_h)]
             rnn_out = tf.reshape(lstm_outputs, [-1, 256])
             self.layers['rnn_state_init'] = self.rnn_state_init
             self.layers['rnn_state_in'] = self.rnn_state_in
@@ -187,45 +374,3 @@ class Agent():
             self.layers['value'] = value
 
         return state, policy, value
-
-    # Builds a simple feedforward model to learn the cart and pole environment.
-    def build_model_feedforward(self, input_dim, num_hidden=30):
-        self.layers = {}
-        state = tf.placeholder('float32', shape=(None, input_dim), name='state')
-
-        self.layers['state'] = state
-        # Fully connected layer with num_hidden hidden units
-        with tf.variable_scope('fc1'):
-            fc1 = tf.contrib.layers.fully_connected(inputs=state,
-            num_outputs=num_hidden,
-            activation_fn=tf.nn.relu,
-            weights_initializer=tf.contrib.layers.xavier_initializer(),
-            biases_initializer=tf.zeros_initializer())
-            self.layers['fc1'] = fc1
-
-        # Fully connected layer with num_hidden hidden units
-        with tf.variable_scope('fc2'):
-            fc2 = tf.contrib.layers.fully_connected(inputs=fc1,
-            num_outputs=num_hidden,
-            activation_fn=tf.nn.relu,
-            weights_initializer=tf.contrib.layers.xavier_initializer(),
-            biases_initializer=tf.zeros_initializer())
-            self.layers['fc2'] = fc2
-        
-        # The policy output to the two possible actions
-        with tf.variable_scope('policy'):
-            policy = tf.contrib.layers.fully_connected(inputs=fc2,
-            num_outputs=self.action_size, activation_fn=tf.nn.softmax,
-            weights_initializer=tf.contrib.layers.xavier_initializer(),
-            biases_initializer=tf.zeros_initializer())
-            self.layers['policy'] = policy
-
-        # The value output
-        with tf.variable_scope('value'):
-            value = tf.contrib.layers.fully_connected(inputs=fc2, num_outputs=1,
-            activation_fn=None,
-            weights_initializer=tf.contrib.layers.xavier_initializer(),
-            biases_initializer=tf.zeros_initializer())
-            self.layers['value'] = value
-
-        return state, policy, value
@@ -0,0 +1,88 @@
+# coding: utf-8
+# Compares the per-step time and memory allocated by the old np.append frame
+# stacking in CustomGym.preprocess with the FrameStack ring buffer.
+import sys, getopt
+import tracemalloc
+from time import time
+import numpy as np
+from frame_stack import FrameStack
+
+NUM_FRAMES = 4
+H, W = 84, 84
+
+# The frame stacking that CustomGym.preprocess used to do.
+class AppendStack:
+    def __init__(self):
+        self.state = None
+
+    def reset(self, s):
+        s = s.reshape(1, s.shape[0], s.shape[1], 1)
+        self.state = np.repeat(s, NUM_FRAMES, axis=3)
+        return self.state
+
+    def push(self, s):
+        s = s.reshape(1, s.shape[0], s.shape[1], 1)
+        self.state = np.append(s, self.state[:,:,:,:NUM_FRAMES-1], axis=3)
+        return self.state
+
+# Pushes each frame and then makes the contiguous copy that a network feed
+# would need.
+class CopyingFrameStack(FrameStack):
+    def push(self, frame):
+        FrameStack.push(self, frame)
+        return self.copy()
+
+def run(stack, frames):
+    state = stack.reset(frames[0])
+    for frame in frames[1:]:
+        state = stack.push(frame)
+    return state
+
+# Returns the time per step in microseconds.
+def time_per_step(make_stack, frames):
+    stack = make_stack()
+    start_time = time()
+    run(stack, frames)
+    return 1e6 * (time() - start_time) / len(frames)
+
+# Returns the average number of bytes allocated per step, including memory that
+# is freed again before the next step. numpy reports its array allocations to
+# tracemalloc, so the peak during each step tells us how much it allocated.
+def bytes_per_step(make_stack, frames):
+    stack = make_stack()
+    state = stack.reset(frames[0])
+    total = 0
+    tracemalloc.start()
+    for frame in frames[1:]:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        state = stack.push(frame)
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return float(total) / (len(frames) - 1)
+
+def main(argv):
+    num_steps = 10000
+    try:
+        opts, args = getopt.getopt(argv, 'n:')
+    except getopt.GetoptError:
+        print('Usage: python benchmark_frame_stack.py -n <num steps>')
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-n':
+            num_steps = int(arg)
+    frames = [np.random.rand(H, W).astype(np.float32) for _ in range(num_steps)]
+
+    # Check the ring buffer gives the same states as np.append.
+    assert np.array_equal(run(AppendStack(), frames[:10]),
+    run(FrameStack(NUM_FRAMES, H, W), frames[:10]))
+
+    print('method               us/step  bytes allocated/step')
+    for name, make_stack in [('np.append', AppendStack),
+        ('FrameStack view', lambda: FrameStack(NUM_FRAMES, H, W)),
+        ('FrameStack copy', lambda: CopyingFrameStack(NUM_FRAMES, H, W))]:
+        print('{:19s}  {:7.2f}  {:20.0f}'.format(name,
+        time_per_step(make_stack, frames), bytes_per_step(make_stack, frames)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
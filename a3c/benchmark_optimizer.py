@@ -0,0 +1,167 @@
+# coding: utf-8
+# Compares the shared optimizers and update modes from optimizers.py. For each
+# combination, a fresh agent is trained by several threads for a fixed time, as
+# in the threads mode of a3c.py, and we report the training steps per second
+# and the average reward of the last episodes.
+#
+# Runs on CartPole if gym can make it, and on Catch, a stand-in pixel
+# environment that doesn't need gym or the Atari roms: a ball falls from the
+# top of the screen and the agent moves a paddle to catch it.
+import sys, getopt
+import threading
+from time import time
+import numpy as np
+import tensorflow as tf
+from agent import Agent
+from frame_stack import FrameStack
+from optimizers import make_optimizer, make_update_lock, OPTIMIZERS, \
+UPDATE_MODES
+from returns import discounted_returns
+
+LEARNING_RATE = 1e-4
+DISCOUNT_FACTOR = 0.99
+I_ASYNC_UPDATE = 5
+
+# Has the same interface as CustomGym: the states are stacks of four 84x84
+# frames, and the actions are left, stay and right.
+class CatchGym:
+    SIZE = 84
+    PADDLE_WIDTH = 12
+    SPEED = 4
+
+    def __init__(self, num_frames=4):
+        self.action_size = 3
+        self.frame_stack = FrameStack(num_frames, self.SIZE, self.SIZE)
+        self.frame = np.zeros((self.SIZE, self.SIZE), dtype=np.float32)
+
+    def draw(self):
+        self.frame[...] = 0
+        self.frame[self.ball_y:self.ball_y+2, self.ball_x:self.ball_x+2] = 1
+        self.frame[-2:, self.paddle_x:self.paddle_x+self.PADDLE_WIDTH] = 1
+        return self.frame
+
+    def reset(self):
+        self.ball_y = 0
+        self.ball_x = np.random.randint(self.SIZE - 2)
+        self.paddle_x = (self.SIZE - self.PADDLE_WIDTH) // 2
+        return self.frame_stack.reset(self.draw())
+
+    def step(self, action_idx):
+        self.paddle_x = int(np.clip(self.paddle_x + (action_idx-1) * self.SPEED,
+        0, self.SIZE - self.PADDLE_WIDTH))
+        self.ball_y += self.SPEED
+        reward = 0.0
+        terminal = self.ball_y >= self.SIZE - 2
+        if terminal:
+            caught = self.paddle_x - 2 < self.ball_x < \
+            self.paddle_x + self.PADDLE_WIDTH
+            reward = 1.0 if caught else -1.0
+            self.ball_y = self.SIZE - 2
+        return self.frame_stack.push(self.draw()), reward, terminal, None
+
+def make_env(game_name):
+    if game_name == 'Catch':
+        return CatchGym(), 'mnih'
+    from custom_gym_classic_control import CustomGymClassicControl
+    return CustomGymClassicControl(game_name), 'feedforward'
+
+# A cut-down async_trainer: trains until the deadline, and records the number of
+# steps and the episode rewards.
+def worker(agent, env, deadline, steps, episode_rewards, idx):
+    state = env.reset()
+    episode_reward = 0
+    batch_states = None
+    while time() < deadline:
+        batch_rewards = []
+        batch_actions = []
+        baseline_values = []
+        terminal = False
+        while not terminal and len(batch_rewards) < I_ASYNC_UPDATE:
+            if batch_states is None:
+                batch_states = np.empty((I_ASYNC_UPDATE,) + state.shape[1:],
+                dtype=np.float32)
+            batch_states[len(batch_rewards)] = state[0]
+            actions, values = agent.act(state)
+            state, reward, terminal, _ = env.step(actions[0])
+            episode_reward += reward
+            batch_rewards.append(np.clip(reward, -1, 1))
+            batch_actions.append(actions[0])
+            baseline_values.append(values[0])
+        bootstrap = 0 if terminal else agent.get_value(state)[0]
+        target_values = discounted_returns(batch_rewards, DISCOUNT_FACTOR,
+        bootstrap=bootstrap)
+        agent.train(batch_states[:len(batch_rewards)], batch_actions,
+        target_values, target_values - np.array(baseline_values))
+        steps[idx] += len(batch_rewards)
+        if terminal:
+            episode_rewards.append(episode_reward)
+            episode_reward = 0
+            state = env.reset()
+
+# Returns the steps per second and the average reward of the last
+# num_last_episodes episodes.
+def run(game_name, optimizer, update_mode, num_threads, seconds,
+    num_last_episodes=20):
+    envs = []
+    for _ in range(num_threads):
+        env, model = make_env(game_name)
+        envs.append(env)
+    graph = tf.Graph()
+    with graph.as_default(), tf.Session(graph=graph) as sess:
+        agent = Agent(session=sess, action_size=envs[0].action_size,
+        model=model, optimizer=make_optimizer(optimizer, LEARNING_RATE,
+        update_mode), update_lock=make_update_lock(update_mode))
+        sess.run(tf.global_variables_initializer())
+
+        steps = [0] * num_threads
+        episode_rewards = []
+        deadline = time() + seconds
+        threads = [threading.Thread(target=worker, args=(agent, envs[i],
+        deadline, steps, episode_rewards, i,)) for i in range(num_threads)]
+        start_time = time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        steps_per_second = sum(steps) / (time() - start_time)
+    last_rewards = episode_rewards[-num_last_episodes:]
+    average_reward = np.mean(last_rewards) if len(last_rewards) > 0 else \
+    float('nan')
+    return steps_per_second, average_reward, len(episode_rewards)
+
+def main(argv):
+    num_threads = 8
+    seconds = 60.0
+    games = ['CartPole-v0', 'Catch']
+    try:
+        opts, args = getopt.getopt(argv, 't:s:g:')
+    except getopt.GetoptError:
+        print('Usage: python benchmark_optimizer.py -t <num threads>',
+        '-s <seconds per run> -g <game name>')
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-t':
+            num_threads = int(arg)
+        elif opt == '-s':
+            seconds = float(arg)
+        elif opt == '-g':
+            games = [arg]
+
+    for game_name in games:
+        try:
+            make_env(game_name)
+        except Exception as e:
+            print('Could not make', game_name, '(' + str(e) + '), so skipping')
+            continue
+        print(game_name, 'with', num_threads, 'threads for', seconds,
+        'seconds per run')
+        print('optimizer  update mode  steps/sec  episodes  avg reward (last 20)')
+        for optimizer in OPTIMIZERS:
+            for update_mode in UPDATE_MODES:
+                steps_per_second, average_reward, num_episodes = run(game_name,
+                optimizer, update_mode, num_threads, seconds)
+                print('{:9s}  {:11s}  {:9.1f}  {:8d}  {:10.2f}'.format(optimizer,
+                update_mode, steps_per_second, num_episodes, average_reward))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
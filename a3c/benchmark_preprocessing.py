@@ -0,0 +1,81 @@
+# coding: utf-8
+# Compares the speed and output of AtariPreprocessor with the skimage path
+# CustomGym.preprocess used to take. Uses real frames if gym can make the game,
+# and otherwise synthetic Atari-like frames of flat coloured rectangles.
+import sys, getopt
+from time import time
+import numpy as np
+from skimage.transform import resize
+from skimage import img_as_float
+from preprocessing import AtariPreprocessor
+
+# The preprocessing CustomGym.preprocess used to do.
+def skimage_preprocess(obs, w=84, h=84):
+    grayscale = img_as_float(obs).mean(2)
+    return resize(grayscale, (w, h))
+
+def synthetic_frames(num_frames, h=210, w=160):
+    frames = []
+    for _ in range(num_frames):
+        frame = np.zeros((h, w, 3), dtype=np.uint8)
+        for _ in range(20):
+            y, x = np.random.randint(0, h-8), np.random.randint(0, w-8)
+            dy, dx = np.random.randint(2, 16), np.random.randint(2, 16)
+            frame[y:y+dy, x:x+dx] = np.random.randint(0, 256, 3)
+        frames.append(frame)
+    return frames
+
+def game_frames(game_name, num_frames):
+    import gym
+    env = gym.make(game_name)
+    frames = [env.reset()]
+    while len(frames) < num_frames:
+        obs, _, terminal, _ = env.step(env.action_space.sample())
+        frames.append(env.reset() if terminal else obs)
+    return frames
+
+# Returns the time per frame in microseconds, and the outputs.
+def run(preprocess, frames):
+    outputs = []
+    start_time = time()
+    for frame in frames:
+        outputs.append(np.copy(preprocess(frame)))
+    return 1e6 * (time() - start_time) / len(frames), outputs
+
+def main(argv):
+    num_frames = 1000
+    game_name = 'SpaceInvaders-v0'
+    try:
+        opts, args = getopt.getopt(argv, 'n:g:')
+    except getopt.GetoptError:
+        print('Usage: python benchmark_preprocessing.py -n <num frames>',
+        '-g <game name>')
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-n':
+            num_frames = int(arg)
+        elif opt == '-g':
+            game_name = arg
+    try:
+        frames = game_frames(game_name, num_frames)
+        print('Using frames from', game_name)
+    except Exception as e:
+        print('Could not make', game_name, '(' + str(e) + '), so using',
+        'synthetic frames')
+        frames = synthetic_frames(num_frames)
+
+    skimage_us, skimage_outputs = run(skimage_preprocess, frames)
+    print('skimage                  {:8.1f} us/frame'.format(skimage_us))
+    for dtype in [np.float32, np.uint8]:
+        preprocessor = AtariPreprocessor(dtype=dtype)
+        us, outputs = run(preprocessor, frames)
+        print('AtariPreprocessor {:7s}{:8.1f} us/frame  ({:.1f}x faster)'.format(
+        np.dtype(dtype).name, us, skimage_us / us))
+        # Compare on the same [0, 1] scale as the skimage output.
+        scale = 1.0 if dtype == np.float32 else 1.0 / 255.0
+        diffs = np.abs(np.array(outputs) * scale - np.array(skimage_outputs))
+        print('    mean abs difference {:.4f}, max abs difference {:.4f}'.format(
+        np.mean(diffs), np.max(diffs)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,51 @@
+# coding: utf-8
+# Compares the speed of the returns module with the python loops it replaced,
+# which test_returns.py checks it against, on single trajectories and on
+# batches.
+import sys, getopt
+from time import time
+import numpy as np
+from returns import discounted_returns, gae
+from test_returns import loop_discounted_returns, loop_gae, GAMMA, LAMBDA
+
+# Returns the time per call in microseconds.
+def time_per_call(f, num_calls):
+    start_time = time()
+    for _ in range(num_calls):
+        f()
+    return 1e6 * (time() - start_time) / num_calls
+
+def main(argv):
+    num_calls = 100
+    try:
+        opts, args = getopt.getopt(argv, 'n:')
+    except getopt.GetoptError:
+        print('Usage: python benchmark_returns.py -n <num calls>')
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-n':
+            num_calls = int(arg)
+
+    print('case                    loop us/call  vectorized us/call  speedup')
+    for N, T in [(1, 5), (1, 1000), (1, 20000), (16, 5), (16, 1000)]:
+        rewards = np.random.randn(N, T).astype(np.float32)
+        values = np.random.randn(N, T).astype(np.float32)
+        dones = np.random.rand(N, T) < 0.01
+        bootstrap = np.random.randn(N).astype(np.float32)
+        # A single trajectory is passed as one, so short ones take the loop.
+        single = lambda a: a[0] if N == 1 else a
+        for name, loop, vectorized in [
+            ('returns', lambda: [loop_discounted_returns(rewards[n], dones[n],
+            GAMMA) for n in range(N)], lambda: discounted_returns(single(rewards),
+            GAMMA, single(dones), single(bootstrap))),
+            ('gae', lambda: [loop_gae(rewards[n], values[n], dones[n], GAMMA,
+            LAMBDA, bootstrap[n]) for n in range(N)], lambda: gae(
+            single(rewards), single(values), GAMMA, LAMBDA, single(dones),
+            single(bootstrap)))]:
+            loop_us = time_per_call(loop, num_calls)
+            vectorized_us = time_per_call(vectorized, num_calls)
+            print('{:7s} N={:2d} T={:5d}  {:12.1f}  {:18.1f}  {:6.1f}x'.format(
+            name, N, T, loop_us, vectorized_us, loop_us / vectorized_us))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,72 @@
+# coding: utf-8
+# Compares the throughput of the shared queue.Queue step counter that the async
+# trainers used to use with the StepCounter, as the number of threads grows.
+import sys, getopt
+import queue
+import threading
+from time import time
+from step_counter import StepCounter
+
+STEPS_PER_THREAD = 200000
+
+def queue_worker(T_queue, num_steps):
+    for _ in range(num_steps):
+        T = T_queue.get()
+        T_queue.put(T+1)
+
+def step_counter_worker(step_counter, worker_idx, num_steps):
+    worker_counter = step_counter.worker(worker_idx)
+    for _ in range(num_steps):
+        T = worker_counter.increment()
+    worker_counter.publish()
+
+# Runs num_threads threads that each take num_steps steps, and returns the
+# total steps per second and the final value of T.
+def run_queue(num_threads, num_steps):
+    T_queue = queue.Queue()
+    T_queue.put(0)
+    threads = [threading.Thread(target=queue_worker, args=(T_queue,
+    num_steps,)) for _ in range(num_threads)]
+    start_time = time()
+    for p in threads:
+        p.start()
+    for p in threads:
+        p.join()
+    elapsed = time() - start_time
+    return num_threads * num_steps / elapsed, T_queue.get()
+
+def run_step_counter(num_threads, num_steps):
+    step_counter = StepCounter(num_threads)
+    threads = [threading.Thread(target=step_counter_worker, args=(step_counter,
+    i, num_steps,)) for i in range(num_threads)]
+    start_time = time()
+    for p in threads:
+        p.start()
+    for p in threads:
+        p.join()
+    elapsed = time() - start_time
+    return num_threads * num_steps / elapsed, step_counter.value()
+
+def main(argv):
+    num_steps = STEPS_PER_THREAD
+    thread_counts = [1, 2, 4, 8, 16, 32]
+    try:
+        opts, args = getopt.getopt(argv, 'n:')
+    except getopt.GetoptError:
+        print('Usage: python benchmark_step_counter.py -n <steps per thread>')
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-n':
+            num_steps = int(arg)
+    print('threads  queue steps/s  StepCounter steps/s  speedup')
+    for num_threads in thread_counts:
+        queue_rate, queue_T = run_queue(num_threads, num_steps)
+        counter_rate, counter_T = run_step_counter(num_threads, num_steps)
+        # Both counters should agree on the total once every thread has
+        # finished.
+        assert queue_T == counter_T == num_threads * num_steps
+        print('{:7d}  {:13.0f}  {:19.0f}  {:7.1f}x'.format(num_threads,
+        queue_rate, counter_rate, counter_rate / queue_rate))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
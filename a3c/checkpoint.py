@@ -0,0 +1,155 @@
+# coding: utf-8
+# Writes checkpoints in a background thread, so that training is only blocked
+# for as long as it takes to copy the values into host memory.
+#
+# A checkpoint for step T is written to save_path-T.npz. We write it to a
+# temporary file first and then rename it, so a checkpoint file is either
+# complete or not there at all. A checkpoint that is at least keep_every_steps
+# steps or keep_every_seconds seconds after the last one we kept for good is
+# kept for good too. Of the rest, we only keep the max_to_keep most recent
+# (or all of them, if max_to_keep is None).
+#
+# If writing a checkpoint fails, the background thread carries on with the next
+# one, and wait raises the error.
+import os
+import glob
+import threading
+import queue
+from time import time
+import numpy as np
+
+def checkpoint_path(save_path, step):
+    return save_path + '-' + str(step) + '.npz'
+
+# Returns the step of the most recent checkpoint under save_path, or None if
+# there aren't any.
+def latest_step(save_path):
+    steps = []
+    for path in glob.glob(save_path + '-*.npz'):
+        step = path[len(save_path)+1:-len('.npz')]
+        if step.isdigit():
+            steps.append(int(step))
+    return max(steps) if len(steps) > 0 else None
+
+# Returns a dictionary from names to arrays.
+def load_checkpoint(path):
+    with np.load(path) as checkpoint:
+        return {name: checkpoint[name] for name in checkpoint.files}
+
+# Loads the values in the checkpoint into the given tensorflow variables.
+# Variable.load feeds the variable's initializer, so this doesn't add any ops
+# to the graph.
+def restore_session(sess, variables, path):
+    values = load_checkpoint(path)
+    for variable in variables:
+        if variable.name in values:
+            variable.load(values[variable.name], sess)
+        else:
+            print('Checkpoint', path, 'has no value for', variable.name)
+
+class CheckpointWriter:
+    def __init__(self, save_path, max_to_keep=2, keep_every_steps=None,
+        keep_every_seconds=None):
+        self.save_path = save_path
+        self.max_to_keep = max_to_keep
+        self.keep_every_steps = keep_every_steps
+        self.keep_every_seconds = keep_every_seconds
+
+        # The (step, time, path) of the checkpoints that we may delete later.
+        self.recent = []
+        self.last_kept_step = None
+        self.last_kept_time = time()
+
+        # How long the last save blocked the caller, and how long the
+        # background thread took to write it.
+        self.snapshot_seconds = 0.0
+        self.write_seconds = 0.0
+        self.num_written = 0
+        # The first error writing a checkpoint that wait hasn't raised yet.
+        self.error = None
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Queues a checkpoint of values, a dictionary from names to arrays, for the
+    # given step. If copy is False, the arrays must not be changed afterwards.
+    # Returns the path the checkpoint will be written to.
+    def save(self, step, values, copy=True):
+        start_time = time()
+        if copy:
+            values = {name: np.copy(value) for name, value in values.items()}
+        self.queue.put((step, values))
+        self.snapshot_seconds = time() - start_time
+        return checkpoint_path(self.save_path, step)
+
+    # Fetches the values of the given tensorflow variables in one session call,
+    # and queues them to be written.
+    def save_session(self, sess, variables, step):
+        start_time = time()
+        values = sess.run(variables)
+        path = self.save(step, {v.name: value for v, value in zip(variables,
+        values)}, copy=False)
+        self.snapshot_seconds = time() - start_time
+        return path
+
+    def run(self):
+        while True:
+            step, values = self.queue.get()
+            try:
+                self.write(step, values)
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, step, values):
+        start_time = time()
+        path = checkpoint_path(self.save_path, step)
+        tmp_path = path + '.tmp.npz'
+        try:
+            np.savez(tmp_path, **values)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.apply_retention(step, path)
+        self.write_seconds = time() - start_time
+        self.num_written += 1
+
+    def apply_retention(self, step, path):
+        now = time()
+        keep = False
+        if self.keep_every_steps is not None:
+            if self.last_kept_step is None or \
+            step - self.last_kept_step >= self.keep_every_steps:
+                keep = True
+        if self.keep_every_seconds is not None:
+            if now - self.last_kept_time >= self.keep_every_seconds:
+                keep = True
+        if keep:
+            self.last_kept_step = step
+            self.last_kept_time = now
+        else:
+            self.recent.append((step, now, path))
+
+        if self.max_to_keep is None:
+            return
+        while len(self.recent) > self.max_to_keep:
+            _, _, old_path = self.recent.pop(0)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    # Blocks until every queued checkpoint has been written, and raises the
+    # first error writing one since the last wait, if there was one.
+    def wait(self):
+        self.queue.join()
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def print_latency(self):
+        print('Checkpoint blocked training for {:.3f}s, and took {:.3f}s to \
+write in the background'.format(self.snapshot_seconds, self.write_seconds))
@@ -1,9 +1,11 @@
-#from scipy.misc import imresize
-from skimage.transform import resize
-from skimage import img_as_float
 import gym
 import numpy as np
 import random
+import multiprocessing
+from time import perf_counter
+from frame_stack import FrameStack
+from preprocessing import AtariPreprocessor
+from frameskip import FrameSkipper
 
 
 
@@ -23,44 +25,128 @@ class CustomGym:
         else:
             # Use the actions specified by Open AI. Sometimes this has more
             # actions than we want, and some actions do the same thing.
-            self.action_space = range(env.action_space.n)
+            self.action_space = range(self.env.action_space.n)
 
         self.action_size = len(self.action_space)
         self.observation_shape = self.env.observation_space.shape
 
-        self.state = None
+        # Converts frames to grayscale in [0, 1] and downsamples them to w x h.
+        self.preprocessor = AtariPreprocessor(self.observation_shape[0],
+        self.observation_shape[1], h, w)
+        self.frames = FrameStack(num_frames, h, w)
         self.game_name = game_name
+        # Repeats each action skip_actions times. For Space Invaders, it also
+        # takes the maximum value for each pixel over the last two frames, to
+        # get round sprites flickering (Mnih et al. (2015)).
+        self.frameskip = FrameSkipper(self.env, skip_actions,
+        max_pool=(game_name == 'SpaceInvaders-v0'))
+        # The total time spent preprocessing, so that the trainers can time it
+        # separately from the emulator.
+        self.preprocess_seconds = 0.0
 
     def preprocess(self, obs, is_start=False):
-#        grayscale = obs.astype('float32').mean(2)
-        grayscale = img_as_float(obs).mean(2)        
-#        s = resize(grayscale, (self.w, self.h)).astype('float32') * (1.0/255.0)        
-        s = resize(grayscale, (self.w, self.h))
-        s = s.reshape(1, s.shape[0], s.shape[1], 1)
-        if is_start or self.state is None:
-            self.state = np.repeat(s, self.num_frames, axis=3)
+        start_time = perf_counter()
+        s = self.preprocessor(obs)
+        # Returns a read-only view of the frame stack, which changes on the
+        # next step. Callers that keep states around need to copy them.
+        if is_start:
+            state = self.frames.reset(s)
         else:
-            self.state = np.append(s, self.state[:,:,:,:self.num_frames-1], axis=3)
-        return self.state
+            state = self.frames.push(s)
+        self.preprocess_seconds += perf_counter() - start_time
+        return state
 
     def render(self):
         self.env.render()
 
     def reset(self):
-        return self.preprocess(self.env.reset(), is_start=True)
+        return self.preprocess(self.frameskip.reset(), is_start=True)
 
     def step(self, action_idx):
         action = self.action_space[action_idx]
-        accum_reward = 0
-        prev_s = None
-        for _ in range(self.skip_actions):
-            s, r, term, info = self.env.step(action)
-            accum_reward += r
-            if term:
-                break
-            prev_s = s
-        # Takes maximum value for each pixel value over the current and previous
-        # frame. Used to get round Atari sprites flickering (Mnih et al. (2015))
-        if self.game_name == 'SpaceInvaders-v0' and prev_s is not None:
-            s = np.maximum.reduce([s, prev_s])
+        s, accum_reward, term, info = self.frameskip.step(action)
         return self.preprocess(s), accum_reward, term, info
+
+# Runs in a subprocess, and steps env in response to commands sent down remote.
+def env_worker(remote, parent_remote, env_fn):
+    parent_remote.close()
+    env = env_fn()
+    while True:
+        cmd, data = remote.recv()
+        if cmd == 'step':
+            state, reward, terminal, info = env.step(data)
+            if terminal:
+                state = env.reset()
+            remote.send((state, reward, terminal, info))
+        elif cmd == 'reset':
+            remote.send(env.reset())
+        elif cmd == 'action_size':
+            remote.send(env.action_size)
+        elif cmd == 'close':
+            remote.close()
+            break
+
+# Steps several environments together. env_fns is a list of functions that
+# each create one environment, e.g. lambda: CustomGym('SpaceInvaders-v0').
+# States are stacked along the first dimension, so for N CustomGyms they have
+# shape (N, h, w, num_frames). When an environment reaches a terminal state it
+# is reset straight away, and the state returned for it is the first state of
+# the new episode.
+# If use_subprocesses is True, each environment runs in its own process.
+class VecCustomGym:
+    def __init__(self, env_fns, use_subprocesses=False):
+        self.num_envs = len(env_fns)
+        self.use_subprocesses = use_subprocesses
+        if use_subprocesses:
+            # Fork, so that env_fns don't have to be picklable.
+            context = multiprocessing.get_context('fork')
+            pipes = [context.Pipe() for _ in range(self.num_envs)]
+            self.remotes = [remote for remote, _ in pipes]
+            self.processes = []
+            for (remote, worker_remote), env_fn in zip(pipes, env_fns):
+                p = context.Process(target=env_worker, args=(worker_remote,
+                remote, env_fn,))
+                p.daemon = True
+                p.start()
+                worker_remote.close()
+                self.processes.append(p)
+            self.remotes[0].send(('action_size', None))
+            self.action_size = self.remotes[0].recv()
+        else:
+            self.envs = [env_fn() for env_fn in env_fns]
+            self.action_size = self.envs[0].action_size
+
+    def reset(self):
+        if self.use_subprocesses:
+            for remote in self.remotes:
+                remote.send(('reset', None))
+            states = [remote.recv() for remote in self.remotes]
+        else:
+            states = [env.reset() for env in self.envs]
+        return np.concatenate(states, axis=0)
+
+    # Takes one action index per environment. Returns the stacked states, and
+    # arrays of the rewards and terminals, and a list of the infos.
+    def step(self, action_idxs):
+        if self.use_subprocesses:
+            for remote, action_idx in zip(self.remotes, action_idxs):
+                remote.send(('step', action_idx))
+            results = [remote.recv() for remote in self.remotes]
+        else:
+            results = []
+            for env, action_idx in zip(self.envs, action_idxs):
+                state, reward, terminal, info = env.step(action_idx)
+                if terminal:
+                    state = env.reset()
+                results.append((state, reward, terminal, info))
+        states, rewards, terminals, infos = zip(*results)
+        return np.concatenate(states, axis=0), \
+        np.array(rewards, dtype=np.float32), np.array(terminals, dtype=bool), \
+        list(infos)
+
+    def close(self):
+        if self.use_subprocesses:
+            for remote in self.remotes:
+                remote.send(('close', None))
+            for p in self.processes:
+                p.join()
@@ -6,9 +6,9 @@ class CustomGymClassicControl:
     def __init__(self, game_name, skip_actions=4):
         self.env = gym.make(game_name)
         self.skip_actions = skip_actions
-        self.action_size = env.action_space.n
+        self.action_size = self.env.action_space.n
         self.action_space = range(self.action_size)
-        self.observation_shape = env.observation_space.shape
+        self.observation_shape = self.env.observation_space.shape
 
         self.state = None
 
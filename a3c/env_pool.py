@@ -0,0 +1,57 @@
+# coding: utf-8
+# A pool of environments, which builds them in parallel and keeps them warm
+# between runs in the same process.
+#
+# Making an Atari environment loads the ROM and starts the emulator, so making
+# one per worker one after another made start-up slow with many workers. take
+# builds the environments the pool doesn't already have on a thread pool: the
+# emulator does its start-up work outside the GIL, so the threads overlap.
+# Environments given back with put are reused by the next take, so e.g. the runs
+# of a hyperparameter sweep in one process only pay for them once.
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+# The most environments to build at once.
+MAX_WORKERS = 16
+
+class EnvPool:
+    # make_env takes a game name and returns a new environment.
+    def __init__(self, make_env, max_workers=MAX_WORKERS):
+        self.make_env = make_env
+        self.max_workers = max_workers
+        self.envs = {}
+        self.lock = threading.Lock()
+
+    # Returns num_envs environments for game_name, using warm ones first, and
+    # prints how long it took.
+    def take(self, game_name, num_envs):
+        start_time = time()
+        with self.lock:
+            warm = self.envs.get(game_name, [])
+            envs = warm[:num_envs]
+            self.envs[game_name] = warm[num_envs:]
+        num_reused = len(envs)
+        num_new = num_envs - num_reused
+        if num_new > 0:
+            with ThreadPoolExecutor(max_workers=min(num_new,
+                self.max_workers)) as executor:
+                envs += list(executor.map(self.make_env, [game_name] * num_new))
+        print('Made', num_new, 'and reused', num_reused, game_name,
+        'environments in', '{:.2f}'.format(time() - start_time), 'seconds')
+        return envs
+
+    # Gives environments back to the pool, for the next take to reuse. They
+    # are reset before they are next used, so they can be given back mid
+    # episode.
+    def put(self, game_name, envs):
+        with self.lock:
+            self.envs.setdefault(game_name, []).extend(envs)
+
+    # Closes all the warm environments and empties the pool.
+    def close(self):
+        with self.lock:
+            envs = [env for game_envs in self.envs.values() for env in game_envs]
+            self.envs = {}
+        for env in envs:
+            env.env.close()
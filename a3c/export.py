@@ -0,0 +1,147 @@
+# coding: utf-8
+# Exports an A3C checkpoint as a frozen, inference-only graph, and loads it back
+# to play.
+#
+# The training graph has the optimizer and its slots, the gradients, the
+# clipping and the ops to set the weights on top of the network. export keeps
+# only the ops that go from the states to the policy, the value and the sampled
+# actions, with the weights folded in as constants. FrozenAgent loads such a
+# graph into its own session, so there are no variables to initialise or
+# restore, and nothing is kept for training.
+import os
+import sys, getopt
+from time import time
+import tensorflow as tf
+from agent import Agent
+from checkpoint import checkpoint_path, restore_session
+
+# The names of the tensors FrozenAgent feeds and fetches. policy and value are
+# identities we add to the training graph when exporting, so that they don't
+# depend on the model's layer names.
+STATE = 'network/state'
+TEMPERATURE = 'act/temperature'
+GREEDY = 'act/greedy'
+POLICY = 'frozen/policy'
+VALUE = 'frozen/value'
+SAMPLED_ACTION = 'act/sampled_action'
+SAMPLED_LOG_PROB = 'act/sampled_log_prob'
+SAMPLED_VALUE = 'act/sampled_value'
+OUTPUTS = [POLICY, VALUE, SAMPLED_ACTION, SAMPLED_LOG_PROB, SAMPLED_VALUE]
+
+def frozen_path(save_path, T):
+    return save_path + '-' + str(T) + '.pb'
+
+# Restores the checkpoint for step T under save_path into the session.
+def restore_checkpoint(sess, save_path, T):
+    path = checkpoint_path(save_path, T)
+    if os.path.exists(path):
+        restore_session(sess, tf.global_variables(), path)
+    else:
+        # Fall back to checkpoints written by tf.train.Saver.
+        tf.train.Saver().restore(sess, save_path + '-' + str(T))
+
+# Builds an agent with the given action size and model, restores the checkpoint
+# for step T under save_path, and writes the frozen graph to path. Returns the
+# number of nodes in the training graph and in the frozen graph.
+def export(save_path, T, action_size, model, path):
+    graph = tf.Graph()
+    with graph.as_default(), tf.Session(graph=graph) as sess:
+        agent = Agent(session=sess, action_size=action_size, model=model)
+        with tf.variable_scope('frozen'):
+            tf.identity(agent.policy, name='policy')
+            tf.identity(agent.value, name='value')
+        sess.run(tf.global_variables_initializer())
+        restore_checkpoint(sess, save_path, T)
+        graph_def = graph.as_graph_def()
+        frozen_graph_def = tf.graph_util.convert_variables_to_constants(sess,
+        graph_def, OUTPUTS)
+    with tf.gfile.GFile(path, 'wb') as f:
+        f.write(frozen_graph_def.SerializeToString())
+    return len(graph_def.node), len(frozen_graph_def.node)
+
+# Has the inference methods of Agent, on a graph written by export.
+class FrozenAgent:
+    def __init__(self, path, config=None):
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        # Nothing should add to the graph from here on.
+        self.graph.finalize()
+        self.sess = tf.Session(graph=self.graph, config=config)
+
+        tensor = lambda name: self.graph.get_tensor_by_name(name + ':0')
+        self.state = tensor(STATE)
+        self.temperature = tensor(TEMPERATURE)
+        self.greedy = tensor(GREEDY)
+        self.policy = tensor(POLICY)
+        self.value = tensor(VALUE)
+        self.sampled_action = tensor(SAMPLED_ACTION)
+        self.sampled_log_prob = tensor(SAMPLED_LOG_PROB)
+        self.sampled_value = tensor(SAMPLED_VALUE)
+        self.action_size = self.policy.get_shape()[1].value
+
+    def get_policy(self, state):
+        return self.sess.run(self.policy, {self.state: state}).flatten()
+
+    def get_value(self, state):
+        return self.sess.run(self.value, {self.state: state}).flatten()
+
+    def get_policy_and_value(self, state):
+        policy, value = self.sess.run([self.policy, self.value], {self.state:
+        state})
+        return policy.flatten(), value.flatten()
+
+    # Returns the sampled actions and the values for a batch of states, and the
+    # log-probabilities of the actions if log_probs is True.
+    def act(self, states, temperature=1.0, greedy=False, log_probs=False):
+        fetches = [self.sampled_action, self.sampled_value]
+        if log_probs:
+            fetches.append(self.sampled_log_prob)
+        return tuple(self.sess.run(fetches, {self.state: states,
+        self.temperature: temperature, self.greedy: greedy}))
+
+    def close(self):
+        self.sess.close()
+
+def main(argv):
+    save_path = None
+    T = None
+    game_name = None
+    path = None
+    try:
+        opts, args = getopt.getopt(argv, 'g:s:T:o:')
+    except getopt.GetoptError:
+        print('Usage: python export.py -g <game name> -s <save path> -T <T>',
+        '-o <frozen graph path>')
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-g':
+            game_name = arg
+        elif opt == '-s':
+            save_path = arg
+        elif opt == '-T':
+            T = int(arg)
+        elif opt == '-o':
+            path = arg
+    if game_name is None or save_path is None or T is None:
+        print('Usage: python export.py -g <game name> -s <save path> -T <T>',
+        '-o <frozen graph path>')
+        sys.exit(2)
+    if path is None:
+        path = frozen_path(save_path, T)
+
+    from a3c import make_env
+    env = make_env(game_name)
+    start_time = time()
+    num_nodes, num_frozen_nodes = export(save_path, T, env.action_size, 'mnih',
+    path)
+    print('Exported', checkpoint_path(save_path, T), 'to', path, 'in',
+    '{:.2f}'.format(time() - start_time), 'seconds')
+    print('Kept', num_frozen_nodes, 'of', num_nodes, 'nodes, and',
+    os.path.getsize(path), 'bytes')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,39 @@
+# coding: utf-8
+# Keeps the last num_frames preprocessed frames of an environment in a
+# preallocated circular buffer, so adding a frame doesn't allocate or copy the
+# other frames.
+#
+# The stacked state has shape (1, h, w, num_frames), with the newest frame first.
+# We store every frame twice, num_frames channels apart, so the stacked state is
+# always one slice of the buffer and we never have to unwrap the ring.
+import numpy as np
+
+class FrameStack:
+    def __init__(self, num_frames, h, w, dtype=np.float32):
+        self.num_frames = num_frames
+        self.buffer = np.zeros((1, h, w, 2*num_frames), dtype=dtype)
+        self.pos = 0
+
+    # Start a new stack with the given (h, w) frame repeated num_frames times.
+    def reset(self, frame):
+        self.pos = 0
+        self.buffer[0] = frame[:,:,np.newaxis]
+        return self.view()
+
+    # Add a new frame to the front of the stack, dropping the oldest one.
+    def push(self, frame):
+        self.pos = (self.pos - 1) % self.num_frames
+        self.buffer[0,:,:,self.pos] = frame
+        self.buffer[0,:,:,self.pos+self.num_frames] = frame
+        return self.view()
+
+    # Returns a read-only view of the stacked frames. The view changes when the
+    # next frame is pushed, so copy it if you need to keep it.
+    def view(self):
+        state = self.buffer[:,:,:,self.pos:self.pos+self.num_frames]
+        state.flags.writeable = False
+        return state
+
+    # Returns a contiguous copy of the stacked frames.
+    def copy(self):
+        return np.ascontiguousarray(self.view())
@@ -0,0 +1,110 @@
+# coding: utf-8
+# Repeats each action for skip_actions steps of a gym environment, and returns
+# the pixelwise maximum of the last two frames, to get round Atari sprites
+# flickering (Mnih et al. (2015)).
+#
+# The frames are written into two preallocated uint8 buffers and the maximum
+# is taken in place, so nothing is allocated per step. For Atari games we step
+# the emulator directly: every frame but the last two is emulated without
+# fetching the screen, and the last two screens are copied straight into the
+# buffers. Otherwise we step the gym environment and copy its last two
+# observations into the buffers.
+#
+# The two paths pool different frames. For Atari games, the two frames are the
+# last two emulator frames, one frame apart, as in Mnih et al. Before, and still
+# for other environments, they were the observations of the last two gym steps,
+# which for an Atari game are env.frameskip emulator frames apart. A flickering
+# sprite that is drawn on alternate frames is only caught by the first.
+import numpy as np
+
+class FrameSkipper:
+    def __init__(self, env, skip_actions=4, max_pool=True):
+        self.env = env
+        self.skip_actions = skip_actions
+        self.max_pool = max_pool
+        self.buffers = np.zeros((2,) + env.observation_space.shape,
+        dtype=np.uint8)
+
+        # Use the emulator directly if the gym environment is an Atari game
+        # that we can step in the same way as gym does.
+        atari = env.unwrapped
+        self.ale = getattr(atari, 'ale', None)
+        if self.ale is not None and not (hasattr(atari, '_action_set') and
+            hasattr(atari, 'frameskip') and
+            getattr(atari, '_obs_type', None) == 'image'):
+            self.ale = None
+        if self.ale is not None:
+            # Fill the buffers the same way gym gets its observations.
+            self.get_screen = getattr(self.ale, 'getScreenRGB2',
+            self.ale.getScreenRGB)
+        # Stepping the emulator bypasses gym's TimeLimit, so we count steps.
+        self.max_episode_steps = getattr(env, '_max_episode_steps', None)
+        self.elapsed_steps = 0
+
+    def reset(self):
+        self.elapsed_steps = 0
+        self.buffers[0][...] = self.env.reset()
+        return self.buffers[0]
+
+    # Returns the max-pooled frame, the total reward, terminal and info. The
+    # frame is a buffer that is overwritten on the next step, but info is not
+    # reused.
+    def step(self, action):
+        if self.ale is not None:
+            reward, terminal, num_frames = self.step_emulator(action)
+            # A new dictionary each step, as gym gives, since callers such as
+            # VecCustomGym keep the infos of several steps.
+            info = {'ale.lives': self.ale.lives()}
+            self.elapsed_steps += self.skip_actions
+            if self.max_episode_steps is not None and \
+                self.elapsed_steps >= self.max_episode_steps:
+                terminal = True
+        else:
+            reward, terminal, num_frames, info = self.step_env(action)
+        if self.max_pool and num_frames > 1:
+            np.maximum(self.buffers[0], self.buffers[1], out=self.buffers[0])
+        return self.buffers[0], reward, terminal, info
+
+    # Each gym step repeats the action for env.frameskip emulator frames, or a
+    # random number of frames in [low, high) if it is a tuple. The screen of
+    # the last emulator frame goes in buffers[0], and that of the emulator
+    # frame just before it in buffers[1]. Returns the reward, terminal and the
+    # number of frames to max-pool over: we only pool two frames from the same
+    # episode.
+    def step_emulator(self, action):
+        atari = self.env.unwrapped
+        ale_action = atari._action_set[action]
+        frameskip = atari.frameskip
+        num_frames = 0
+        for _ in range(self.skip_actions):
+            if isinstance(frameskip, int):
+                num_frames += frameskip
+            else:
+                num_frames += atari.np_random.randint(frameskip[0],
+                frameskip[1])
+        reward = 0
+        for frame in range(num_frames):
+            reward += self.ale.act(ale_action)
+            if self.ale.game_over():
+                self.get_screen(self.buffers[0])
+                return reward, True, 1
+            if frame == num_frames - 2:
+                self.get_screen(self.buffers[1])
+        self.get_screen(self.buffers[0])
+        return reward, False, num_frames
+
+    def step_env(self, action):
+        reward = 0
+        num_frames = 0
+        for i in range(self.skip_actions):
+            s, r, terminal, info = self.env.step(action)
+            reward += r
+            num_frames += 1
+            if terminal or i == self.skip_actions - 1:
+                self.buffers[0][...] = s
+                break
+            if i == self.skip_actions - 2:
+                self.buffers[1][...] = s
+        if terminal:
+            num_frames = 1
+        return reward, terminal, num_frames, info
@@ -0,0 +1,106 @@
+# coding: utf-8
+# A central inference server for the A3C workers, as in GA3C
+# (https://arxiv.org/abs/1611.06256). Rather than every worker running its own
+# forward pass on a batch of one state, workers submit their states to a queue.
+# A predictor thread stacks whatever has arrived, up to max_batch_size states or
+# until timeout seconds have passed since the first one, and runs one forward
+# pass for the whole batch, which also samples the actions. The action and value
+# are then sent back to each worker.
+import threading
+import queue
+from time import time
+import numpy as np
+
+MAX_BATCH_SIZE = 8
+TIMEOUT = 0.005
+
+class InferenceServer:
+    def __init__(self, agent, max_batch_size=MAX_BATCH_SIZE, timeout=TIMEOUT):
+        self.agent = agent
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.requests = queue.Queue()
+        # batch_size_counts[n] is the number of forward passes we ran on a
+        # batch of n states.
+        self.batch_size_counts = np.zeros(max_batch_size+1, dtype=np.int64)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.thread.join()
+
+    # Each worker should get its own client.
+    def client(self):
+        return InferenceClient(self)
+
+    # Wait for the next batch of requests. Returns an empty list if nothing
+    # arrived, so that we can check whether we have been stopped.
+    def next_batch(self):
+        try:
+            batch = [self.requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time() + self.timeout
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while not self.stopped:
+            batch = self.next_batch()
+            if len(batch) == 0:
+                continue
+            states = np.vstack([state for state, _ in batch])
+            actions, values = self.agent.act(states)
+            for i, (_, client) in enumerate(batch):
+                client.respond(actions[i:i+1], values[i:i+1])
+            self.batch_size_counts[len(batch)] += 1
+
+    # Returns a dictionary from batch size to the number of forward passes run
+    # with that batch size.
+    def batch_size_histogram(self):
+        return {n: int(c) for n, c in enumerate(self.batch_size_counts) if c > 0}
+
+    def average_batch_size(self):
+        num_batches = np.sum(self.batch_size_counts)
+        if num_batches == 0:
+            return 0.0
+        return float(np.dot(np.arange(self.max_batch_size+1),
+        self.batch_size_counts)) / num_batches
+
+    def print_histogram(self):
+        print('Inference batch sizes (size: count)', self.batch_size_histogram())
+        print('Average inference batch size', self.average_batch_size())
+
+# Has the same act and get_value methods as the Agent, for a batch of one
+# state, so the trainers can use either.
+class InferenceClient:
+    def __init__(self, server):
+        self.server = server
+        self.action_size = server.agent.action_size
+        self.ready = threading.Event()
+        self.result = None
+
+    def respond(self, actions, values):
+        self.result = (actions, values)
+        self.ready.set()
+
+    def act(self, state):
+        self.ready.clear()
+        self.server.requests.put((state, self))
+        self.ready.wait()
+        return self.result
+
+    def get_value(self, state):
+        return self.act(state)[1]
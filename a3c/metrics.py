@@ -0,0 +1,41 @@
+# coding: utf-8
+# Writes scalar and histogram summaries for tensorboard without touching the
+# session.
+#
+# write_summary and write_histogram build the tf.Summary protocol buffer on the
+# host and hand it to a tf.summary.FileWriter, so they don't add any ops to the
+# graph or make any session calls. The FileWriter already queues the events and
+# writes them from its own thread, every flush_secs seconds or as soon as
+# max_queue events are waiting, so adding an event doesn't block on the disk.
+import tensorflow as tf
+
+class SummaryWriter:
+    def __init__(self, logdir, graph=None, max_queue=100, flush_secs=10):
+        self.writer = tf.summary.FileWriter(logdir, graph, max_queue=max_queue,
+        flush_secs=flush_secs)
+
+    # summary is a dictionary from tags to scalar values, t is the global step.
+    def write_summary(self, summary, t):
+        event = tf.Summary(value=[tf.Summary.Value(tag=tag,
+        simple_value=float(value)) for tag, value in summary.items()])
+        self.writer.add_summary(event, global_step=t)
+
+    # Writes a histogram that has already been bucketed: bucket_counts[i] is the
+    # number of values up to bucket_limits[i], and above the limit before it.
+    # total is the sum of the values, if known. The minimum and maximum are
+    # taken from the limits of the first and last non-empty buckets.
+    def write_histogram(self, tag, bucket_limits, bucket_counts, t, total=0.0):
+        nonempty = [i for i, count in enumerate(bucket_counts) if count > 0]
+        histogram = tf.HistogramProto(num=float(sum(bucket_counts)),
+        sum=float(total), bucket_limit=[float(l) for l in bucket_limits],
+        bucket=[float(count) for count in bucket_counts])
+        if len(nonempty) > 0:
+            first = nonempty[0]
+            histogram.min = float(bucket_limits[first-1]) if first > 0 else 0.0
+            histogram.max = float(bucket_limits[nonempty[-1]])
+        event = tf.Summary(value=[tf.Summary.Value(tag=tag, histo=histogram)])
+        self.writer.add_summary(event, global_step=t)
+
+    # Writes everything that is queued and closes the event file.
+    def close(self):
+        self.writer.close()
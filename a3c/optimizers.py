@@ -0,0 +1,40 @@
+# coding: utf-8
+# The optimizer the A3C workers share, and how their updates are serialised.
+#
+# All the worker threads train one Agent, so they share its optimizer and its
+# statistics, e.g. for RMSProp the running mean of the squared gradients, as
+# with the shared RMSProp in the async paper. The update mode says how
+# concurrent updates are serialised:
+# - 'locked': one lock around each whole update, so updates never overlap.
+# - 'striped': each variable is updated under its own lock (tensorflow's
+#   use_locking), so updates to different variables can still overlap.
+# - 'hogwild': no locking at all, as in the async paper.
+# SharedParameterStore implements the same optimizers and modes for the
+# process-based workers.
+import threading
+import tensorflow as tf
+
+OPTIMIZERS = ['adam', 'rmsprop']
+UPDATE_MODES = ['locked', 'striped', 'hogwild']
+
+# As in the async paper.
+RMSPROP_DECAY = 0.99
+RMSPROP_EPSILON = 0.1
+
+def make_optimizer(name, learning_rate, update_mode='hogwild'):
+    if update_mode not in UPDATE_MODES:
+        raise ValueError('Unknown update mode ' + str(update_mode))
+    # In locked mode the whole update is already serialised.
+    use_locking = update_mode == 'striped'
+    if name == 'adam':
+        return tf.train.AdamOptimizer(learning_rate, use_locking=use_locking)
+    elif name == 'rmsprop':
+        return tf.train.RMSPropOptimizer(learning_rate, decay=RMSPROP_DECAY,
+        epsilon=RMSPROP_EPSILON, use_locking=use_locking)
+    raise ValueError('Unknown optimizer ' + str(name))
+
+# Returns the lock to hold around each update, or None if there isn't one.
+def make_update_lock(update_mode):
+    if update_mode == 'locked':
+        return threading.Lock()
+    return None
@@ -0,0 +1,140 @@
+# coding: utf-8
+# Per-worker timers for the phases of a training step, so we can see where the
+# wall-clock time goes as we add workers.
+#
+# A worker calls lap(phase) at the end of each phase, which charges the time
+# since its previous lap to that phase: both to its total and to a histogram
+# with BUCKETS_PER_DECADE log-spaced buckets per decade. As with StepCounter,
+# every worker owns its own slots, so recording a lap needs no lock, and
+# readers sum the slots of all the workers.
+#
+# If shared is True, the slots live in shared memory so that the timers can be
+# passed to worker processes as well as threads.
+import math
+import sys
+import multiprocessing
+from time import perf_counter
+import numpy as np
+
+# The phases of an A3C step. 'counter' is the time spent on the shared step
+# counter.
+PHASES = ['env', 'preprocess', 'inference', 'returns', 'gradients', 'counter']
+
+# The buckets go from MIN_SECONDS to MAX_DECADES decades above it, plus one
+# bucket for anything shorter and one for anything longer.
+MIN_SECONDS = 1e-6
+MAX_DECADES = 7
+BUCKETS_PER_DECADE = 4
+NUM_BUCKETS = MAX_DECADES * BUCKETS_PER_DECADE + 2
+
+# Returns the upper limit of each bucket. As in tensorflow's own histograms, the
+# last bucket goes up to the largest float.
+def bucket_limits():
+    return [MIN_SECONDS * 10 ** (i / BUCKETS_PER_DECADE)
+    for i in range(NUM_BUCKETS - 1)] + [sys.float_info.max]
+
+def bucket(seconds):
+    if seconds < MIN_SECONDS:
+        return 0
+    return min(NUM_BUCKETS - 1,
+    1 + int(math.log10(seconds / MIN_SECONDS) * BUCKETS_PER_DECADE))
+
+class PhaseTimers:
+    def __init__(self, num_workers, phases=PHASES, shared=False):
+        self.num_workers = num_workers
+        self.phases = list(phases)
+        num_slots = num_workers * len(self.phases)
+        if shared:
+            self.seconds = multiprocessing.RawArray('d', num_slots)
+            self.counts = multiprocessing.RawArray('q', num_slots * NUM_BUCKETS)
+        else:
+            self.seconds = [0.0] * num_slots
+            self.counts = [0] * (num_slots * NUM_BUCKETS)
+        self.last_totals = None
+
+    # Returns the timer for the given worker. Each worker index should only be
+    # handed to one thread.
+    def worker(self, worker_idx):
+        return WorkerPhaseTimer(self, worker_idx)
+
+    # Returns the seconds spent in each phase, summed over the workers, and the
+    # histogram of the laps of each phase, as arrays of shape (num_phases,)
+    # and (num_phases, NUM_BUCKETS).
+    def totals(self):
+        num_phases = len(self.phases)
+        seconds = np.array(self.seconds[:], dtype=np.float64).reshape(
+        self.num_workers, num_phases).sum(axis=0)
+        counts = np.array(self.counts[:], dtype=np.int64).reshape(
+        self.num_workers, num_phases, NUM_BUCKETS).sum(axis=0)
+        return seconds, counts
+
+    # Returns a dictionary from each phase to a dictionary of its total seconds,
+    # number of laps, mean seconds per lap, fraction of the time spent in all
+    # the phases, and histogram of the laps.
+    # If interval is True, only counts the time since the last call with
+    # interval=True, so only one reader should ask for intervals.
+    def stats(self, interval=False):
+        seconds, counts = self.totals()
+        if interval:
+            totals = seconds, counts
+            if self.last_totals is not None:
+                seconds = seconds - self.last_totals[0]
+                counts = counts - self.last_totals[1]
+            self.last_totals = totals
+        total_seconds = max(seconds.sum(), 1e-12)
+        stats = {}
+        for i, phase in enumerate(self.phases):
+            laps = int(counts[i].sum())
+            stats[phase] = {'seconds': seconds[i], 'laps': laps,
+            'mean': seconds[i] / laps if laps > 0 else 0.0,
+            'fraction': seconds[i] / total_seconds, 'histogram': counts[i]}
+        return stats
+
+    def print_stats(self, stats):
+        print('phase        fraction  mean ms      laps')
+        for phase in self.phases:
+            s = stats[phase]
+            print('{:11s}  {:8.3f}  {:7.3f}  {:8d}'.format(phase, s['fraction'],
+            1e3 * s['mean'], s['laps']))
+
+    # Writes the fraction of time and histogram of each phase to the given
+    # SummaryWriter.
+    def write_summary(self, writer, stats, t):
+        writer.write_summary({'time_fraction/' + phase: stats[phase]['fraction']
+        for phase in self.phases}, t)
+        limits = bucket_limits()
+        for phase in self.phases:
+            s = stats[phase]
+            writer.write_histogram('time/' + phase, limits, s['histogram'], t,
+            total=s['seconds'])
+
+class WorkerPhaseTimer:
+    def __init__(self, timers, worker_idx):
+        self.seconds = timers.seconds
+        self.counts = timers.counts
+        num_phases = len(timers.phases)
+        self.slots = {phase: worker_idx * num_phases + i
+        for i, phase in enumerate(timers.phases)}
+        self.last = perf_counter()
+
+    # Starts the next lap now, without charging the time since the last lap to
+    # any phase.
+    def start(self):
+        self.last = perf_counter()
+
+    # Charges the time since the last lap to phase. If inner_seconds of it were
+    # spent in another phase, e.g. preprocessing inside env.step, they are
+    # charged to inner_phase instead.
+    def lap(self, phase, inner_phase=None, inner_seconds=0.0):
+        now = perf_counter()
+        seconds = now - self.last
+        self.last = now
+        if inner_phase is not None:
+            self.record(inner_phase, inner_seconds)
+            seconds -= inner_seconds
+        self.record(phase, seconds)
+
+    def record(self, phase, seconds):
+        slot = self.slots[phase]
+        self.seconds[slot] += seconds
+        self.counts[slot * NUM_BUCKETS + bucket(seconds)] += 1
@@ -0,0 +1,62 @@
+# coding: utf-8
+# Fast preprocessing of Atari frames: converts an (in_h, in_w, 3) uint8 frame
+# to grayscale and downsamples it to (out_h, out_w) by area averaging.
+#
+# Area averaging is separable, so we precompute one table of weights for the
+# rows and one for the columns. Row i of a table gives the fraction of each
+# input pixel covered by output pixel i, divided by the number of input pixels
+# it covers. The grayscale conversion is folded into the row weights, so each
+# frame costs two uint8 additions and two small matrix multiplications, all
+# written into preallocated buffers.
+import numpy as np
+
+# Returns the (n_out, n_in) matrix of area weights for downsampling n_in pixels
+# to n_out pixels.
+def area_weights(n_in, n_out):
+    scale = float(n_in) / n_out
+    weights = np.zeros((n_out, n_in), dtype=np.float32)
+    for i in range(n_out):
+        start = i * scale
+        end = (i+1) * scale
+        for j in range(int(np.floor(start)), min(int(np.ceil(end)), n_in)):
+            overlap = min(end, j+1) - max(start, j)
+            weights[i, j] = overlap / scale
+    return weights
+
+class AtariPreprocessor:
+    # If dtype is float32, the output is in [0, 1]. If it is uint8, the output
+    # is in [0, 255].
+    def __init__(self, in_h=210, in_w=160, out_h=84, out_w=84,
+        dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        if self.dtype == np.float32:
+            scale = 1.0 / (3.0 * 255.0)
+        elif self.dtype == np.uint8:
+            scale = 1.0 / 3.0
+        else:
+            raise ValueError('dtype must be float32 or uint8, not ' +
+            str(self.dtype))
+        self.row_weights = area_weights(in_h, out_h) * np.float32(scale)
+        self.col_weights = np.ascontiguousarray(area_weights(in_w, out_w).T)
+
+        self.gray_sum = np.empty((in_h, in_w), dtype=np.uint16)
+        self.gray = np.empty((in_h, in_w), dtype=np.float32)
+        self.rows = np.empty((out_h, in_w), dtype=np.float32)
+        self.out = np.empty((out_h, out_w), dtype=np.float32)
+        if self.dtype == np.uint8:
+            self.out_uint8 = np.empty((out_h, out_w), dtype=np.uint8)
+
+    # Returns the preprocessed frame. The result is written into a buffer that
+    # is reused on the next call, so copy it if you need to keep it.
+    def __call__(self, obs):
+        # The sum of three uint8 channels fits in a uint16.
+        np.add(obs[:,:,0], obs[:,:,1], out=self.gray_sum, dtype=np.uint16)
+        np.add(self.gray_sum, obs[:,:,2], out=self.gray_sum, dtype=np.uint16)
+        np.copyto(self.gray, self.gray_sum)
+        np.dot(self.row_weights, self.gray, out=self.rows)
+        np.dot(self.rows, self.col_weights, out=self.out)
+        if self.dtype == np.uint8:
+            np.rint(self.out, out=self.out)
+            np.copyto(self.out_uint8, self.out, casting='unsafe')
+            return self.out_uint8
+        return self.out
@@ -0,0 +1,102 @@
+# coding: utf-8
+# Vectorized discounted returns and advantages.
+#
+# Every function takes either a single trajectory of shape (T,) or a batch of
+# trajectories of shape (N, T), and returns an array of the same shape. dones[t]
+# is True if the episode ended at step t, so the return starts again from zero
+# before step t. That is, we compute
+#
+#     R_t = r_t + gamma * (1 - done_t) * R_{t+1},
+#
+# where R_T is the bootstrap value (zero if not given). With the value of the
+# state after the last step as bootstrap, these are the n-step targets A3C
+# trains on.
+#
+# Rather than looping over the steps in python, we use a parallel scan. Write
+# the recurrence as R_t = r_t + a_t R_{t+1}, with a_t = gamma * (1 - done_t).
+# After the k-th pass, R_t holds the sum over the next 2^k steps and a_t the
+# product of their discounts, so combining each step with the one 2^k steps
+# ahead doubles the span. log2(T) passes of whole-array operations then give
+# every return, for all N trajectories at once.
+#
+# Each pass costs a few numpy calls, though, which for a handful of steps take
+# longer than the python loop. So single trajectories of fewer than
+# LOOP_MAX_STEPS steps, such as A3C's 5-step rollouts, use the loop instead.
+# benchmark_returns.py shows where the two cross over, at a few hundred steps.
+import numpy as np
+
+LOOP_MAX_STEPS = 256
+
+# Returns the values as a float (N, T) array, and whether they were a single
+# trajectory.
+def as_batch(values):
+    values = np.asarray(values)
+    single = values.ndim == 1
+    dtype = np.result_type(values.dtype, np.float32)
+    return np.atleast_2d(values).astype(dtype, copy=False), single
+
+# The recurrence one step at a time, for a short single trajectory r.
+def loop_returns(r, gamma, dones=None, bootstrap=None):
+    rewards = r.tolist()
+    dones = [False] * len(rewards) if dones is None else list(dones)
+    returns = [0.0] * len(rewards)
+    R = 0.0 if bootstrap is None else float(bootstrap)
+    for t in range(len(rewards) - 1, -1, -1):
+        if dones[t]:
+            R = 0.0
+        R = rewards[t] + gamma * R
+        returns[t] = R
+    return np.array(returns, dtype=r.dtype)
+
+def discounted_returns(rewards, gamma, dones=None, bootstrap=None):
+    r = np.asarray(rewards)
+    if r.ndim == 1 and len(r) < LOOP_MAX_STEPS:
+        return loop_returns(r.astype(np.result_type(r.dtype, np.float32),
+        copy=False), gamma, dones, bootstrap)
+    r, single = as_batch(r)
+    N, T = r.shape
+    # Put the bootstrap value after the last step, with no discount after it.
+    returns = np.zeros((N, T+1), dtype=r.dtype)
+    returns[:,:T] = r
+    if bootstrap is not None:
+        returns[:,T] = bootstrap
+    discounts = np.full((N, T+1), gamma, dtype=r.dtype)
+    discounts[:,T] = 0
+    if dones is not None:
+        discounts[:,:T] *= 1 - np.atleast_2d(np.asarray(dones)).astype(r.dtype)
+
+    span = 1
+    while span <= T:
+        returns[:,:-span] += discounts[:,:-span] * returns[:,span:]
+        discounts[:,:-span] *= discounts[:,span:]
+        span *= 2
+    return returns[0,:T] if single else returns[:,:T]
+
+# Generalised advantage estimation (Schulman et al. 2015). values[t] is the
+# estimated value of the state at step t, and bootstrap is the estimated value
+# of the state after the last step. Returns the advantages; adding values to
+# them gives the lambda-returns.
+def gae(rewards, values, gamma, lam, dones=None, bootstrap=None):
+    r, single = as_batch(rewards)
+    v = np.atleast_2d(np.asarray(values)).astype(r.dtype, copy=False)
+    next_values = np.empty_like(v)
+    next_values[:,:-1] = v[:,1:]
+    next_values[:,-1] = 0 if bootstrap is None else bootstrap
+    if dones is not None:
+        next_values *= 1 - np.atleast_2d(np.asarray(dones)).astype(r.dtype)
+    deltas = r + gamma * next_values - v
+    return discounted_returns(deltas[0] if single else deltas, gamma * lam,
+    dones)
+
+# Sets the value at each step to the value at the end of its episode, i.e. at
+# the next step t with dones[t] True. Steps after the last done are unchanged.
+def fill_from_episode_end(values, dones):
+    v, single = as_batch(values)
+    d = np.atleast_2d(np.asarray(dones)).astype(bool)
+    T = v.shape[1]
+    steps = np.broadcast_to(np.arange(T), d.shape)
+    next_done = np.where(d, steps, T)
+    next_done = np.minimum.accumulate(next_done[:,::-1], axis=1)[:,::-1]
+    filled = np.where(next_done < T,
+    np.take_along_axis(v, np.minimum(next_done, T-1), axis=1), v)
+    return filled[0] if single else filled
@@ -1,9 +1,15 @@
 # coding: utf-8
 # Given a save path for tensorflow to restore parameters for, run an agent on
-# an OpenAI Gym environment.
-from custom_gym import CustomGym
+# an OpenAI Gym environment. Given a frozen graph from export.py instead, run
+# the agent from that, without building the training graph.
+#
+# With -e, evaluate instead: play that many episodes headlessly, spread over
+# worker processes, and report the scores, lengths and episodes per second.
 from agent import Agent
+from a3c import make_env
+from export import FrozenAgent, restore_checkpoint
 import os, getopt, sys
+import multiprocessing
 import gym
 import tensorflow as tf
 import numpy as np
@@ -11,45 +17,55 @@ from time import time, sleep
 
 # Returns a tensorflow session with the 
 def run_agent(save_path, T, game_name):
+    env = make_env(game_name)
     with tf.Session() as sess:
-        agent = Agent(session=sess, observation_shape=(210,160,3),
-        action_size=3,
+        agent = Agent(session=sess, action_size=env.action_size,
         optimizer=tf.train.AdamOptimizer(1e-4))
+        sess.run(tf.global_variables_initializer())
+        restore_checkpoint(sess, save_path, T)
 
-        # Create a saver, and only keep 2 checkpoints.
-        saver = tf.train.Saver()
-
-        saver.restore(sess, save_path + '-' + str(T))
-
-        play(agent, game_name)
+        play(agent, game_name, env=env)
 
         return sess, agent
 
-def play(agent, game_name, render=True, num_episodes=10, fps=5.0, monitor=True):
-    gym_env = gym.make(game_name)
+# Plays with the frozen graph at path. Only the inference graph is loaded.
+def run_frozen(path, game_name):
+    start_time = time()
+    agent = FrozenAgent(path)
+    print('Loaded', path, 'in', '{:.2f}'.format(time() - start_time),
+    'seconds')
+    play(agent, game_name)
+    agent.close()
+    return agent
+
+# Plays num_episodes episodes of game_name with the agent, which is an Agent or
+# a FrozenAgent. Uses env if given, or else makes a new one.
+def play(agent, game_name, render=True, num_episodes=10, fps=5.0, monitor=True,
+    env=None):
+    if env is None:
+        env = make_env(game_name)
+    gym_env = env.env
     if monitor:
         gym_env.monitor.start('videos/-v0')
-    env = CustomGym(gym_env, game_name)
 
     desired_frame_length = 1.0 / fps
 
     episode_rewards = []
     episode_vals = []
     t = 0
-    for ep in xrange(num_episodes):
+    for ep in range(num_episodes):
         print('Starting episode', ep)
         episode_reward = 0
         state = env.reset()
         terminal = False
         current_time = time()
         while not terminal:
-            policy, value = agent.get_policy_and_value(state)
-            action_idx = np.random.choice(agent.action_size, p=policy)
-            state, reward, terminal, _ = env.step(action_idx)
+            actions, values = agent.act(state)
+            state, reward, terminal, _ = env.step(actions[0])
             if render:
                 env.render()
             t += 1
-            episode_vals.append(value)
+            episode_vals.append(values[0])
             episode_reward += reward
             # Sleep so the frame rate is correct
             next_time = time()
@@ -62,14 +78,98 @@ def play(agent, game_name, render=True, num_episodes=10, fps=5.0, monitor=True):
         gym_env.monitor.close()
     return episode_rewards, episode_vals
 
+# Loads the frozen graph at path if it is given, or else the checkpoint for step
+# T under save_path, in a new graph and session with the given config.
+def load_agent(action_size, path=None, save_path=None, T=None, config=None):
+    if path is not None:
+        return FrozenAgent(path, config=config)
+    graph = tf.Graph()
+    with graph.as_default():
+        sess = tf.Session(graph=graph, config=config)
+        agent = Agent(session=sess, action_size=action_size)
+        sess.run(tf.global_variables_initializer())
+        restore_checkpoint(sess, save_path, T)
+    graph.finalize()
+    return agent
+
+# Plays one episode without rendering or waiting, and returns its score and
+# length. The actions are sampled on the host with rng rather than in the graph
+# (or chosen greedily), so the episode only depends on the seeds of rng and the
+# env.
+def play_episode(agent, env, rng, greedy=False):
+    state = env.reset()
+    score = 0
+    length = 0
+    terminal = False
+    while not terminal:
+        policy = agent.get_policy(state)
+        if greedy:
+            action = np.argmax(policy)
+        else:
+            cumulative = np.cumsum(policy)
+            action = min(np.searchsorted(cumulative,
+            rng.random_sample() * cumulative[-1], side='right'),
+            len(policy) - 1)
+        state, reward, terminal, _ = env.step(action)
+        score += reward
+        length += 1
+    return score, length
+
+# Runs in a worker process. Plays one episode for each seed, seeding the env and
+# the action sampling with it, and returns the (seed, score, length) of each.
+def evaluation_worker(game_name, seeds, path, save_path, T, greedy):
+    env = make_env(game_name)
+    # We get parallelism from the number of workers.
+    config = tf.ConfigProto(intra_op_parallelism_threads=1,
+    inter_op_parallelism_threads=1)
+    agent = load_agent(env.action_size, path, save_path, T, config)
+    results = []
+    for seed in seeds:
+        env.env.seed(seed)
+        score, length = play_episode(agent, env, np.random.RandomState(seed),
+        greedy)
+        results.append((seed, score, length))
+    agent.sess.close()
+    return results
+
+# Plays num_episodes episodes headlessly over num_workers processes, with the
+# frozen graph at path or the checkpoint for step T under save_path. Episode i
+# is seeded with seed + i, so the results don't depend on the number of
+# workers. Returns the scores and lengths of the episodes in order, and the
+# episodes per second of wall-clock time, including starting the workers.
+def evaluate(game_name, num_episodes, num_workers, seed=0, path=None,
+    save_path=None, T=None, greedy=False):
+    seeds = [seed + i for i in range(num_episodes)]
+    num_workers = min(num_workers, num_episodes)
+    start_time = time()
+    # Spawn the workers, so they each start tensorflow afresh.
+    with multiprocessing.get_context('spawn').Pool(num_workers) as pool:
+        results = pool.starmap(evaluation_worker, [(game_name,
+        seeds[i::num_workers], path, save_path, T, greedy)
+        for i in range(num_workers)])
+    episodes_per_second = num_episodes / (time() - start_time)
+    results = sorted(result for worker_results in results
+    for result in worker_results)
+    scores = [score for _, score, _ in results]
+    lengths = [length for _, _, length in results]
+    return scores, lengths, episodes_per_second
+
 def main(argv):
     save_path = None
     T = None
     game_name = None
+    frozen = None
+    num_episodes = None
+    num_workers = multiprocessing.cpu_count()
+    seed = 0
     try:
-        opts, args = getopt.getopt(argv, 'g:s:T:')
+        opts, args = getopt.getopt(argv, 'g:s:T:f:e:p:d:')
     except getopt.GetoptError:
         print('Usage: python run_agent.py -g <game name> -s <save path> -T <T>')
+        print('Or, with a graph from export.py: python run_agent.py -g',
+        '<game name> -f <frozen graph path>')
+        print('To evaluate headlessly, add -e <num episodes> -p <num',
+        'processes> -d <seed>')
     for opt, arg in opts:
         if opt == '-g':
             game_name = arg
@@ -77,9 +177,35 @@ def main(argv):
             save_path = arg
         elif opt == '-T':
             T = arg
+        elif opt == '-f':
+            frozen = arg
+        elif opt == '-e':
+            num_episodes = int(arg)
+        elif opt == '-p':
+            num_workers = int(arg)
+        elif opt == '-d':
+            seed = int(arg)
     if game_name is None:
         print('No game name specified')
         sys.exit()
+    if num_episodes is not None:
+        if frozen is None and (save_path is None or T is None):
+            print('Specify a frozen graph, or a save path and T')
+            sys.exit()
+        print('Evaluating', num_episodes, 'episodes over', num_workers,
+        'processes with seed', seed)
+        scores, lengths, episodes_per_second = evaluate(game_name,
+        num_episodes, num_workers, seed, frozen, save_path, T)
+        print('Scores', scores)
+        print('Lengths', lengths)
+        print('Avg score', np.mean(scores), 'std', np.std(scores),
+        'Avg length', np.mean(lengths))
+        print('Episodes per second', episodes_per_second)
+        return
+    if frozen is not None:
+        print('Running frozen agent from', frozen)
+        run_frozen(frozen, game_name)
+        return
     if save_path is None:
         print('No save path specified')
         sys.exit()
@@ -0,0 +1,156 @@
+# coding: utf-8
+# A parameter store in shared memory, for running the A3C workers as separate
+# processes. Each worker process has its own copy of the Agent graph. Workers
+# copy the shared weights into their graph at the start of each rollout,
+# compute gradients locally, and then apply them to the shared weights.
+#
+# The optimizer is Adam or RMSProp, with its statistics shared by all the
+# workers. As in optimizers.py, the update mode is 'locked' (one lock around
+# each update), 'striped' (one lock per weight) or 'hogwild' (no locking, as in
+# the async paper).
+import multiprocessing
+import numpy as np
+from optimizers import UPDATE_MODES, RMSPROP_DECAY, RMSPROP_EPSILON
+
+class SharedParameterStore:
+    # shapes: a list with the shape of each weight, in the order of
+    # agent.weights. The locks are made with the given multiprocessing context,
+    # which must be the one the workers are started with.
+    def __init__(self, shapes, learning_rate=1e-4, beta1=0.9, beta2=0.999,
+        epsilon=1e-8, optimizer='adam', update_mode='hogwild', context=None):
+        if update_mode not in UPDATE_MODES:
+            raise ValueError('Unknown update mode ' + str(update_mode))
+        if optimizer == 'rmsprop':
+            epsilon = RMSPROP_EPSILON
+        elif optimizer != 'adam':
+            raise ValueError('Unknown optimizer ' + str(optimizer))
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.optimizer = optimizer
+        self.update_mode = update_mode
+
+        # The weights and the optimizer statistics all live in shared memory.
+        # For RMSProp, v is the running mean of the squared gradients and m is
+        # unused.
+        sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.shared_weights = [multiprocessing.RawArray('f', n) for n in sizes]
+        self.shared_m = [multiprocessing.RawArray('f', n) for n in sizes]
+        self.shared_v = [multiprocessing.RawArray('f', n) for n in sizes]
+        self.shared_t = multiprocessing.RawValue('q', 0)
+        self.views = None
+        # As in tensorflow's RMSPropOptimizer, the mean square starts at one,
+        # so the first steps aren't divided by a tiny root mean square.
+        if optimizer == 'rmsprop':
+            for v in self.get_views()['v']:
+                v[...] = 1.0
+
+        context = context or multiprocessing.get_context()
+        if update_mode == 'locked':
+            lock = context.Lock()
+            self.locks = [lock] * len(sizes)
+        elif update_mode == 'striped':
+            self.locks = [context.Lock() for _ in sizes]
+        else:
+            self.locks = None
+
+    # The numpy views can't be sent to another process, so we rebuild them in
+    # each process the first time we need them.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['views'] = None
+        return state
+
+    def get_views(self):
+        if self.views is None:
+            to_array = lambda raw, shape: np.frombuffer(raw,
+            dtype=np.float32).reshape(shape)
+            self.views = {
+                'weights': [to_array(w, s) for w, s in zip(self.shared_weights,
+                self.shapes)],
+                'm': [to_array(m, s) for m, s in zip(self.shared_m,
+                self.shapes)],
+                'v': [to_array(v, s) for v, s in zip(self.shared_v,
+                self.shapes)]}
+        return self.views
+
+    # Returns a copy of the current shared weights.
+    def get_weights(self):
+        return [np.copy(w) for w in self.get_views()['weights']]
+
+    def set_weights(self, values):
+        for w, value in zip(self.get_views()['weights'], values):
+            w[...] = value
+
+    # Returns a copy of the optimizer statistics, as a dictionary from names to
+    # arrays, to checkpoint along with the weights. The workers may be updating
+    # them as we copy, as they may the weights.
+    def get_statistics(self):
+        views = self.get_views()
+        statistics = {'shared/optimizer': np.array(self.optimizer),
+        'shared/t': np.array(self.shared_t.value)}
+        for i in range(len(self.shapes)):
+            statistics['shared/m/' + str(i)] = np.copy(views['m'][i])
+            statistics['shared/v/' + str(i)] = np.copy(views['v'][i])
+        return statistics
+
+    # Sets the optimizer statistics from a checkpoint with the ones
+    # get_statistics returned. Returns False, and leaves them at zero, if the
+    # checkpoint has none for this optimizer.
+    def set_statistics(self, values):
+        if 'shared/optimizer' not in values or \
+            str(values['shared/optimizer']) != self.optimizer:
+            return False
+        views = self.get_views()
+        for i in range(len(self.shapes)):
+            views['m'][i][...] = values['shared/m/' + str(i)]
+            views['v'][i][...] = values['shared/v/' + str(i)]
+        self.shared_t.value = int(values['shared/t'])
+        return True
+
+    # Apply one optimizer step with the given gradients to the shared weights.
+    def apply_gradients(self, grads):
+        views = self.get_views()
+        if self.update_mode == 'locked':
+            with self.locks[0]:
+                self.apply_all(views, grads)
+        else:
+            self.apply_all(views, grads)
+
+    def apply_all(self, views, grads):
+        self.shared_t.value += 1
+        t = self.shared_t.value
+        for i, g in enumerate(grads):
+            if self.update_mode == 'striped':
+                with self.locks[i]:
+                    self.apply_one(views, i, g, t)
+            else:
+                self.apply_one(views, i, g, t)
+
+    def apply_one(self, views, i, g, t):
+        w, m, v = views['weights'][i], views['m'][i], views['v'][i]
+        if self.optimizer == 'rmsprop':
+            v *= RMSPROP_DECAY
+            v += (1.0 - RMSPROP_DECAY) * np.square(g)
+            w -= self.learning_rate * g / np.sqrt(v + self.epsilon)
+        else:
+            lr_t = self.learning_rate * np.sqrt(1.0 - self.beta2**t) / \
+            (1.0 - self.beta1**t)
+            m *= self.beta1
+            m += (1.0 - self.beta1) * g
+            v *= self.beta2
+            v += (1.0 - self.beta2) * np.square(g)
+            w -= lr_t * m / (np.sqrt(v) + self.epsilon)
+
+# Creates a store with the same shapes as the agent's weights, initialised to
+# the agent's current weights.
+def store_from_agent(agent, learning_rate, optimizer='adam',
+    update_mode='hogwild', context=None):
+    weights = agent.get_weights()
+    store = SharedParameterStore([w.shape for w in weights],
+    learning_rate=learning_rate, optimizer=optimizer, update_mode=update_mode,
+    context=context)
+    store.set_weights(weights)
+    return store
@@ -0,0 +1,46 @@
+# coding: utf-8
+# Publishes the agent's weights to a file so that another process, e.g. the
+# evaluator, can pick up the latest ones. We write to a temporary file and then
+# rename it over the snapshot, so readers never see a half-written snapshot.
+#
+# Each publish also bumps a sequence number, kept in a small file next to the
+# snapshot and written after it. Readers compare sequence numbers to find new
+# snapshots, which is much cheaper than loading them, and unlike modification
+# times doesn't miss a snapshot published within the filesystem's timestamp
+# resolution of the last one.
+import os
+import numpy as np
+
+def snapshot_path(save_path):
+    return save_path + '-snapshot.npz'
+
+def sequence_path(path):
+    return path + '.sequence'
+
+# weights is a list of arrays, in the order of agent.weights. The last snapshot
+# of a run is published with final set, so readers know to stop.
+def publish_snapshot(path, weights, T, final=False):
+    sequence = (snapshot_sequence(path) or 0) + 1
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, T=T, final=final, *weights)
+    os.replace(tmp_path, path)
+    tmp_path = sequence_path(path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(str(sequence))
+    os.replace(tmp_path, sequence_path(path))
+
+# Returns the sequence number of the latest snapshot, or None if there isn't
+# one yet.
+def snapshot_sequence(path):
+    try:
+        with open(sequence_path(path)) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+# Returns T, the list of weights, and whether this is the final snapshot.
+def load_snapshot(path):
+    with np.load(path) as snapshot:
+        weights = [snapshot['arr_' + str(i)] for i in
+        range(len(snapshot.files) - 2)]
+        return int(snapshot['T']), weights, bool(snapshot['final'])
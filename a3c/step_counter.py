@@ -0,0 +1,57 @@
+# coding: utf-8
+# A shared global step counter for the asynchronous trainers.
+#
+# Every worker owns one slot that only it ever writes to, so publishing a count
+# needs no lock. Each worker counts steps locally and only publishes its total
+# every publish_every steps. Readers sum the slots, which gives a slightly
+# stale (by at most num_workers * publish_every steps) but cheap snapshot of T.
+#
+# If shared is True, the slots live in shared memory so that the counter can be
+# passed to worker processes as well as threads.
+import multiprocessing
+
+PUBLISH_EVERY = 100
+
+class StepCounter:
+    def __init__(self, num_workers, initial_T=0, publish_every=PUBLISH_EVERY,
+        shared=False):
+        self.initial_T = initial_T
+        self.publish_every = publish_every
+        if shared:
+            self.slots = multiprocessing.RawArray('q', num_workers)
+        else:
+            self.slots = [0] * num_workers
+
+    # Returns the counter for the given worker. Each worker index should only be
+    # handed to one thread.
+    def worker(self, worker_idx):
+        return WorkerStepCounter(self, worker_idx)
+
+    # Returns a snapshot of the global step count.
+    def value(self):
+        return self.initial_T + sum(self.slots)
+
+class WorkerStepCounter:
+    def __init__(self, counter, worker_idx):
+        self.counter = counter
+        self.worker_idx = worker_idx
+        self.local_steps = counter.slots[worker_idx]
+        self.last_published = self.local_steps
+        self.T = counter.value()
+
+    # Count n steps, and return this worker's estimate of the global step
+    # count. The estimate includes all of this worker's own steps, plus the
+    # other workers' steps as of the last time we published.
+    def increment(self, n=1):
+        self.local_steps += n
+        self.T += n
+        if self.local_steps - self.last_published >= self.counter.publish_every:
+            self.publish()
+        return self.T
+
+    # Publish the local count to our slot and refresh the global snapshot.
+    def publish(self):
+        self.counter.slots[self.worker_idx] = self.local_steps
+        self.last_published = self.local_steps
+        self.T = self.counter.value()
+        return self.T
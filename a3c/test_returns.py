@@ -0,0 +1,134 @@
+# Checks the returns module against the python loops it replaced.
+import numpy as np
+from returns import discounted_returns, gae, fill_from_episode_end, \
+LOOP_MAX_STEPS
+
+GAMMA = 0.99
+LAMBDA = 0.95
+
+# The n-step target loop from a3c.async_trainer.
+def loop_n_step_targets(rewards, gamma, bootstrap):
+    targets = []
+    target_value = bootstrap
+    for reward in reversed(rewards):
+        target_value = reward + gamma * target_value
+        targets.append(target_value)
+    targets.reverse()
+    return np.array(targets)
+
+# cartpolepolicygradienttensorflow.discount_rewards and, with dones = rewards
+# != 0, pong-improved.discounted_rewards.
+def loop_discounted_returns(rewards, dones, gamma):
+    returns = np.zeros(np.shape(rewards))
+    running_sum = 0
+    for i in reversed(range(len(rewards))):
+        if dones[i]:
+            running_sum = 0
+        running_sum = running_sum * gamma + rewards[i]
+        returns[i] = running_sum
+    return returns
+
+# pong.propagate_reward_for_point.
+def loop_propagate_reward_for_point(rewards, end_points):
+    rewards = np.array(rewards)
+    i_end_point = 0
+    for i in range(len(rewards)):
+        if i_end_point >= len(end_points):
+            return rewards
+        if i <= end_points[i_end_point]:
+            rewards[i] = rewards[end_points[i_end_point]]
+        else:
+            i_end_point += 1
+    return rewards
+
+def loop_gae(rewards, values, dones, gamma, lam, bootstrap):
+    advantages = np.zeros(len(rewards))
+    advantage = 0
+    next_value = bootstrap
+    for t in reversed(range(len(rewards))):
+        if dones[t]:
+            advantage = 0
+            next_value = 0
+        delta = rewards[t] + gamma * next_value - values[t]
+        advantage = delta + gamma * lam * advantage
+        advantages[t] = advantage
+        next_value = values[t]
+    return advantages
+
+def assert_close(actual, expected, name):
+    error = np.max(np.abs(actual - expected) / (1 + np.abs(expected)))
+    assert error < 1e-5, name + ' differs by ' + str(error)
+
+# Lengths either side of the loop cut-off and of the scan's powers of two.
+LENGTHS = [1, 5, 63, 64, 65, 200, LOOP_MAX_STEPS-1, LOOP_MAX_STEPS, 1000]
+
+def random_trajectory(T, shape=()):
+    rewards = np.random.randn(*(shape + (T,)))
+    values = np.random.randn(*(shape + (T,)))
+    dones = np.random.rand(*(shape + (T,))) < 0.05
+    bootstrap = np.random.randn(*shape)
+    return rewards, values, dones, bootstrap
+
+def test_n_step_targets():
+    np.random.seed(0)
+    for T in LENGTHS:
+        rewards, _, _, bootstrap = random_trajectory(T)
+        assert_close(discounted_returns(rewards, GAMMA, bootstrap=bootstrap),
+        loop_n_step_targets(rewards, GAMMA, bootstrap), 'n-step targets')
+
+def test_discounted_returns():
+    np.random.seed(1)
+    for T in LENGTHS:
+        rewards, _, dones, _ = random_trajectory(T)
+        assert_close(discounted_returns(rewards, GAMMA, dones),
+        loop_discounted_returns(rewards, dones, GAMMA), 'discounted returns')
+
+def test_gae():
+    np.random.seed(2)
+    for T in LENGTHS:
+        rewards, values, dones, bootstrap = random_trajectory(T)
+        assert_close(gae(rewards, values, GAMMA, LAMBDA, dones, bootstrap),
+        loop_gae(rewards, values, dones, GAMMA, LAMBDA, bootstrap), 'gae')
+
+def test_fill_from_episode_end():
+    np.random.seed(3)
+    for T in LENGTHS:
+        rewards = np.random.choice([-1.0, 0.0, 0.0, 0.0, 1.0], T)
+        end_points = [t for t in range(T) if rewards[t] != 0]
+        # The loop skipped the step after each end point, leaving its reward
+        # as it was, so we only compare the other steps.
+        compared = np.ones(T, dtype=bool)
+        compared[[t+1 for t in end_points if t+1 < T]] = False
+        assert_close(fill_from_episode_end(rewards, rewards != 0)[compared],
+        loop_propagate_reward_for_point(rewards, end_points)[compared],
+        'propagate reward for point')
+
+# Each row of a batch is treated as its own trajectory.
+def test_batch_rows():
+    np.random.seed(4)
+    for T in LENGTHS:
+        rewards, values, dones, bootstrap = random_trajectory(T, (4,))
+        returns = discounted_returns(rewards, GAMMA, dones, bootstrap)
+        advantages = gae(rewards, values, GAMMA, LAMBDA, dones, bootstrap)
+        for n in range(4):
+            assert_close(returns[n], discounted_returns(rewards[n], GAMMA,
+            dones[n], bootstrap[n]), 'batch returns')
+            assert_close(advantages[n], loop_gae(rewards[n], values[n],
+            dones[n], GAMMA, LAMBDA, bootstrap[n]), 'batch gae')
+
+def test_dtypes():
+    rewards = np.ones(5, dtype=np.float32)
+    assert discounted_returns(rewards, GAMMA).dtype == np.float32
+    assert discounted_returns(np.ones((2, 300), dtype=np.float32),
+    GAMMA).dtype == np.float32
+    assert discounted_returns([1, 0, 1], GAMMA).dtype == np.float64
+
+# The examples from the tests in cartpolepolicygradienttensorflow.py and
+# pong-improved.py.
+def test_examples():
+    assert (discounted_returns([1,-1,3,1,1,1,2,-5], 0.5, [0,0,1,0,1,0,0,0]) ==
+    np.array([1-0.5+3*0.25, -1+3*0.5, 3, 1+0.5, 1, 1+0.5*2+0.25*-5, 2+0.5*-5,
+    -5])).all()
+    rewards = np.array([1,0,0,1,0])
+    assert (discounted_returns(rewards, 0.5, rewards != 0) ==
+    np.array([1,0.25,0.5,1,0])).all()
@@ -48,8 +48,8 @@ DISCOUNT_FACTOR = 0.5
 VERBOSE_EVERY_STEPS = 100
 
 # Train the agent
-def train(tf_sess, observations, tf_input_layer, tf_output_layer,
-        tf_train_operation, tf_action, tf_target, tf_cost):
+def train(tf_sess, observations, tf_input_layer, tf_next_input_layer,
+        tf_train_operation, tf_action, tf_reward, tf_terminal, tf_cost):
     # Sample a minibatch to train on
     mini_batch = random.sample(observations, MINI_BATCH_SIZE)
 
@@ -57,40 +57,19 @@ def train(tf_sess, observations, tf_input_layer, tf_output_layer,
     actions = [d['action'] for d in mini_batch]
     rewards = [d['reward'] for d in mini_batch]
     next_states = [d['next_state'] for d in mini_batch]
-    expected_q = []
+    terminals = [d['terminal'] for d in mini_batch]
 
-    # Compute Q(s', a'; theta_{i-1}). This is an unbiased estimator for y_i as
-    # in eqn 2 in the DQN paper.
-    next_q = tf_sess.run(tf_output_layer, feed_dict={tf_input_layer : \
-            next_states})
-
-    for i in xrange(len(mini_batch)):
-        if mini_batch[i]['terminal']:
-            # This was a terminal frame
-            expected_q.append(rewards[i])
-        else:
-            expected_q.append(rewards[i] + DISCOUNT_FACTOR * \
-                    np.max(next_q[i]))
-
-    one_hot_actions = compute_one_hot_actions(actions)
-
-    # Learn that these actions in these states lead to this reward
+    # Learn that these actions in these states lead to this reward. The targets
+    # are computed from the next states in the same step.
     _, loss = tf_sess.run([tf_train_operation, tf_cost], feed_dict={
         tf_input_layer: states,
-        tf_action: one_hot_actions,
-        tf_target: expected_q})
+        tf_action: actions,
+        tf_reward: rewards,
+        tf_terminal: terminals,
+        tf_next_input_layer: next_states})
 
     return loss
 
-# Return a one hot vector with a 1 at the index for the action.
-def compute_one_hot_actions(actions):
-    one_hot_actions = []
-    for i in xrange(len(actions)):
-        one_hot = np.zeros([NUM_ACTIONS])
-        one_hot[ACTIONS.index(actions[i])] = 1
-        one_hot_actions.append(one_hot)
-    return one_hot_actions
-
 # Deep Q-learning
 def deep_q_learn(restore_model='',
         checkpoint_path='tensorflow_checkpoints'):
@@ -99,17 +78,30 @@ def deep_q_learn(restore_model='',
     tf_sess = tf.Session()
 
     # Create tensorflow network
-    tf_input_layer, tf_output_layer = create_network()
+    tf_weights = create_weights()
+    tf_input_layer = tf.placeholder('float', [None, 4])
+    tf_output_layer = compute_q_values(tf_input_layer, tf_weights)
 
-    # A one-hot vector specifying the action
-    tf_action = tf.placeholder('float', [None, NUM_ACTIONS])
+    # The index of the action taken in each state
+    tf_action = tf.placeholder(tf.int32, [None])
+
+    tf_reward = tf.placeholder('float', [None])
+    tf_terminal = tf.placeholder(tf.bool, [None])
+    tf_next_input_layer = tf.placeholder('float', [None, 4])
+
+    # Compute Q(s', a'; theta_{i-1}), with the same weights. This is an
+    # unbiased estimator for y_i as in eqn 2 in the DQN paper. It is a
+    # constant as far as training is concerned.
+    tf_next_q = tf.stop_gradient(compute_q_values(tf_next_input_layer,
+    tf_weights))
 
     # The target for Q-learning. This is y_i in eqn 2 of the DQN paper.
-    tf_target = tf.placeholder('float', [None])
+    tf_target = tf_reward + (1.0 - tf.cast(tf_terminal, tf.float32)) * \
+            DISCOUNT_FACTOR * tf.reduce_max(tf_next_q, reduction_indices=1)
 
-    # The q-value for the specified action, where tf_action is a one-hot vector.
-    tf_q_for_action = tf.reduce_sum(tf_output_layer * tf_action,
-    reduction_indices=1)
+    # The q-value for the specified action
+    tf_q_for_action = tf.reduce_sum(tf_output_layer * tf.one_hot(tf_action,
+    NUM_ACTIONS), reduction_indices=1)
 
     # The cost we try to minimise, as in eqn 2 of the DQN paper
     tf_cost = tf.reduce_mean(tf.square(tf_target - tf_q_for_action))
@@ -118,8 +110,18 @@ def deep_q_learn(restore_model='',
     tf_train_operation = \
             tf.train.AdamOptimizer(INITIAL_LEARNING_RATE).minimize(tf_cost)
 
+    # The average of the maximum q-values of a batch of states
+    tf_avg_q_value = tf.reduce_mean(tf.reduce_max(tf_output_layer,
+    reduction_indices=1))
+
     tf_sess.run(tf.initialize_all_variables())
 
+    # Everything the training loop runs has now been built, so an op added from
+    # here on would be added again on every step. Finalizing the graph makes
+    # that an error rather than a slow leak.
+    tf_sess.graph.finalize()
+    print('The graph has', len(tf_sess.graph.as_graph_def().node), 'nodes')
+
     epsilon_greedy = INITIAL_EPSILON_GREEDY
 
     # Give this run of the program an identifier
@@ -171,9 +173,9 @@ def deep_q_learn(restore_model='',
         # Update the current and next states
         next_state = obs
 
-        # Record transitions
+        # Record transitions, with the index of the action
         observations.append({'state': current_state, 'action':
-            action, 'reward': reward, 'next_state': next_state,
+            ACTIONS.index(action), 'reward': reward, 'next_state': next_state,
             'terminal': terminal})
 
         episode_reward += 1
@@ -194,7 +196,7 @@ def deep_q_learn(restore_model='',
         # average q-value
         if (t >= OBSERVATION_STEPS) and (t % VERBOSE_EVERY_STEPS == 0):
             avg_q_value = compute_average_q_value(tf_sess, tf_input_layer,
-                    tf_output_layer, benchmark_states)
+                    tf_avg_q_value, benchmark_states)
             print('Time: {}. Average Q-value: {}'.format(t, avg_q_value))
             avg_q_history.append(avg_q_value)
 
@@ -225,8 +227,9 @@ def deep_q_learn(restore_model='',
 
         # Train if we have reached the number of observation steps
         if (t >= OBSERVATION_STEPS):
-            loss = train(tf_sess, observations, tf_input_layer, tf_output_layer,
-                    tf_train_operation, tf_action, tf_target, tf_cost)
+            loss = train(tf_sess, observations, tf_input_layer,
+                    tf_next_input_layer, tf_train_operation, tf_action,
+                    tf_reward, tf_terminal, tf_cost)
             losses.append(loss)
     
         # Anneal epsilon for epsilon-greedy strategy
@@ -265,40 +268,37 @@ def compute_action(tf_sess, input_layer, output_layer, current_state,
 
 # Compute the average q value for a given set of states. This can be used as an
 # indicator of training progress.
-def compute_average_q_value(tf_sess, tf_input_layer, tf_output_layer, states):
-    # Compute the maximum q-value for each state
-    tf_max_q_values = tf.reduce_max(tf_output_layer, reduction_indices=1)
-
-    # Take the average of the maximum q-values
-    tf_avg_q_values = tf.reduce_mean(tf_max_q_values)
-    
+# tf_avg_q_value is built once, in deep_q_learn.
+def compute_average_q_value(tf_sess, tf_input_layer, tf_avg_q_value, states):
     # Run the computation
-    avg_q_values = tf_sess.run(tf_avg_q_values, feed_dict={tf_input_layer : \
+    avg_q_values = tf_sess.run(tf_avg_q_value, feed_dict={tf_input_layer : \
         states})
 
     return avg_q_values
 
-# Initialise the q network
-def create_network():
-    input_layer = tf.placeholder('float', [None, 4])
-
+# Initialise the weights of the q network
+def create_weights():
     num_hidden_1 = 5
     W1 = tf.Variable(tf.truncated_normal([4, num_hidden_1], stddev=1/np.sqrt(4)))
     b1 = tf.Variable(tf.constant(0.01, shape=[num_hidden_1]))
-    hidden_1 = tf.nn.relu(tf.matmul(input_layer, W1) + b1)
 
     num_hidden_2 = 5
     W2 = tf.Variable(tf.truncated_normal([num_hidden_1, num_hidden_2],
         stddev=1/np.sqrt(num_hidden_1)))
     b2 = tf.Variable(tf.constant(0.01, shape=[num_hidden_2]))
-    hidden_2 = tf.nn.relu(tf.matmul(hidden_1, W2) + b2)
 
     W3 = tf.Variable(tf.truncated_normal([num_hidden_2, NUM_ACTIONS],
         stddev=1/np.sqrt(num_hidden_2)))
     b3 = tf.Variable(tf.constant(0.01, shape=[NUM_ACTIONS]))
-    output_layer = tf.matmul(hidden_2, W3) + b3
 
-    return input_layer, output_layer
+    return W1, b1, W2, b2, W3, b3
+
+# Compute the q values of a batch of states with the given weights
+def compute_q_values(input_layer, weights):
+    W1, b1, W2, b2, W3, b3 = weights
+    hidden_1 = tf.nn.relu(tf.matmul(input_layer, W1) + b1)
+    hidden_2 = tf.nn.relu(tf.matmul(hidden_1, W2) + b2)
+    return tf.matmul(hidden_2, W3) + b3
 
 if __name__ == '__main__':
     # Run deep q learning
@@ -7,6 +7,7 @@ import numpy as np
 import tensorflow as tf
 import random
 import gym
+from returns import discounted_returns
 
 NUM_ACTIONS = 2
 NUM_INPUT = 4
@@ -153,15 +154,8 @@ def compute_one_hot_actions(actions):
 # Compute discounted rewards. The array terminal contains True/False values, and
 # indicates if the frame is terminal
 def discount_rewards(rewards, terminal, discount_factor):
-    discounted_rewards = np.zeros_like(rewards).astype('float32')
-
-    running_sum = 0
-    for i in reversed(range(len(rewards))):
-        if terminal[i]:
-            running_sum = 0
-        running_sum = running_sum * discount_factor + rewards[i]
-        discounted_rewards[i] = running_sum
-    return discounted_rewards
+    return discounted_returns(rewards, discount_factor,
+    terminal).astype('float32')
 
 def test_discount_rewards():
     actual = discount_rewards([1,-1,3,1,1,1,2,-5], [0,0,1,0,1,0,0,0], 0.5)
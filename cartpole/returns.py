@@ -0,0 +1 @@
+../a3c/returns.py
\ No newline at end of file
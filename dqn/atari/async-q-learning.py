@@ -32,10 +32,12 @@ import tensorflow as tf
 import numpy as np
 from time import sleep
 import gym
-import Queue
 import custom_gridworld as custom
 from gym_wrap import GymWrapper
 import random
+from step_counter import StepCounter
+from phase_timer import PhaseTimers
+from metrics import SummaryWriter
 
 random.seed(100)
 
@@ -59,6 +61,10 @@ EPSILON_STEPS = 4000000
 I_TARGET = 40000
 I_ASYNC_UPDATE = 5
 
+# The phases of a step we time. 'targets' is the time spent computing the
+# targets with the target network, and 'counter' on the shared step counter.
+PHASES = ['env', 'preprocess', 'inference', 'targets', 'gradients', 'counter']
+
 training_finished = False
 
 class Agent():
@@ -120,39 +126,18 @@ class Agent():
         q_vals = model(state)
         return model, state, q_vals
 
-class Summary:
-    def __init__(self, logdir, agent):
-        with tf.variable_scope('summary'):
-            summarising = ['episode_avg_reward', 'avg_q_value']
-            self.agent = agent
-            self.writer = tf.summary.FileWriter(logdir, self.agent.sess.graph)
-            self.summary_ops = {}
-            self.summary_vars = {}
-            self.summary_ph = {}
-            for s in summarising:
-                self.summary_vars[s] = tf.Variable(0.0)
-                self.summary_ph[s] = tf.placeholder('float32', name=s)
-                self.summary_ops[s] = tf.summary.scalar(s, self.summary_vars[s])
-            self.update_ops = []
-            for k in self.summary_vars:
-                self.update_ops.append(self.summary_vars[k].assign(self.summary_ph[k]))
-            self.summary_op = tf.summary.merge(list(self.summary_ops.values()))
-            
-    def write_summary(self, summary, t):
-        self.agent.sess.run(self.update_ops, {self.summary_ph[k]: v for k, v in summary.items()})
-        summary_to_add = self.agent.sess.run(self.summary_op, {self.summary_vars[k]: v for k, v in summary.items()})
-        self.writer.add_summary(summary_to_add, global_step=t)
-        
-
 def get_epsilon(global_step, epsilon_steps, epsilon_min):
     epsilon = 1.0 - float(global_step) / float(epsilon_steps) * (1.0 - epsilon_min)
     return epsilon if epsilon > epsilon_min else epsilon_min
 
-def async_trainer(agent, env, sess, thread_idx, T_queue, summary):
+def async_trainer(agent, env, sess, thread_idx, step_counter, timers, summary):
     print('Training thread', thread_idx)
     # Choose a minimum epsilon once and for all for this agent.
-    Tq = T_queue.get()
-    T_queue.put(Tq+1)
+    worker_counter = step_counter.worker(thread_idx)
+    timer = timers.worker(thread_idx)
+    # The env's total time spent preprocessing, if it keeps one.
+    preprocess_seconds = getattr(env, 'preprocess_seconds', 0.0)
+    Tq = worker_counter.T
     epsilon_min = random.choice(4*[0.1] + 3*[0.01] + 3*[0.5])
     epsilon = get_epsilon(Tq, EPSILON_STEPS, epsilon_min)
 
@@ -160,6 +145,7 @@ def async_trainer(agent, env, sess, thread_idx, T_queue, summary):
     last_target_update = Tq
 
     terminal = True
+    timer.start()
     while Tq < T_MAX:
         batch_states = []
         batch_rewards = []
@@ -168,10 +154,14 @@ def async_trainer(agent, env, sess, thread_idx, T_queue, summary):
         if terminal:
             terminal = False
             state = env.reset()
+            last_preprocess_seconds = preprocess_seconds
+            preprocess_seconds = getattr(env, 'preprocess_seconds', 0.0)
+            timer.lap('env', 'preprocess',
+            preprocess_seconds - last_preprocess_seconds)
 
         while not terminal and len(batch_states) < I_ASYNC_UPDATE:
-            Tq = T_queue.get()
-            T_queue.put(Tq+1)
+            Tq = worker_counter.increment()
+            timer.lap('counter')
             batch_states.append(state)
             
             if random.random() < epsilon:
@@ -179,20 +169,26 @@ def async_trainer(agent, env, sess, thread_idx, T_queue, summary):
             else:
                 q_vals = agent.get_q_vals(state)
                 action_idx = np.argmax(q_vals)
+            timer.lap('inference')
 
             # Take the action
             state, reward, terminal, _ = env.step(action_idx)
+            last_preprocess_seconds = preprocess_seconds
+            preprocess_seconds = getattr(env, 'preprocess_seconds', 0.0)
+            timer.lap('env', 'preprocess',
+            preprocess_seconds - last_preprocess_seconds)
             reward = np.clip(reward, -1, 1)
             
             if not terminal:
-                target_q_vals = agent.get_target_q_vals(state)
                 reward += DISCOUNT_FACTOR * agent.get_target_q_vals(state)
+                timer.lap('targets')
 
             batch_rewards.append(reward)
             batch_actions.append(action_idx)
 
         # Apply asynchronous gradient update
         agent.train(np.vstack(batch_states), batch_actions, batch_rewards)
+        timer.lap('gradients')
 
         # Anneal epsilon
         epsilon = get_epsilon(Tq, EPSILON_STEPS, epsilon_min)
@@ -202,6 +198,7 @@ def async_trainer(agent, env, sess, thread_idx, T_queue, summary):
                 print('Worker', thread_idx, 'T', Tq, 'Updating target')
                 last_target_update = Tq
                 agent.update_target()
+                timer.lap('targets')
 
             if Tq - last_verbose >= VERBOSE_EVERY and terminal:
                 print('Worker', thread_idx, 'T', Tq, 'Evaluating agent')
@@ -211,6 +208,12 @@ def async_trainer(agent, env, sess, thread_idx, T_queue, summary):
                 avg_q = np.mean(episode_qs)
                 print('Avg ep reward', avg_ep_r, 'epsilon', epsilon, 'Average q', avg_q)
                 summary.write_summary({'episode_avg_reward': avg_ep_r, 'avg_q_value': avg_q}, Tq)
+                timing = timers.stats(interval=True)
+                timers.print_stats(timing)
+                timers.write_summary(summary, timing, Tq)
+                # Don't count the evaluation as training time.
+                timer.start()
+    worker_counter.publish()
     global training_finished
     training_finished = True
 
@@ -237,8 +240,8 @@ def qlearn(game_name, nb_threads=8):
         env = GymWrapper(gym_env)
         envs.append(env)
 
-    T_queue = Queue.Queue()
-    T_queue.put(0)
+    step_counter = StepCounter(NUM_THREADS)
+    timers = PhaseTimers(NUM_THREADS, PHASES)
 
     with tf.Session() as sess:
         agent = Agent(session=sess, action_size=envs[0].action_size,
@@ -246,11 +249,11 @@ def qlearn(game_name, nb_threads=8):
         optimizer=tf.train.AdamOptimizer(INITIAL_LEARNING_RATE))
         sess.run(tf.global_variables_initializer())
         
-        summary = Summary('tensorboard', agent)
+        summary = SummaryWriter('tensorboard', sess.graph)
 
         for i in range(NUM_THREADS):
             processes.append(threading.Thread(target=async_trainer, args=(agent,
-            envs[i], sess, i, T_queue, summary,)))
+            envs[i], sess, i, step_counter, timers, summary,)))
         for p in processes:
             p.daemon = True
             p.start()
@@ -260,5 +263,7 @@ def qlearn(game_name, nb_threads=8):
         for p in processes:
             p.join()
 
+        summary.close()
+
 if __name__ == '__main__':
     qlearn('SpaceInvaders-v0')
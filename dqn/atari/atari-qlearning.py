@@ -3,11 +3,19 @@
 # We use q-learning. We approximate the q function with a neural network using
 # tensorflow.
 
+import os
+import threading
 import tensorflow as tf
 import random
 import numpy as np
 import gym
 from collections import deque
+from replay_memory import ReplayMemory
+from prioritized_replay import PrioritizedReplayMemory
+from prefetcher import Prefetcher
+from target_sync import TargetSync
+from checkpoint import CheckpointWriter, checkpoint_path, latest_step, \
+restore_session
 
 import matplotlib.pyplot as plt
 import time
@@ -52,6 +60,19 @@ VERBOSE_EVERY_STEPS = 100
 # Copy the network every 10000 steps
 UPDATE_NETWORK_EVERY = 10000
 
+# If TARGET_UPDATE_RATE is not None, instead of copying the q network, move
+# the target network that fraction of the way towards it after every training
+# step (a soft, or Polyak, update).
+TARGET_UPDATE_RATE = None
+
+# Save the networks to SAVE_PATH-t.npz every CHECKPOINT_EVERY steps, keeping the
+# CHECKPOINTS_TO_KEEP most recent. The replay memory is kept on disk in
+# SAVE_PATH-replay, so a restarted run carries on from the latest checkpoint
+# with the memory it had.
+SAVE_PATH = 'checkpoints/atari-qlearning'
+CHECKPOINT_EVERY = 50000
+CHECKPOINTS_TO_KEEP = 2
+
 # Every RENDER_EVERY episodes, render the agent
 RENDER_EVERY = 100
 RENDER = False
@@ -62,42 +83,52 @@ SKIP_FRAMES = 4
 # Whether or not to make the plots
 MAKE_PLOTS = True
 
-# Train the agent
-def train(sess, q_network, target_network, observations):
-    # Sample a minibatch to train on
-    mini_batch = random.sample(observations, MINI_BATCH_SIZE)
-
-    states = [d['state'] for d in mini_batch]
-    actions = [d['action'] for d in mini_batch]
-    rewards = [d['reward'] for d in mini_batch]
-    next_states = [d['next_state'] for d in mini_batch]
-    terminal = np.array([d['terminal'] for d in mini_batch])
-
-    # Compute Q(s', a'; theta'), where theta' are the parameters for the target
-    # network. This is an unbiased estimator for y_i as in eqn 2 in the DQN
-    # paper.
-    next_q = sess.run(target_network.output_layer, feed_dict={
-        target_network.input_layer: next_states
-    })
-    
-    target_q = rewards + np.invert(terminal).astype('float32') * DISCOUNT_FACTOR * np.max(next_q, axis=1)
+# If PRIORITIZED_REPLAY is True, sample the transitions in proportion to their
+# TD errors to the power PRIORITY_ALPHA, and correct for it with importance
+# sampling weights, with an exponent annealed from PRIORITY_BETA to 1 over
+# PRIORITY_BETA_STEPS training steps (Schaul et al. 2015).
+PRIORITIZED_REPLAY = False
+PRIORITY_ALPHA = 0.6
+PRIORITY_BETA = 0.4
+PRIORITY_BETA_STEPS = 10000000
+
+# Sample the minibatches in a background thread, keeping up to PREFETCH_DEPTH
+# of them ready, so the learner doesn't wait for the states to be gathered from
+# the replay memory. With 0, the learner samples each minibatch itself.
+PREFETCH_DEPTH = 2
+
+# Samples a minibatch from the memory, ready to feed, with the states as
+# contiguous arrays. The indices, write counts and importance sampling weights
+# are None unless the memory is prioritized.
+def sample_minibatch(memory):
+    if PRIORITIZED_REPLAY:
+        states, actions, rewards, next_states, terminal, indices, writes, \
+        weights = memory.sample(MINI_BATCH_SIZE)
+    else:
+        states, actions, rewards, next_states, terminal = \
+        memory.sample(MINI_BATCH_SIZE)
+        indices, writes, weights = None, None, None
+
+    return np.ascontiguousarray(states), actions, rewards, \
+    np.ascontiguousarray(next_states), terminal, indices, writes, weights
 
-    one_hot_actions = compute_one_hot_actions(actions)
+# Train the agent on the next minibatch from the prefetcher
+def train(sess, q_network, memory, prefetcher):
+    states, actions, rewards, next_states, terminal, indices, writes, \
+    weights = prefetcher.get()
 
-    # Train the q-network (i.e. the parameters theta).
-    q_network.train(sess, states, one_hot_actions, target_q)
+    # Train the q-network (i.e. the parameters theta). The targets are computed
+    # from the target network in the same step.
+    td_errors = q_network.train(sess, states, actions, rewards, terminal,
+    next_states, weights)
 
-# Return a one hot vector with a 1 at the index for the action.
-def compute_one_hot_actions(actions):
-    one_hot_actions = []
-    for i in xrange(len(actions)):
-        one_hot = np.zeros([NUM_ACTIONS])
-        one_hot[ACTIONS.index(actions[i])] = 1
-        one_hot_actions.append(one_hot)
-    return one_hot_actions
+    # Replay the transitions we got most wrong more often.
+    if PRIORITIZED_REPLAY:
+        with prefetcher.lock:
+            memory.update_priorities(indices, writes, td_errors)
 
 # Deep Q-learning
-def deep_q_learn(game_name='Pong-v0'):
+def deep_q_learn(game_name='Pong-v0', save_path=SAVE_PATH):
 
     # Create tensorflow session
     tf_sess = tf.Session()
@@ -105,13 +136,38 @@ def deep_q_learn(game_name='Pong-v0'):
     # Create tensorflow network
     q_network = NetworkDeepmind('q_network')
     target_network = NetworkDeepmind('target_network')
+    q_network.create_train_operation(target_network)
+    target_sync = TargetSync(q_network.scope, target_network.scope,
+    TARGET_UPDATE_RATE)
 
     tf_sess.run(tf.global_variables_initializer())
-    copy_network_params(tf_sess, q_network, target_network)
-
-    epsilon_greedy = INITIAL_EPSILON_GREEDY
-
-    observations = deque()
+    t = restore(tf_sess, save_path)
+    target_sync.copy(tf_sess)
+
+    # Everything the training loop runs has now been built, so an op added from
+    # here on would be added again on every step. Finalizing the graph makes
+    # that an error rather than a slow leak.
+    tf_sess.graph.finalize()
+    print('The graph has', len(tf_sess.graph.as_graph_def().node), 'nodes')
+
+    epsilon_greedy = compute_epsilon_greedy(t)
+
+    # Stores each frame once, as uint8, on disk, so it is still there when we
+    # restart.
+    if PRIORITIZED_REPLAY:
+        memory = PrioritizedReplayMemory(MEMORY_SIZE, (RESIZED_SCREEN_X,
+        RESIZED_SCREEN_Y), STATE_FRAMES, path=save_path + '-replay',
+        alpha=PRIORITY_ALPHA, beta=compute_priority_beta(t))
+    else:
+        memory = ReplayMemory(MEMORY_SIZE, (RESIZED_SCREEN_X,
+        RESIZED_SCREEN_Y), STATE_FRAMES, path=save_path + '-replay')
+    print('Replay memory has', len(memory), 'transitions')
+    # The prefetcher samples from the memory in its own thread, so we hold
+    # memory_lock whenever we use the memory. It is started once we train.
+    memory_lock = threading.Lock()
+    prefetcher = None
+    checkpointer = CheckpointWriter(save_path, max_to_keep=CHECKPOINTS_TO_KEEP)
+    benchmark_states = None
     actions = []
     avg_q_history = []
     avg_reward_history = []
@@ -138,25 +194,24 @@ def deep_q_learn(game_name='Pong-v0'):
     current_state = compute_state(None, obs)
 
     # Enter loop over number of time steps
-    t = 0
     ep_count = 0
 
     # Set up the last action
     last_action = ACTIONS[0]
     while True:
 
-        # At timestep OBSERVATION_STEPS, we generate some random states to test
-        # the average q value
-        if t == OBSERVATION_STEPS-1:
-            benchmark_observations = random.sample(observations,
-                    BENCHMARK_STATES)
-            benchmark_states = [d['state'] for d in benchmark_observations]
+        # Once we have observed OBSERVATION_STEPS steps, we generate some
+        # random states to test the average q value
+        if benchmark_states is None and len(memory) >= OBSERVATION_STEPS-1:
+            with memory_lock:
+                benchmark_states = memory.sample(BENCHMARK_STATES)[0]
 
         # Copy the network parameters from the q network to the target network
-        # every UPDATE_NETWORK_EVERY timesteps.
-        if (t % UPDATE_NETWORK_EVERY == 0) and t > OBSERVATION_STEPS:
+        # every UPDATE_NETWORK_EVERY timesteps, unless we update it softly.
+        if TARGET_UPDATE_RATE is None and (t % UPDATE_NETWORK_EVERY == 0) and \
+                t > OBSERVATION_STEPS:
             print('Updating target network')
-            copy_network_params(tf_sess, q_network, target_network)
+            target_sync.copy(tf_sess)
 
         # Compute action using the q-network
         if t % SKIP_FRAMES == 0:
@@ -174,22 +229,23 @@ def deep_q_learn(game_name='Pong-v0'):
         # Update the current and next states
         next_state = compute_state(current_state, obs)
 
-        # Record transitions
-        observations.append({'state': current_state, 'action':
-            action, 'reward': reward, 'next_state': next_state,
-            'terminal': terminal})
+        # Record transitions. The memory only needs the newest frame of the
+        # state, as it rebuilds the states from the frames before it.
+        with memory_lock:
+            memory.add(current_state[:,:,-1], ACTIONS.index(action), reward,
+            terminal)
 
         # Compute average reward
         reward_history.append(reward)
         if len(reward_history) > REWARD_MEMORY:
             reward_history.popleft()
 
-        if t < OBSERVATION_STEPS and t % 1000 == 0:
+        if len(memory) < OBSERVATION_STEPS and t % 1000 == 0:
             print('Observing', t, '/', OBSERVATION_STEPS)
 
         # Compute the average q-value, and display the average reward and
         # average q-value
-        if (t >= OBSERVATION_STEPS) and (t % VERBOSE_EVERY_STEPS == 0):
+        if (len(memory) >= OBSERVATION_STEPS) and (t % VERBOSE_EVERY_STEPS == 0):
             avg_q_value = compute_average_q_value(tf_sess, q_network, benchmark_states)
             avg_q_value_target = compute_average_q_value(tf_sess, target_network, benchmark_states)
             print('Time: {}. Average Q-value: {}. Average Q-value of target: {}'.format(t, avg_q_value, avg_q_value_target))
@@ -200,6 +256,9 @@ def deep_q_learn(game_name='Pong-v0'):
 
             print('Epsilon: {}'.format(epsilon_greedy))
 
+            if prefetcher is not None:
+                prefetcher.print_stats()
+
             # Plot the data, but don't show it
             plot_data = np.append(np.array(avg_q_history)[:,np.newaxis],
                     np.array(avg_reward_history)[:,np.newaxis], axis=1)
@@ -214,17 +273,22 @@ def deep_q_learn(game_name='Pong-v0'):
                 ax1.plot(avg_q_history)
                 plt.pause(0.0001) 
 
-        # Ensure we don't go over our memory size
-        if len(observations) > MEMORY_SIZE:
-            observations.popleft()
-
         # Train the target network if we have reached the number of 
-        # observation steps
-        if (t >= OBSERVATION_STEPS):
-            train(tf_sess, q_network, target_network, observations)
+        # observation steps. A restored memory may already have them.
+        if (len(memory) >= OBSERVATION_STEPS):
+            if prefetcher is None:
+                prefetcher = Prefetcher(lambda: sample_minibatch(memory),
+                PREFETCH_DEPTH, memory_lock)
+            if PRIORITIZED_REPLAY:
+                # Minibatches already in the queue keep the beta they were
+                # sampled with.
+                memory.beta = compute_priority_beta(t)
+            train(tf_sess, q_network, memory, prefetcher)
+            if TARGET_UPDATE_RATE is not None:
+                target_sync.update(tf_sess)
     
         # Anneal epsilon for epsilon-greedy strategy
-        if epsilon_greedy > FINAL_EPSILON_GREEDY and len(observations) > \
+        if epsilon_greedy > FINAL_EPSILON_GREEDY and len(memory) > \
                 OBSERVATION_STEPS:
             epsilon_greedy -= (INITIAL_EPSILON_GREEDY - FINAL_EPSILON_GREEDY) \
                     / EPSILON_GREEDY_STEPS
@@ -242,6 +306,39 @@ def deep_q_learn(game_name='Pong-v0'):
         # Update t
         t += 1
 
+        # Save the networks, and make sure the memory on disk is up to date.
+        if t % CHECKPOINT_EVERY == 0:
+            with memory_lock:
+                memory.flush()
+            print('Saving in', checkpointer.save_session(tf_sess,
+            tf.global_variables(), t))
+
+# Restores the variables from the latest checkpoint under save_path, if there is
+# one, and returns its step, or 0 if there isn't one.
+def restore(sess, save_path):
+    if os.path.dirname(save_path) != '':
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    t = latest_step(save_path)
+    if t is None:
+        return 0
+    print('Restoring from', checkpoint_path(save_path, t))
+    restore_session(sess, tf.global_variables(), checkpoint_path(save_path, t))
+    return t
+
+# Returns epsilon after t steps: it is annealed linearly over
+# EPSILON_GREEDY_STEPS steps once we have observed OBSERVATION_STEPS steps.
+def compute_epsilon_greedy(t):
+    annealed_steps = max(t - OBSERVATION_STEPS, 0)
+    return max(FINAL_EPSILON_GREEDY, INITIAL_EPSILON_GREEDY -
+    annealed_steps * (INITIAL_EPSILON_GREEDY - FINAL_EPSILON_GREEDY) /
+    EPSILON_GREEDY_STEPS)
+
+# Returns the importance sampling exponent after t steps.
+def compute_priority_beta(t):
+    trained_steps = max(t - OBSERVATION_STEPS, 0)
+    return min(1.0, PRIORITY_BETA + trained_steps * (1.0 - PRIORITY_BETA) /
+    PRIORITY_BETA_STEPS)
+
 # If current_state is None then just repeat the observation STATE_FRAMES times.
 # Otherwise, remove the first frame, and append obs to get the new current
 # state.
@@ -256,20 +353,15 @@ def compute_state(current_state, obs):
         state = np.append(current_state[:,:,1:], obs[:,:,np.newaxis], axis=2)
     return state
 
-# Preprocess the observation to remove noise.
+# Preprocess the observation to remove noise. The frame stays uint8, and the
+# network normalises it.
 def preprocess(obs):
-    # Convert to float
-    obs = obs.astype('float32')
-
     # Crop screen and set to grayscale
     obs = obs[34:194,:,0]
 
     # Downsize screen
     obs = obs[::2,::2]
 
-    # Normalise input to 0-1 values
-    obs = obs / 255.0 - 0.5
-
     return obs
 
 # Compute the action predicted by the current parameters of the q network for
@@ -294,19 +386,6 @@ def compute_average_q_value(sess, network, states):
 
     return avg_max_q_values
 
-# Updates the network parameters -- thanks to Denny Britz's code for the idea!
-def copy_network_params(sess, net1, net2):
-    net1_params = [t for t in tf.trainable_variables() if t.name.startswith(net1.scope)]
-    net2_params = [t for t in tf.trainable_variables() if t.name.startswith(net2.scope)]
-    net1_params = sorted(net1_params, key = lambda v : v.name)
-    net2_params = sorted(net2_params, key = lambda v : v.name)
-
-    update_ops = []
-    for net1_v, net2_v in zip(net1_params, net2_params):
-        update_ops.append(net2_v.assign(net1_v))
-
-    sess.run(update_ops)
-
 class NetworkDeepmind():
     def __init__(self, scope):
         self.scope = scope
@@ -314,68 +393,119 @@ class NetworkDeepmind():
             self.create_network()
 
     def create_network(self):
-        conv1_W = tf.Variable(tf.truncated_normal([8, 8, STATE_FRAMES, 32],
+        self.conv1_W = tf.Variable(tf.truncated_normal([8, 8, STATE_FRAMES, 32],
             stddev=0.01))
-        conv1_b = tf.Variable(tf.constant(0.1, shape=[32]))
+        self.conv1_b = tf.Variable(tf.constant(0.1, shape=[32]))
 
-        conv2_W = tf.Variable(tf.truncated_normal([4, 4, 32, 64], stddev=0.1))
-        conv2_b = tf.Variable(tf.constant(0.1, shape=[64]))
+        self.conv2_W = tf.Variable(tf.truncated_normal([4, 4, 32, 64],
+            stddev=0.1))
+        self.conv2_b = tf.Variable(tf.constant(0.1, shape=[64]))
 
-        conv3_W = tf.Variable(tf.truncated_normal([3, 3, 64, 64], stddev=0.1))
-        conv3_b = tf.Variable(tf.constant(0.1, shape=[64]))
+        self.conv3_W = tf.Variable(tf.truncated_normal([3, 3, 64, 64],
+            stddev=0.1))
+        self.conv3_b = tf.Variable(tf.constant(0.1, shape=[64]))
 
-        fc1_W = tf.Variable(tf.truncated_normal([7*7*64, 512], stddev=0.1))
-        fc1_b = tf.Variable(tf.constant(0.1, shape=[512]))
+        self.fc1_W = tf.Variable(tf.truncated_normal([7*7*64, 512], stddev=0.1))
+        self.fc1_b = tf.Variable(tf.constant(0.1, shape=[512]))
         
-        fc2_W = tf.Variable(tf.truncated_normal([512, NUM_ACTIONS], stddev=0.1))
-        fc2_b = tf.Variable(tf.constant(0.1, shape=[NUM_ACTIONS]))
+        self.fc2_W = tf.Variable(tf.truncated_normal([512, NUM_ACTIONS],
+            stddev=0.1))
+        self.fc2_b = tf.Variable(tf.constant(0.1, shape=[NUM_ACTIONS]))
 
-        self.input_layer = tf.placeholder('float', [None, RESIZED_SCREEN_X,
+        # The states are fed as uint8 frames, and converted in the graph.
+        self.input_layer = tf.placeholder(tf.uint8, [None, RESIZED_SCREEN_X,
             RESIZED_SCREEN_Y, STATE_FRAMES])
 
-        conv1 = tf.nn.relu(tf.nn.conv2d(self.input_layer, conv1_W,
-            strides=[1,4,4,1], padding='SAME') + conv1_b) 
+        self.output_layer = self.compute_q_values(self.input_layer)
 
-        conv2 = tf.nn.relu(tf.nn.conv2d(conv1, conv2_W, strides=[1,2,2,1],
-            padding='VALID') + conv2_b)
+    # Builds the q-values of a batch of uint8 states with this network's
+    # weights.
+    def compute_q_values(self, input_layer):
+        inputs = tf.cast(input_layer, tf.float32) / 255.0 - 0.5
 
-        conv3 = tf.nn.relu(tf.nn.conv2d(conv2, conv3_W, strides=[1,1,1,1],
-            padding='VALID') + conv3_b)
+        conv1 = tf.nn.relu(tf.nn.conv2d(inputs, self.conv1_W,
+            strides=[1,4,4,1], padding='SAME') + self.conv1_b) 
 
-        flatten = tf.reshape(conv3, [-1, 7*7*64])
-
-        fc1 = tf.nn.relu(tf.matmul(flatten, fc1_W) + fc1_b)
-
-        self.output_layer = tf.matmul(fc1, fc2_W) + fc2_b
+        conv2 = tf.nn.relu(tf.nn.conv2d(conv1, self.conv2_W, strides=[1,2,2,1],
+            padding='VALID') + self.conv2_b)
 
-        # A one-hot vector specifying the action
-        self.action = tf.placeholder('float', [None, NUM_ACTIONS])
+        conv3 = tf.nn.relu(tf.nn.conv2d(conv2, self.conv3_W, strides=[1,1,1,1],
+            padding='VALID') + self.conv3_b)
 
-        # The target for Q-learning. This is y_i in eqn 2 of the DQN paper.
-        self.target = tf.placeholder('float', [None])
+        flatten = tf.reshape(conv3, [-1, 7*7*64])
 
-        # The q-value for the specified action, where tf_action is a one-hot vector.
-        self.q_for_action = tf.reduce_sum(self.output_layer * self.action,
-                reduction_indices=1)
+        fc1 = tf.nn.relu(tf.matmul(flatten, self.fc1_W) + self.fc1_b)
 
-        # The cost we try to minimise, as in eqn 2 of the DQN paper
-        self.cost = tf.reduce_mean(tf.square(self.target - self.q_for_action))
+        return tf.matmul(fc1, self.fc2_W) + self.fc2_b
 
-        # The train operation: reduce the cost using Adam
-        self.train_operation = \
-                tf.train.RMSPropOptimizer(INITIAL_LEARNING_RATE).minimize(self.cost)
+    # Builds the train operation, which takes whole transitions and computes
+    # their targets from target_network in the graph, so a training step is one
+    # session call.
+    def create_train_operation(self, target_network):
+        with tf.variable_scope(self.scope):
+            # The index of the action taken in each state
+            self.action = tf.placeholder(tf.int32, [None])
+            self.reward = tf.placeholder(tf.float32, [None])
+            self.terminal = tf.placeholder(tf.bool, [None])
+            self.next_input_layer = tf.placeholder(tf.uint8, [None,
+                RESIZED_SCREEN_X, RESIZED_SCREEN_Y, STATE_FRAMES])
+
+            # Compute Q(s', a'; theta'), where theta' are the parameters for
+            # the target network. This is an unbiased estimator for y_i as in
+            # eqn 2 in the DQN paper. It is a constant as far as training is
+            # concerned.
+            next_q = tf.stop_gradient(target_network.compute_q_values(
+                self.next_input_layer))
+            not_terminal = 1.0 - tf.cast(self.terminal, tf.float32)
+            self.target = self.reward + not_terminal * DISCOUNT_FACTOR * \
+                tf.reduce_max(next_q, axis=1)
+
+            # The q-value for the specified action
+            self.q_for_action = tf.reduce_sum(self.output_layer *
+                tf.one_hot(self.action, NUM_ACTIONS), axis=1)
+
+            # The importance sampling weight of each transition, for
+            # prioritized replay. Every transition counts equally if they
+            # aren't fed.
+            self.weights = tf.placeholder_with_default(
+                tf.ones_like(self.reward), [None])
+
+            # The TD error of each transition, which prioritized replay uses
+            # as the priority.
+            self.td_error = self.target - self.q_for_action
+
+            # The cost we try to minimise, as in eqn 2 of the DQN paper
+            self.cost = tf.reduce_mean(self.weights * tf.square(self.td_error))
+
+            # The train operation: reduce the cost using RMSProp, on this
+            # network's weights only.
+            self.train_operation = \
+                    tf.train.RMSPropOptimizer(INITIAL_LEARNING_RATE).minimize(
+                    self.cost, var_list=tf.get_collection(
+                    tf.GraphKeys.TRAINABLE_VARIABLES, self.scope))
 
     def compute_action(self, sess, state):
         q = sess.run(self.output_layer, feed_dict={self.input_layer: [state]})[0]
         action_index = np.argmax(q)
         return ACTIONS[action_index]
 
-    def train(self, sess, states, actions, targets):
-        sess.run(self.train_operation, feed_dict={
+    # Trains on the given transitions, with the actions given by their indices,
+    # weighting their squared errors by weights if given, and returns their TD
+    # errors.
+    def train(self, sess, states, actions, rewards, terminals, next_states,
+        weights=None):
+        feed_dict = {
             self.input_layer: states,
             self.action: actions,
-            self.target: targets
-        })
+            self.reward: rewards,
+            self.terminal: terminals,
+            self.next_input_layer: next_states
+        }
+        if weights is not None:
+            feed_dict[self.weights] = weights
+        _, td_errors = sess.run([self.train_operation, self.td_error],
+        feed_dict=feed_dict)
+        return td_errors
 
 # Evaluate the given agent on the game.
 # Returns:  - the discounted reward averaged across episodes.
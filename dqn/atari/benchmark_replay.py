@@ -0,0 +1,84 @@
+# coding: utf-8
+# Measures the throughput of the prioritized replay memory at a given capacity,
+# 1M by default: how many transitions per second we can sample by priority, how
+# many priorities per second we can update after a training step, and how many
+# transitions per second we can add. The uniform memory is timed alongside.
+#
+# The frames are tiny by default, so the memory fits in RAM at 1M and we time
+# the sampling rather than the copying of the states. Pass -x 80 to time full
+# 80x80 frames as well, if you have the memory for them.
+import sys, getopt
+from time import time
+import numpy as np
+from replay_memory import ReplayMemory
+from prioritized_replay import PrioritizedReplayMemory
+
+# Returns the calls per second.
+def calls_per_second(f, num_calls):
+    start_time = time()
+    for _ in range(num_calls):
+        f()
+    return num_calls / (time() - start_time)
+
+# Fills the memory without adding the transitions one at a time.
+def fill(memory, rng):
+    memory.actions[:] = rng.randint(4, size=memory.capacity)
+    memory.rewards[:] = rng.randn(memory.capacity)
+    memory.terminals[:] = rng.rand(memory.capacity) < 0.001
+    memory.starts[1:] = memory.terminals[:-1]
+    memory.size = memory.capacity
+    memory.index = 0
+    if isinstance(memory, PrioritizedReplayMemory):
+        indices = memory.sample_indices_in_order()
+        memory.tree.update(indices, rng.rand(len(indices)))
+
+def main(argv):
+    capacity = 1000000
+    batch_size = 32
+    frame_size = 1
+    num_calls = 2000
+    try:
+        opts, args = getopt.getopt(argv, 'c:b:x:n:')
+    except getopt.GetoptError:
+        print('Usage: python benchmark_replay.py -c <capacity> -b <batch size>',
+        '-x <frame size> -n <num calls>')
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-c':
+            capacity = int(arg)
+        elif opt == '-b':
+            batch_size = int(arg)
+        elif opt == '-x':
+            frame_size = int(arg)
+        elif opt == '-n':
+            num_calls = int(arg)
+
+    rng = np.random.RandomState(0)
+    frame = np.zeros((frame_size, frame_size), dtype=np.uint8)
+    print('Capacity', capacity, 'batch size', batch_size, 'frames',
+    frame.shape)
+    print('memory       indices/sec  samples/sec  updates/sec  adds/sec')
+    for name, memory in [('uniform', ReplayMemory(capacity, frame.shape)),
+        ('prioritized', PrioritizedReplayMemory(capacity, frame.shape))]:
+        fill(memory, rng)
+        indices_per_second = batch_size * calls_per_second(
+        lambda: memory.sample_indices(batch_size, rng), num_calls)
+        samples_per_second = batch_size * calls_per_second(
+        lambda: memory.sample(batch_size, rng), num_calls)
+        if isinstance(memory, PrioritizedReplayMemory):
+            indices = memory.sample_indices(batch_size, rng)
+            writes = memory.writes[indices]
+            td_errors = rng.randn(batch_size)
+            updates_per_second = batch_size * calls_per_second(
+            lambda: memory.update_priorities(indices, writes, td_errors),
+            num_calls)
+        else:
+            updates_per_second = float('nan')
+        adds_per_second = calls_per_second(lambda: memory.add(frame, 0, 0.0,
+        False), 10 * num_calls)
+        print('{:11s}  {:11.0f}  {:11.0f}  {:11.0f}  {:8.0f}'.format(name,
+        indices_per_second, samples_per_second, updates_per_second,
+        adds_per_second))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1 @@
+../../a3c/checkpoint.py
\ No newline at end of file
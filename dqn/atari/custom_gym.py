@@ -1,7 +1,10 @@
-from scipy.misc import imresize
 import gym
 import numpy as np
 import random
+from time import perf_counter
+from frame_stack import FrameStack
+from preprocessing import AtariPreprocessor
+from frameskip import FrameSkipper
 
 class CustomGym:
     def __init__(self, env, skip_actions=4, nb_frames=4, w=84, h=84):
@@ -13,39 +16,40 @@ class CustomGym:
         self.action_space = [1,2,3] # For space invaders
         self.action_size = len(self.action_space)
 
-        self.state = None
+        # Converts frames to grayscale in [0, 1] and downsamples them to w x h.
+        observation_shape = self.env.observation_space.shape
+        self.preprocessor = AtariPreprocessor(observation_shape[0],
+        observation_shape[1], h, w)
+        self.frames = FrameStack(nb_frames, h, w)
         self.has_lives = hasattr(self.env, 'ale') and hasattr(self.env.ale, 'lives')
+        # Repeats each action skip_actions times. For Atari games, it also
+        # takes the maximum value for each pixel over the last two frames, to
+        # get round sprites flickering (Mnih et al. (2015)).
+        self.frameskip = FrameSkipper(self.env, skip_actions,
+        max_pool=self.has_lives)
+        # The total time spent preprocessing, so that the trainers can time it
+        # separately from the emulator.
+        self.preprocess_seconds = 0.0
 
     def preprocess(self, obs, is_start=False):
-        grayscale = obs.astype('float32').mean(2)
-        s = imresize(grayscale, (self.w, self.h)).astype('float32') * (1.0/255.0)
-        s = s.reshape(1, s.shape[0], s.shape[1], 1)
-        if is_start or self.state is None:
-            self.state = np.repeat(s, self.nb_frames, axis=3)
+        start_time = perf_counter()
+        s = self.preprocessor(obs)
+        # Returns a read-only view of the frame stack, which changes on the
+        # next step. Callers that keep states around need to copy them.
+        if is_start:
+            state = self.frames.reset(s)
         else:
-            self.state = np.append(s, self.state[:,:,:,:self.nb_frames-1], axis=3)
-        return self.state
+            state = self.frames.push(s)
+        self.preprocess_seconds += perf_counter() - start_time
+        return state
 
     def render(self):
         self.env.render()
 
     def reset(self):
-        return self.preprocess(self.env.reset(), is_start=True)
+        return self.preprocess(self.frameskip.reset(), is_start=True)
 
     def step(self, action_idx):
-        if self.has_lives:
-            start_lives = self.env.ale.lives()
         action = self.action_space[action_idx]
-        accum_reward = 0
-        prev_s = None
-        for _ in range(self.skip_actions):
-            s, r, term, info = self.env.step(action)
-            accum_reward += r
-            if term:
-                break
-            prev_s = s
-        # Takes maximum value for each pixel value over the current and previous
-        # frame. Used to get round Atari sprites flickering (Mnih et al. (2015))
-        if self.has_lives and prev_s is not None:
-            s = np.maximum.reduce([s, prev_s])
+        s, accum_reward, term, info = self.frameskip.step(action)
         return self.preprocess(s), accum_reward, term, info
@@ -0,0 +1 @@
+../../a3c/frame_stack.py
\ No newline at end of file
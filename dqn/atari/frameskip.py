@@ -0,0 +1 @@
+../../a3c/frameskip.py
\ No newline at end of file
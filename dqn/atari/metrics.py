@@ -0,0 +1 @@
+../../a3c/metrics.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../a3c/phase_timer.py
\ No newline at end of file
@@ -0,0 +1,71 @@
+# coding: utf-8
+# Samples minibatches in a background thread, so that they are ready to feed
+# when the learner wants them.
+#
+# The thread keeps up to depth minibatches in a queue, and get only dequeues one.
+# Gathering the states of a minibatch from the replay memory is mostly numpy
+# copying, which releases the GIL, so it overlaps with the session calls of the
+# training step. Whoever else changes the memory (adding transitions or
+# updating priorities) must hold lock, which we hold while sampling.
+#
+# We count how often the learner has to wait for a minibatch, and for how long,
+# to see whether the queue is deep enough. With a depth of 0 there is no thread,
+# and get samples the minibatch itself, which counts as waiting for it.
+import threading
+import queue
+from time import time
+
+class Prefetcher:
+    # sample takes no arguments and returns a minibatch.
+    def __init__(self, sample, depth=2, lock=None):
+        self.sample = sample
+        self.depth = depth
+        self.lock = lock if lock is not None else threading.Lock()
+        self.num_batches = 0
+        self.num_stalls = 0
+        self.stall_seconds = 0.0
+        self.stopped = False
+        if depth > 0:
+            self.queue = queue.Queue(maxsize=depth)
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped:
+            with self.lock:
+                batch = self.sample()
+            self.queue.put(batch)
+
+    # Returns the next minibatch, waiting for it if the queue is empty.
+    def get(self):
+        self.num_batches += 1
+        if self.depth > 0:
+            try:
+                return self.queue.get_nowait()
+            except queue.Empty:
+                pass
+        self.num_stalls += 1
+        start_time = time()
+        if self.depth > 0:
+            batch = self.queue.get()
+        else:
+            with self.lock:
+                batch = self.sample()
+        self.stall_seconds += time() - start_time
+        return batch
+
+    # Stops the thread after the minibatch it is sampling.
+    def stop(self):
+        self.stopped = True
+        if self.depth > 0:
+            # Make room, in case the thread is waiting to put a minibatch.
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.thread.join()
+
+    def print_stats(self):
+        print('Prefetcher: the learner waited for {} of {} minibatches, for \
+{:.3f}s in all'.format(self.num_stalls, self.num_batches, self.stall_seconds))
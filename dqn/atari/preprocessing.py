@@ -0,0 +1 @@
+../../a3c/preprocessing.py
\ No newline at end of file
@@ -0,0 +1,154 @@
+# coding: utf-8
+# Prioritized experience replay (Schaul et al. 2015), with proportional
+# priorities kept in a sum tree.
+#
+# The sum tree is a binary tree in one array: the leaves hold the priorities,
+# and each parent the sum of its children, so the root is the total. To sample,
+# we descend from the root, going left or right depending on whether the value
+# is less than the left sum. Sampling and updating a batch of priorities both
+# take log2(capacity) vectorized steps, one per level of the tree.
+import numpy as np
+from replay_memory import ReplayMemory
+
+class SumTree:
+    def __init__(self, capacity):
+        # Round the number of leaves up to a power of two, so every level is
+        # full. The padding leaves have priority zero, so are never sampled.
+        self.num_leaves = 1
+        while self.num_leaves < capacity:
+            self.num_leaves *= 2
+        self.depth = self.num_leaves.bit_length() - 1
+        # Node 1 is the root, and the children of node i are 2i and 2i+1.
+        self.tree = np.zeros(2 * self.num_leaves, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices):
+        return self.tree[self.num_leaves + np.asarray(indices)]
+
+    # Sets the priorities of the leaves at the given indices. If an index is
+    # repeated, the last priority given for it wins. Parents shared by several
+    # of the leaves are updated more than once per level, but always to the
+    # same sum, so we don't need to deduplicate them.
+    def update(self, indices, priorities):
+        nodes = self.num_leaves + np.asarray(indices)
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes //= 2
+            self.tree[nodes] = self.tree[2*nodes] + self.tree[2*nodes + 1]
+
+    # Sets the priority of one leaf. For a few leaves, this is quicker than
+    # update.
+    def set(self, index, priority):
+        node = self.num_leaves + index
+        tree = self.tree
+        tree[node] = priority
+        node //= 2
+        while node >= 1:
+            tree[node] = tree[2*node] + tree[2*node + 1]
+            node //= 2
+
+    # Returns the index of the leaf where each value falls, when the leaves
+    # are laid end to end with lengths equal to their priorities.
+    def find(self, values):
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            # Go right past empty subtrees, even for a value of zero.
+            right = values >= left_sums
+            values -= np.where(right, left_sums, 0.0)
+            nodes = left + right
+        return nodes - self.num_leaves
+
+# A ReplayMemory that samples each transition with probability proportional to
+# its priority, (|TD error| + epsilon)^alpha. New transitions get the largest
+# priority seen so far, so they are replayed at least once.
+#
+# Transitions that can't be sampled, i.e. the newest, which doesn't have its
+# next state yet, and once the memory is full the oldest history_length - 1,
+# which have lost the start of their states, have priority zero.
+#
+# Each slot also counts how many times it has been written, and sample returns
+# the counts with the indices. A slot written since its transition was sampled
+# holds a different transition, so update_priorities leaves it alone.
+class PrioritizedReplayMemory(ReplayMemory):
+    def __init__(self, capacity, frame_shape, history_length=4,
+        dtype=np.uint8, path=None, alpha=0.6, beta=0.4, epsilon=1e-6):
+        ReplayMemory.__init__(self, capacity, frame_shape, history_length,
+        dtype, path)
+        self.alpha = alpha
+        # The importance-sampling exponent sample uses by default. The trainer
+        # anneals it by setting it.
+        self.beta = beta
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.tree = SumTree(capacity)
+        self.writes = np.zeros(capacity, dtype=np.int64)
+        # The priorities aren't kept on disk, so a reopened memory starts with
+        # the same priority for every transition.
+        if self.size > 1:
+            self.tree.update(self.sample_indices_in_order(), self.max_priority)
+
+    # Returns the indices of all the transitions that can be sampled.
+    def sample_indices_in_order(self):
+        if self.size < self.capacity:
+            return np.arange(self.size - 1)
+        return (self.index + np.arange(self.history_length - 1,
+        self.capacity - 1)) % self.capacity
+
+    def add(self, frame, action, reward, terminal):
+        index = self.index
+        ReplayMemory.add(self, frame, action, reward, terminal)
+        self.writes[index] += 1
+        # The previous transition now has its next state, and this one and the
+        # ones whose states start with the frame we overwrote can't be sampled.
+        if self.size > 1:
+            self.tree.set((index - 1) % self.capacity, self.max_priority)
+        self.tree.set(index, 0.0)
+        if self.size == self.capacity:
+            for i in range(1, self.history_length):
+                self.tree.set((index + i) % self.capacity, 0.0)
+
+    # Samples batch_size indices in proportion to their priorities. We split
+    # the total priority into batch_size equal ranges and sample one index from
+    # each, which spreads the batch out over the memory.
+    def sample_indices(self, batch_size, rng=np.random):
+        total = self.tree.total()
+        values = (np.arange(batch_size) + rng.random_sample(batch_size)) * \
+        (total / batch_size)
+        # Keep clear of the end of the last leaf, for rounding errors.
+        values = np.minimum(values, np.nextafter(total, 0))
+        return np.minimum(self.tree.find(values), self.capacity - 1)
+
+    # Returns the importance-sampling weights (N P(i))^-beta of the given
+    # indices, divided by the largest in the batch, so they only scale the
+    # updates down.
+    def importance_weights(self, indices, beta):
+        probabilities = self.tree.get(indices) / self.tree.total()
+        weights = (len(self) * probabilities) ** -beta
+        return (weights / np.max(weights)).astype(np.float32)
+
+    # Returns the states, action indices, rewards, next states and terminals of
+    # batch_size transitions sampled by priority, along with their indices and
+    # write counts, to update their priorities with later, and their
+    # importance-sampling weights.
+    def sample(self, batch_size, rng=np.random, beta=None):
+        indices = self.sample_indices(batch_size, rng)
+        return self.transitions(indices) + (indices, self.writes[indices],
+        self.importance_weights(indices, self.beta if beta is None else beta))
+
+    # Sets the priorities of the transitions at indices from the absolute TD
+    # errors of the last training step on them. writes are the slots' write
+    # counts when the transitions were sampled. The minibatch may have been
+    # sampled a few transitions ago, so we skip the slots that have been
+    # written since, and those that can't be sampled any more keep their
+    # priority of zero.
+    def update_priorities(self, indices, writes, td_errors):
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self.max_priority = max(self.max_priority, np.max(priorities))
+        current = (self.writes[indices] == writes) & \
+        (self.tree.get(indices) > 0)
+        self.tree.update(indices[current], priorities[current])
@@ -0,0 +1,149 @@
+# coding: utf-8
+# A replay memory for DQN that stores each frame once.
+#
+# Consecutive states share all but one of their frames, so rather than storing
+# every state and next state, we store the newest frame of each state, as
+# uint8, in a preallocated circular array, along with the action taken in that
+# state, the reward and whether the episode ended. The state at index i is then
+# the frames at i-history_length+1, ..., i, and the next state is the state at
+# i+1. Frames from before the start of the episode are replaced by its first
+# frame, as when a state is first built by repeating the first frame.
+#
+# Minibatches are sampled with a few numpy gathers over the arrays, so sampling
+# doesn't depend on the size of the memory.
+#
+# If path is given, the arrays are memory-mapped .npy files in that directory,
+# so the memory can be larger than RAM and survives restarts. flush writes the
+# arrays and then the index and size, and a memory that is opened again carries
+# on from the index and size of the last flush. This isn't a snapshot, though:
+# the operating system may write the mapped pages at any time, so after a crash
+# the slots from that index on can hold transitions added after the flush. They
+# are still transitions the agent saw, but states around where they end may mix
+# frames from before and after the flush.
+import os
+import json
+import numpy as np
+
+class ReplayMemory:
+    def __init__(self, capacity, frame_shape, history_length=4,
+        dtype=np.uint8, path=None):
+        self.capacity = capacity
+        self.history_length = history_length
+        self.path = path
+        # The next index to write to, and the number of transitions stored.
+        self.index = 0
+        self.size = 0
+        reopen = path is not None and os.path.exists(self.metadata_path())
+        if reopen:
+            with open(self.metadata_path()) as f:
+                metadata = json.load(f)
+            self.index = metadata['index']
+            self.size = metadata['size']
+        elif path is not None:
+            os.makedirs(path, exist_ok=True)
+
+        self.frames = self.array('frames', (capacity,) + tuple(frame_shape),
+        dtype, reopen)
+        self.actions = self.array('actions', (capacity,), np.int32, reopen)
+        self.rewards = self.array('rewards', (capacity,), np.float32, reopen)
+        self.terminals = self.array('terminals', (capacity,), bool, reopen)
+        # Whether the frame at each index is the first of its episode.
+        self.starts = self.array('starts', (capacity,), bool, reopen)
+        if reopen and self.size > 0:
+            # The episode that was running was cut short, and the next frame
+            # added will start a new one. We don't have the next state of its
+            # last transition, so we treat it as terminal.
+            self.terminals[(self.index - 1) % capacity] = True
+
+    def metadata_path(self):
+        return os.path.join(self.path, 'memory.json')
+
+    # Returns a new array of zeros, or if we have a path, the memory-mapped
+    # array of that name in it, which is created unless reopen is True.
+    def array(self, name, shape, dtype, reopen):
+        if self.path is None:
+            return np.zeros(shape, dtype=dtype)
+        path = os.path.join(self.path, name + '.npy')
+        if not reopen:
+            return np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+            shape=shape)
+        array = np.load(path, mmap_mode='r+')
+        if array.shape != shape or array.dtype != np.dtype(dtype):
+            raise ValueError('The replay memory in ' + self.path + ' has ' +
+            name + ' of shape ' + str(array.shape) + ' and type ' +
+            str(array.dtype) + ', not ' + str(shape) + ' and ' +
+            str(np.dtype(dtype)))
+        return array
+
+    def __len__(self):
+        return self.size
+
+    # Writes the memory-mapped arrays to disk, and then the index and size, so
+    # that opening the memory again carries on from here. Does nothing for a
+    # memory kept in RAM.
+    def flush(self):
+        if self.path is None:
+            return
+        for array in [self.frames, self.actions, self.rewards, self.terminals,
+            self.starts]:
+            array.flush()
+        tmp_path = self.metadata_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'index': self.index, 'size': self.size}, f)
+        os.replace(tmp_path, self.metadata_path())
+
+    # Records taking the action with the given index in the state whose newest
+    # frame is frame, and getting the reward. The next frame added is then the
+    # newest frame of the next state, unless terminal is True, in which case it
+    # starts a new episode.
+    def add(self, frame, action, reward, terminal):
+        previous = (self.index - 1) % self.capacity
+        self.frames[self.index] = frame
+        self.actions[self.index] = action
+        self.rewards[self.index] = reward
+        self.terminals[self.index] = terminal
+        self.starts[self.index] = self.size == 0 or self.terminals[previous]
+        self.index = (self.index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    # Returns the stacked states at the given indices, as an array of shape
+    # (len(indices),) + frame_shape + (history_length,).
+    def states(self, indices):
+        offsets = np.arange(1 - self.history_length, 1)
+        frame_indices = (np.asarray(indices)[:,np.newaxis] + offsets) % \
+        self.capacity
+        # A frame is from an earlier episode if a later frame in the window
+        # starts an episode. Those are replaced by the first frame of the
+        # episode, which is the first one that isn't from an earlier episode.
+        starts = self.starts[frame_indices[:,1:]]
+        earlier = np.zeros(frame_indices.shape, dtype=bool)
+        earlier[:,:-1] = np.cumsum(starts[:,::-1], axis=1)[:,::-1] > 0
+        first = np.take_along_axis(frame_indices,
+        earlier.sum(axis=1)[:,np.newaxis], axis=1)
+        frame_indices = np.where(earlier, first, frame_indices)
+        return np.moveaxis(self.frames[frame_indices], 1, -1)
+
+    # Returns batch_size indices of transitions whose state and next state are
+    # both stored, uniformly at random.
+    def sample_indices(self, batch_size, rng=np.random):
+        if self.size < self.capacity:
+            # The newest transition doesn't have its next state yet.
+            return rng.randint(0, self.size - 1, size=batch_size)
+        # Once the memory is full, the oldest history_length - 1 transitions
+        # are missing the start of their states, and the newest its next state.
+        offsets = rng.randint(self.history_length - 1, self.capacity - 1,
+        size=batch_size)
+        return (self.index + offsets) % self.capacity
+
+    # Returns the states, action indices, rewards, next states and terminals of
+    # batch_size transitions sampled uniformly at random.
+    def sample(self, batch_size, rng=np.random):
+        indices = self.sample_indices(batch_size, rng)
+        return self.transitions(indices)
+
+    # Returns the states, action indices, rewards, next states and terminals of
+    # the transitions at the given indices.
+    def transitions(self, indices):
+        return self.states(indices), self.actions[indices], \
+        self.rewards[indices], self.states((indices + 1) % self.capacity), \
+        self.terminals[indices]
@@ -0,0 +1 @@
+../../a3c/step_counter.py
\ No newline at end of file
@@ -0,0 +1,41 @@
+# coding: utf-8
+# Keeps the variables of a target network in step with those of a source
+# network.
+#
+# The assign ops are built once, when the TargetSync is made, and each sync is
+# one session call that runs them, so syncing doesn't add to the graph however
+# long we train. copy sets the target to the source, for periodic hard updates.
+# update moves the target a fraction tau of the way towards the source, for a
+# soft (Polyak) update after every training step.
+import tensorflow as tf
+
+# Returns the trainable variables under scope, sorted by their names within it.
+def scope_variables(scope):
+    variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope)
+    return sorted(variables, key=lambda v: v.name[len(scope):])
+
+class TargetSync:
+    def __init__(self, source_scope, target_scope, tau=None):
+        source_variables = scope_variables(source_scope)
+        target_variables = scope_variables(target_scope)
+        if len(source_variables) != len(target_variables):
+            raise ValueError(source_scope + ' has ' +
+            str(len(source_variables)) + ' variables, and ' + target_scope +
+            ' has ' + str(len(target_variables)))
+        self.tau = tau
+        with tf.name_scope('target_sync'):
+            self.copy_operation = tf.group(*[target.assign(source) for source,
+            target in zip(source_variables, target_variables)])
+            if tau is not None:
+                self.update_operation = tf.group(*[target.assign_sub(tau *
+                (target - source)) for source, target in zip(source_variables,
+                target_variables)])
+
+    # Sets the target network's variables to the source network's.
+    def copy(self, sess):
+        sess.run(self.copy_operation)
+
+    # Moves the target network's variables a fraction tau of the way to the
+    # source network's.
+    def update(self, sess):
+        sess.run(self.update_operation)
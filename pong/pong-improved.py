@@ -8,6 +8,8 @@ import random
 import gym
 import pickle
 import sys
+from checkpoint import CheckpointWriter
+from returns import discounted_returns
 env = gym.make('Pong-v0')
 
 MOVE_UP = 2
@@ -32,6 +34,9 @@ def train_policy_gradient_agent(num_episodes, batch_size=10, num_hidden=10):
 
     win_history = []
 
+    # Keep every checkpoint of W1, W2.
+    checkpointer = CheckpointWriter('weights/W1W2', max_to_keep=None)
+
     # SGD with Adam
     m1 = np.zeros(np.shape(W1))
     v1 = np.zeros(np.shape(W1))
@@ -77,13 +82,11 @@ def train_policy_gradient_agent(num_episodes, batch_size=10, num_hidden=10):
             pickle.dump(win_history, f)
             f.close()
 
-        # Write W1, W2 to file every 10th batch
+        # Write W1, W2 to file every 10th batch. The file is written in the
+        # background, so we can carry on training straight away.
         if (i_episode % 10) == 0:
-            name = 'weights/W1W2-' + str(i_episode) + '.pkl'
+            name = checkpointer.save(i_episode, {'W1': W1, 'W2': W2})
             print('Writing W1, W2 to ' + name)
-            f = open(name, 'wb')
-            pickle.dump([W1, W2], f)
-            f.close()
 
         # Compute the policy gradient for this trajectory
         print('Computing gradients')
@@ -113,6 +116,9 @@ def train_policy_gradient_agent(num_episodes, batch_size=10, num_hidden=10):
         v2hat = v2 / (1-beta2**adam_t)
         W2 = W2 + adam_eta * m2hat / (np.sqrt(v2hat) + adam_eps)
 
+    # Make sure the last checkpoints have been written
+    checkpointer.wait()
+
     # Return our trained theta
     return W1, W2
 
@@ -196,13 +202,13 @@ def compute_policy_gradient(episode_rewards, episode_actions,
     # Update using the cross entropy loss that labels the action we took as
     # correct.
     dlogits = []
-    for t in xrange(episode_length):
+    for t in range(episode_length):
         dlogits.append((1 - episode_pis[t] if episode_actions[t] == MOVE_UP else
             - episode_pis[t]))
     dlogits = np.array(dlogits).ravel()
 
     dlogits_weighted = dlogits * normalized_rewards
-    for t in xrange(episode_length):
+    for t in range(episode_length):
         sys.stdout.write('Progress: %d%%   \r' % int(100*float(t+1) / \
                 float(episode_length)) )
         sys.stdout.flush()
@@ -227,13 +233,8 @@ def normalize_rewards(rewards):
 # discount * R_{t+2} + ... . But also break up the sequence into distinct
 # points, so we start again with the discount when we reach the end of a point.
 def discounted_rewards(rewards, discount):
-    discounted_rewards = np.zeros(np.shape(rewards))
-    running_total = 0
-    for t in reversed(range(0, len(rewards))):
-        if rewards[t] != 0: running_total = 0
-        running_total = running_total * discount + rewards[t]
-        discounted_rewards[t] = running_total
-    return discounted_rewards
+    rewards = np.asarray(rewards)
+    return discounted_returns(rewards, discount, rewards != 0)
 
 # Run an episode with the policy parametrised by theta.
 # - theta: the parameter to use for the policy
@@ -309,8 +310,8 @@ def compute_state(curr_obs, prev_obs):
 def numerical_gradient(state, W1, W2, eps):
     state = np.reshape(state, (-1, 1))
     grad_W1 = np.zeros(np.shape(W1))
-    for i in xrange(np.shape(W1)[0]):
-        for j in xrange(np.shape(W1)[1]):
+    for i in range(np.shape(W1)[0]):
+        for j in range(np.shape(W1)[1]):
             W1_plus = np.copy(W1)
             W1_plus[i,j] += eps
             W1_minus = np.copy(W1)
@@ -319,8 +320,8 @@ def numerical_gradient(state, W1, W2, eps):
                     policy_forward(state, W1_minus, W2)[-1]) / (2*eps)
 
     grad_W2 = np.zeros(np.shape(W2))
-    for i in xrange(np.shape(W2)[0]):
-        for j in xrange(np.shape(W2)[1]):
+    for i in range(np.shape(W2)[0]):
+        for j in range(np.shape(W2)[1]):
             W2_plus = np.copy(W2)
             W2_plus[i,j] += eps
             W2_minus = np.copy(W2)
@@ -345,7 +346,7 @@ def test_gradient(eps, num_input=100, num_hidden=6, num_tests=10):
     max_relative_error_W1 = 0
     max_relative_error_W2 = 0
 
-    for i in xrange(num_tests):
+    for i in range(num_tests):
         state = np.random.randn(num_input, 1)
         W1 = np.random.randn(num_hidden, num_input) * 0.1
         W2 = np.random.randn(1, num_hidden) * 0.1
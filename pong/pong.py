@@ -8,6 +8,8 @@ import gym
 import matplotlib.pyplot as plt
 import pickle
 import sys
+from checkpoint import CheckpointWriter
+from returns import fill_from_episode_end
 env = gym.make('Pong-v0')
 
 MOVE_UP = 2
@@ -34,6 +36,10 @@ def train_policy_gradient_agent(num_episodes, max_episode_length,
     W2 = initialise_weights(num_hidden, 1)
 
     win_history = []
+
+    # Keep every checkpoint of W1, W2.
+    checkpointer = CheckpointWriter('weights/W1W2', max_to_keep=None)
+
     if plot:
         plt.ion()
         fig = plt.figure()
@@ -89,13 +95,11 @@ def train_policy_gradient_agent(num_episodes, max_episode_length,
             pickle.dump(win_history, f)
             f.close()
 
-        # Write W1, W2 to file every 10th batch
+        # Write W1, W2 to file every 10th batch. The file is written in the
+        # background, so we can carry on training straight away.
         if (i_episode % 10) == 0:
-            name = 'weights/W1W2-' + str(i_episode) + '.pkl'
+            name = checkpointer.save(i_episode, {'W1': W1, 'W2': W2})
             print('Writing W1, W2 to ' + name)
-            f = open(name, 'wb')
-            pickle.dump([W1, W2], f)
-            f.close()
 
         if plot:
             ax1.clear()
@@ -145,6 +149,9 @@ def train_policy_gradient_agent(num_episodes, max_episode_length,
         v2hat = v2 / (1-beta2**adam_t)
         W2 = W2 + adam_eta * m2hat / (np.sqrt(v2hat) + adam_eps)
 
+    # Make sure the last checkpoints have been written
+    checkpointer.wait()
+
     # Return our trained theta
     return W1, W2
 
@@ -218,7 +225,7 @@ def compute_policy_gradient_one_step(state, W1, W2):
 
     # The (i,j,k) entry of dfc1_dW1 is d(fc1)_i / d(W1)_jk.
     dfc1_dW1 = np.zeros((np.shape(fc1)[0], np.shape(W1)[0], np.shape(W1)[1]))
-    for i in xrange(np.shape(fc1)[0]):
+    for i in range(np.shape(fc1)[0]):
         dfc1_dW1[i,i,:] = np.transpose(state)
     dpi_dW1 = np.tensordot(dpi_dfc1, dfc1_dW1, axes=(0,0))
     dpi_dW1 = np.reshape(dpi_dW1, np.shape(W1))
@@ -242,12 +249,11 @@ def compute_policy_gradient(episode_rewards, episode_actions,
 
     # Normalizes the positive and negative rewards
     normalized_rewards = normalize_rewards(episode_rewards)
-    end_points = [t for t in xrange(len(episode_rewards)) if \
-            episode_rewards[t]  != 0]
-    normalized_rewards = propagate_reward_for_point(normalized_rewards,
-            end_points)
+    # Every step of a point gets the reward for the point
+    end_points = np.array(episode_rewards) != 0
+    normalized_rewards = fill_from_episode_end(normalized_rewards, end_points)
 
-    for t in xrange(episode_length):
+    for t in range(episode_length):
         sys.stdout.write('Progress: %d%%   \r' % int(100*float(t+1) / \
                 float(episode_length)) )
         sys.stdout.flush()
@@ -286,26 +292,9 @@ def normalize_rewards(rewards):
     #    rewards[rewards!=0] /= np.std(rewards[rewards!=0])
     return rewards
     
-# Given end points for each point, copy the reward for the point back to all
-# timesteps in the point
-def propagate_reward_for_point(rewards, end_points):
-    i_end_point = 0
-    for i in xrange(len(rewards)):
-        # If no more end points, then return
-        if i_end_point >= len(end_points):
-            return rewards
-        # If we have not reached the end of the point, set the reward as the
-        # reward for the point
-        if i <= end_points[i_end_point]:
-            rewards[i] = rewards[end_points[i_end_point]]
-        # Otherwise, we increment the end point
-        else:
-            i_end_point += 1
-    return rewards
-
 def discounted_reward(rewards, discount):
     reward = 0
-    for i in xrange(len(rewards)):
+    for i in range(len(rewards)):
         reward += rewards[i] * discount
         discount *= discount
     return reward
@@ -314,7 +303,7 @@ def discounted_reward(rewards, discount):
 # the current point. This is then next nonzero element, if it exists, and
 # otherwise zero.
 def reward_for_this_point(rewards):
-    for i in xrange(len(rewards)):
+    for i in range(len(rewards)):
         if rewards[i] != 0:
             if rewards[i] == 1:
                 return 1
@@ -336,7 +325,7 @@ def run_episode(W1, W2, max_episode_length, render=False):
     episode_states = []
     
     prev_obs = None
-    for t in xrange(max_episode_length):
+    for t in range(max_episode_length):
         episode_observations.append(observation)
         # If rendering, draw the environment
         if render:
@@ -390,8 +379,8 @@ def compute_state(curr_obs, prev_obs):
 def numerical_gradient(state, W1, W2, eps):
     state = np.reshape(state, (-1, 1))
     grad_W1 = np.zeros(np.shape(W1))
-    for i in xrange(np.shape(W1)[0]):
-        for j in xrange(np.shape(W1)[1]):
+    for i in range(np.shape(W1)[0]):
+        for j in range(np.shape(W1)[1]):
             W1_plus = np.copy(W1)
             W1_plus[i,j] += eps
             W1_minus = np.copy(W1)
@@ -400,8 +389,8 @@ def numerical_gradient(state, W1, W2, eps):
                     policy_forward(state, W1_minus, W2)[-1]) / (2*eps)
 
     grad_W2 = np.zeros(np.shape(W2))
-    for i in xrange(np.shape(W2)[0]):
-        for j in xrange(np.shape(W2)[1]):
+    for i in range(np.shape(W2)[0]):
+        for j in range(np.shape(W2)[1]):
             W2_plus = np.copy(W2)
             W2_plus[i,j] += eps
             W2_minus = np.copy(W2)
@@ -424,7 +413,7 @@ def test_gradient(eps, num_input=100, num_hidden=6, num_tests=10):
     max_relative_error_W1 = 0
     max_relative_error_W2 = 0
 
-    for i in xrange(num_tests):
+    for i in range(num_tests):
         state = np.random.randn(num_input, 1)
         W1 = np.random.randn(num_hidden, num_input) * 0.1
         W2 = np.random.randn(1, num_hidden) * 0.1
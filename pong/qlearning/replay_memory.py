@@ -0,0 +1 @@
+../../dqn/atari/replay_memory.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../dqn/atari/target_sync.py
\ No newline at end of file